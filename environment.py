@@ -15,6 +15,7 @@ class TopCombEnv:
     # Other paths
     workdir: str = f"{mainpath}/workdirs/" 
     measurements_path: str = f"{mainpath}/measurements/"
+    cache_dir: str = f"{mainpath}/.cache/"
 
     # Configurations related to Generation 
     genproductions: str = f"{mainpath}/genproductions_scripts"
@@ -1,11 +1,11 @@
 import json
+import hashlib
 import ROOT
 import os
 import numpy as np
 import pandas as pd
 import python.plotting as plot
-from eftanalysis import EFTAnalysis
-from python.tools import Matrix
+from python.tools import Matrix, MergeLists
 from collections import OrderedDict
 from argparse import ArgumentParser
 
@@ -24,7 +24,28 @@ wilson_coeffs = ['cw','cg',                                    # 3 gauge boson
     'cju1','cju8','cjd1','cjd8','cjj11','cjj18','cjj31',       # 4 quark (light)
     'cjj38','cdd1','cdd8','cud1','cud8','cuu1','cuu8']         # 4 quark (light)
 
-def calculateContributions(eftanalysis, channel_groups=None, min_eigval=0., POIs=None, sort_poi=False, external_info=None, external_rotation=None):
+# results of calculateContributions, keyed on the hashes of the input matrices
+_contributions_cache = dict()
+
+def stackMatrices(matrices, pars):
+    # (nmatrices, npars, npars) array of the matrices expressed on the labels 'pars' (missing entries are 0)
+    lookup = dict((p,i) for i,p in enumerate(pars))
+    res = np.zeros((len(matrices), len(pars), len(pars)))
+    for k,m in enumerate(matrices):
+        keep_x = [x for x in m.xpars if x in lookup]
+        keep_y = [y for y in m.ypars if y in lookup]
+        sub = m.loc[keep_y, keep_x]
+        res[k][np.ix_([lookup[y] for y in keep_y], [lookup[x] for x in keep_x])] = sub.values
+    return res
+
+def contributionsKey(matrices, rotation, POIs, channel_groups):
+    h = hashlib.sha256()
+    for m in matrices + ([rotation] if rotation is not None else []):
+        h.update(m.contentHash().encode())
+    h.update(json.dumps([POIs, [[cg, channel_groups[cg]['channels']] for cg in channel_groups]]).encode())
+    return h.hexdigest()
+
+def calculateContributions(eftanalysis, channel_groups=None, min_eigval=0., POIs=None, sort_poi=False, external_info=None, external_rotation=None, cache_dir=None):
     if channel_groups is None:
         channel_groups = OrderedDict([(ch, {'channels':[ch]}) for ch in eftanalysis.channels])
     info_matrix = eftanalysis.info_matrix
@@ -33,6 +54,7 @@ def calculateContributions(eftanalysis, channel_groups=None, min_eigval=0., POIs
         external_info_matrix = Matrix.fromJSON(external_info_matrix)
         info_matrix = info_matrix + external_info_matrix
 
+    rot = None
     if eftanalysis.basis_rotation is None and external_rotation is None:
         if POIs is None:
             POIs = info_matrix.xpars
@@ -40,7 +62,6 @@ def calculateContributions(eftanalysis, channel_groups=None, min_eigval=0., POIs
             POIs = [p for p in POIs if p in info_matrix.xpars]
     else:
         rot = eftanalysis.basis_rotation if external_rotation is None else Matrix.fromJSON(external_rotation)
-        info_matrix = rot * info_matrix * rot.T
         if POIs is None:
             if rot.eigenvalues is None:
                 POIs = rot.ypars
@@ -53,38 +74,61 @@ def calculateContributions(eftanalysis, channel_groups=None, min_eigval=0., POIs
     if sort_poi:
         POIs = sorted(POIs, key=lambda x: wilson_coeffs.index(x) if x in wilson_coeffs else -1)
 
-    res = OrderedDict([
-        (p, OrderedDict([(cg, 0.) for cg in channel_groups])) 
-        for p in POIs])
-
-    for cg in channel_groups:
-        for ch in channel_groups[cg]['channels']:
-            info = eftanalysis.inputs[ch]['info_matrix']
-            if eftanalysis.basis_rotation is not None or external_rotation is not None:
-                rotation = rot.loc[POIs,:]
-                info = rotation * info * rotation.T
-
-            for p in POIs:
-                if p in info.xpars:
-                    res[p][cg] += info.loc[p,p]
+    # one entry per channel (and the external information), all rotated at once
+    channels = MergeLists([channel_groups[cg]['channels'] for cg in channel_groups], True)
+    columns = list(channel_groups.keys())
+    matrices = [eftanalysis.inputs[ch]['info_matrix'] for ch in channels]
     if external_info is not None:
-        if eftanalysis.basis_rotation is not None or external_rotation is not None:
+        channels = channels + [None]
+        columns = columns + [external_label]
+        matrices = matrices + [external_info_matrix]
+
+    key = contributionsKey(matrices, rot, POIs, channel_groups)
+    cache_file = os.path.join(cache_dir, 'contributions_%s.json' % key) if cache_dir is not None else None
+    if key not in _contributions_cache and cache_file is not None and os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            _contributions_cache[key] = json.load(f)
+    if key in _contributions_cache:
+        diagonals = np.array(_contributions_cache[key])
+    else:
+        if rot is None:
+            stack = stackMatrices(matrices, POIs)
+            diagonals = np.einsum('cpp->cp', stack)
+        else:
             rotation = rot.loc[POIs,:]
-            external_info_matrix = rotation * external_info_matrix * rotation.T
-        for p in POIs:
-            res[p][external_label] = external_info_matrix.loc[p,p] if p in external_info_matrix.xpars else 0.
+            stack = stackMatrices(matrices, rotation.xpars)
+            # diag(R I R^T) of every channel in one contraction
+            diagonals = np.einsum('pi,cij,pj->cp', rotation.values, stack, rotation.values, optimize=True)
+        _contributions_cache[key] = diagonals.tolist()
+        if cache_file is not None:
+            if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+            with open(cache_file, 'w') as f:
+                json.dump(diagonals.tolist(), f)
+
+    # sum the channels of every group
+    groups = np.zeros((len(columns), len(channels)))
+    for ig,cg in enumerate(channel_groups):
+        for ch in channel_groups[cg]['channels']:
+            groups[ig, channels.index(ch)] += 1.
+    if external_info is not None:
+        groups[-1, -1] = 1.
+    contributions = groups @ diagonals
+
+    res = OrderedDict([
+        (p, OrderedDict([(cg, float(contributions[ig, ip])) for ig,cg in enumerate(columns)]))
+        for ip,p in enumerate(POIs)])
 
     return res
 
 
-def makeContributionPlot(eftanalysis, channel_groups=None, min_eigval=0., POIs=None, sort_poi=False, translate_poi=None, external_info=None, external_rotation=None, text_size=1.0, align_labels=False):
+def makeContributionPlot(eftanalysis, channel_groups=None, min_eigval=0., POIs=None, sort_poi=False, translate_poi=None, external_info=None, external_rotation=None, text_size=1.0, align_labels=False, cache_dir=None):
     if channel_groups is None:
         channel_groups = OrderedDict([(ch, {'channels':[ch]}) for ch in eftanalysis.channels])
     for i,cg in enumerate(channel_groups):
         if not 'color' in channel_groups[cg]:
             channel_groups[cg]['color'] = i+2
 
-    res = calculateContributions(eftanalysis, channel_groups, min_eigval, POIs, sort_poi, external_info, external_rotation)
+    res = calculateContributions(eftanalysis, channel_groups, min_eigval, POIs, sort_poi, external_info, external_rotation, cache_dir)
     if external_info is not None:
         external_label, external_info_matrix, external_color = external_info.split(':')
         channel_groups[external_label] = {'color': eval(external_color) if not external_color[0]=='#' else ROOT.TColor.GetColor(external_color)}
@@ -142,8 +186,8 @@ def makeContributionPlot(eftanalysis, channel_groups=None, min_eigval=0., POIs=N
     return h_axes, stack, legend
 
 
-def drawResults(eftanalysis, filepath, channel_groups, min_eigval, POIs=None, sort_poi=False, translate_poi=None, external_info=None, external_rotation=None, text_size=1., align_labels=False, title='#bf{CMS} #it{Preliminary}'):
-    h_axes,stack,legend = makeContributionPlot(eftanalysis, channel_groups, min_eigval, POIs, sort_poi, translate_poi, external_info, external_rotation, text_size, align_labels)
+def drawResults(eftanalysis, filepath, channel_groups, min_eigval, POIs=None, sort_poi=False, translate_poi=None, external_info=None, external_rotation=None, text_size=1., align_labels=False, title='#bf{CMS} #it{Preliminary}', cache_dir=None):
+    h_axes,stack,legend = makeContributionPlot(eftanalysis, channel_groups, min_eigval, POIs, sort_poi, translate_poi, external_info, external_rotation, text_size, align_labels, cache_dir)
     f = 1.5 if filepath[-4:] == '.png' else 1
     c = ROOT.TCanvas('c','c',int(f*1200),int(f*500))
     pads = plot.OnePad()
@@ -162,10 +206,10 @@ def drawResults(eftanalysis, filepath, channel_groups, min_eigval, POIs=None, so
     c.Print(filepath)
 
 
-def printResults(eftanalysis, channel_groups, min_eigval, POIs=None):
+def printResults(eftanalysis, channel_groups, min_eigval, POIs=None, cache_dir=None):
     if channel_groups is None:
         channel_groups = OrderedDict([(ch, {'channels':[ch]}) for ch in eftanalysis.channels])
-    res = calculateContributions(eftanalysis, channel_groups, min_eigval, POIs)
+    res = calculateContributions(eftanalysis, channel_groups, min_eigval, POIs, cache_dir=cache_dir)
     header_str = '\n          {:>12}'.format('unc.') + ' {:>12}'*len(channel_groups.keys())
     header_str = header_str.format(*channel_groups.keys())
     print(header_str)
@@ -182,6 +226,7 @@ def printResults(eftanalysis, channel_groups, min_eigval, POIs=None):
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--input', '-i', help='EFTAnalysis cfg file')
+    parser.add_argument('--cooked', nargs='+', default=None, help='cooked CMS_<measurement>.json files: use their linearized information matrices instead of the EFTAnalysis cfg')
     parser.add_argument('--channels', nargs='+', help='[name1]:[channel1,channel2,..]:[color1]')
     parser.add_argument('--output', '-o', help='output file')
     parser.add_argument('--min-eigval', default=0.04, type=float, help='remove directions with ev<min_eigval')
@@ -192,11 +237,17 @@ if __name__ == '__main__':
     parser.add_argument('--external-info', default=None, help='[name]:[path to information matrix]:[color]')
     parser.add_argument('--external-rotation', help='path to rotation matrix (replaces the one in EFTAnalysis cfg file)')
     parser.add_argument('--align-labels', action='store_true')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None, help='keep the contributions in this folder, keyed on the hashes of the input matrices, so that replotting does not recompute them')
     parser.add_argument('--pub', action='store_true')
     parser.add_argument('--supplementary', action='store_true')
     args = parser.parse_args()
 
-    eftanalysis = EFTAnalysis.fromJSON(args.input, load_data=False)
+    if args.cooked:
+        from python.fisher import FisherAnalysis
+        eftanalysis = FisherAnalysis(args.cooked, args.pois)
+    else:
+        from eftanalysis import EFTAnalysis
+        eftanalysis = EFTAnalysis.fromJSON(args.input, load_data=False)
 
     if args.channels:
         channel_groups = OrderedDict()
@@ -215,9 +266,9 @@ if __name__ == '__main__':
         if not out_dir=='' and not os.path.isdir(out_dir):
             os.makedirs(out_dir)
         title = '#bf{CMS}' if args.pub else '#bf{CMS} #it{Supplementary}' if args.supplementary else '#bf{CMS} #it{Preliminary}'
-        drawResults(eftanalysis, args.output, channel_groups, args.min_eigval, args.pois, args.sort_poi, args.translate, args.external_info, args.external_rotation, args.text_size, args.align_labels, title)
+        drawResults(eftanalysis, args.output, channel_groups, args.min_eigval, args.pois, args.sort_poi, args.translate, args.external_info, args.external_rotation, args.text_size, args.align_labels, title, args.cache_dir)
     else:
-        printResults(eftanalysis, channel_groups, args.min_eigval)
+        printResults(eftanalysis, channel_groups, args.min_eigval, cache_dir=args.cache_dir)
 
 
 
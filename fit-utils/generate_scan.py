@@ -1,9 +1,38 @@
 import json
-import numpy as np 
+import numpy as np
+from argparse import ArgumentParser
+import csv
+
+# Points of the likelihood scan used to fit the quadratic surrogate
+# (get_quadratic.py), written to scan.csv (header with the POIs, then one
+# point per row, the first one being the SM).
+#  - initial design: space-filling (Latin hypercube or Sobol) or normal
+#    samples in a box of +-range_fraction*range around the SM
+#  - refinement (--refine): points along the eigen-directions of the current
+#    Hessian (or basis rotation), more of them along the poorly constrained
+#    ones, at distances where 2*deltaNLL is expected to be up to --max-dnll
+#    (uniformly over the POI ranges along flat or negative directions), always
+#    inside the POI ranges
 
-stuff=json.loads(open( "../extrapoConfigs/full_pois.json").read())
+parser = ArgumentParser()
+parser.add_argument('--pois', default='../extrapoConfigs/full_pois.json', help='JSON file with the POIs and their ranges')
+parser.add_argument('-o', '--output', default='scan.csv')
+parser.add_argument('-n', '--npoints', default=5000, type=int)
+parser.add_argument('--design', default='lhs', choices=['lhs', 'sobol', 'normal'], help="space-filling design, or the original independent normal samples")
+parser.add_argument('--range-fraction', dest='range_fraction', default=0.01, type=float, help='half-width of the scanned box (or width of the normal samples) as a fraction of the POI ranges')
+parser.add_argument('--refine', default=None, help='_hessian.json or _basis_rotation.json of a previous fit: generate points along its weakest eigen-directions instead')
+parser.add_argument('--ndirections', default=None, type=int, help='number of weakest eigen-directions to refine (default: all)')
+parser.add_argument('--max-dnll', dest='max_dnll', default=10., type=float, help='largest expected 2*deltaNLL of the refinement points')
+parser.add_argument('--max-share-ratio', dest='max_share_ratio', default=10., type=float, help='a refinement direction gets at most this many times the points of the best constrained one')
+parser.add_argument('--seed', default=None, type=int)
+args = parser.parse_args()
+
+stuff=json.loads(open( args.pois ).read())
 pois=[p for p in stuff]
-import csv
+rng=np.random.default_rng(args.seed)
+
+lows =np.array([stuff[p]['range'][0] for p in pois], dtype=float)*args.range_fraction
+highs=np.array([stuff[p]['range'][1] for p in pois], dtype=float)*args.range_fraction
 
 
 def get_pois_val_list(poi_val_dict):
@@ -11,15 +40,97 @@ def get_pois_val_list(poi_val_dict):
     for p in poi_val_dict:
         ret[pois.index(p)]=poi_val_dict[p]
     return ret
-npoints=5000
-with open('scan.csv', 'w', newline='') as csvfile:
+
+def latin_hypercube(npoints, ndim):
+    # one point per stratum in every dimension, strata randomly paired
+    strata = np.argsort(rng.random((ndim, npoints)), axis=1).T
+    return (strata + rng.random((npoints, ndim))) / npoints
+
+def sobol(npoints, ndim):
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError("--design sobol requires scipy, use --design lhs otherwise")
+    return qmc.Sobol(d=ndim, scramble=True, seed=rng).random(npoints)
+
+def initial_design(npoints):
+    if args.design == 'normal':
+        # original design: independent normal samples of width range[1]*range_fraction
+        return rng.normal(loc=0, scale=highs, size=(npoints, len(pois)))
+    unit = latin_hypercube(npoints, len(pois)) if args.design == 'lhs' else sobol(npoints, len(pois))
+    return lows + unit*(highs-lows)
+
+def read_directions(filename):
+    # eigenvalues (ascending) and eigenvectors (rows) of a Hessian, or the rows of a basis rotation
+    with open(filename) as f:
+        d = json.load(f)
+    matrix = np.array(d['matrix'], dtype=float)
+    xpars = d['xpars']
+    if 'eigenvalues' in d:
+        eigenvalues, vectors = np.array(d['eigenvalues'], dtype=float), matrix
+    else:
+        eigenvalues, vectors = np.linalg.eigh((matrix+matrix.T)/2.)
+        vectors = vectors.T
+    # express the directions in the POIs of this scan
+    full = np.zeros((len(vectors), len(pois)))
+    for i,p in enumerate(xpars):
+        if p in pois: full[:,pois.index(p)] = vectors[:,i]
+    order = np.argsort(eigenvalues)
+    return eigenvalues[order], full[order]
+
+def range_extent(vectors, sign):
+    # largest t >= 0 such that sign*t*v stays inside the POI ranges, per direction
+    full_lows =np.array([stuff[p]['range'][0] for p in pois], dtype=float)
+    full_highs=np.array([stuff[p]['range'][1] for p in pois], dtype=float)
+    step = sign*vectors
+    limit = np.where(step > 0, full_highs, np.where(step < 0, full_lows, np.inf))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        extent = np.where(step != 0, limit/step, np.inf)
+    return np.clip(np.min(extent, axis=1), 0., None)
+
+def refinement_design(npoints, filename):
+    eigenvalues, vectors = read_directions(filename)
+    keep = np.any(vectors != 0, axis=1)  # directions along POIs of this scan
+    eigenvalues, vectors = eigenvalues[keep], vectors[keep]
+    if args.ndirections is not None:
+        eigenvalues, vectors = eigenvalues[:args.ndirections], vectors[:args.ndirections]
+    # 2*deltaNLL = lambda*t^2 along a direction: the weakest directions are the
+    # least known, so they get more points, spread out to larger distances. The
+    # share of a direction is capped at --max-share-ratio times the share of the
+    # best constrained one, which is also the share of the flat directions.
+    positive = eigenvalues > 0
+    max_share = args.max_share_ratio/np.sqrt(np.max(eigenvalues[positive])) if np.any(positive) else 1.
+    share = np.full(len(eigenvalues), max_share)
+    share[positive] = np.minimum(1./np.sqrt(eigenvalues[positive]), max_share)
+    counts = rng.multinomial(npoints, share/share.sum())
+    direction = np.repeat(np.arange(len(eigenvalues)), counts)
+
+    # the points are drawn inside the POI ranges: up to 2*deltaNLL = --max-dnll,
+    # or uniformly up to the range boundary along the flat directions
+    extent_up, extent_down = range_extent(vectors, 1.)[direction], range_extent(vectors, -1.)[direction]
+    sign = rng.choice([-1., 1.], size=npoints)
+    # one-sided ranges: go to the side that is open
+    sign = np.where(sign > 0, np.where(extent_up > 0, 1., -1.), np.where(extent_down > 0, -1., 1.))
+    extent = np.where(sign > 0, extent_up, extent_down)
+    u = rng.uniform(0., 1., size=npoints)
+    with np.errstate(divide='ignore'):
+        reach = np.sqrt(args.max_dnll/np.where(positive, eigenvalues, 0.))[direction]
+    t = np.where(positive[direction], np.minimum(reach, extent)*np.sqrt(u), extent*u)
+    points = (sign*t)[:,None]*vectors[direction]
+
+    for k in np.flatnonzero(~positive):
+        print(f"Direction {k}: non-positive eigenvalue {eigenvalues[k]:.3g}, {counts[k]} points uniform over the POI ranges")
+    for k in np.argsort(eigenvalues)[:5]:
+        if positive[k]: print(f"Direction {k}: eigenvalue {eigenvalues[k]:.3g}, {counts[k]} points")
+    return points
+
+if args.refine is not None:
+    values = refinement_design(args.npoints, args.refine)
+else:
+    values = initial_design(args.npoints)
+
+with open(args.output, 'w', newline='') as csvfile:
     scanwriter = csv.writer(csvfile, delimiter=',')
     scanwriter.writerow(pois)
     scanwriter.writerow(get_pois_val_list( {} )) # all zeros
-    for i in range(npoints):
-        values=[]
-        for i1,p in enumerate(pois):
-            ranges=stuff[p]['range']
-            values.append( np.random.normal(loc=0, scale=ranges[1]/100.) )
-        
-        scanwriter.writerow( values )
+    scanwriter.writerows( values.tolist() )
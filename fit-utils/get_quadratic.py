@@ -1,341 +1,207 @@
-import torch
-import uproot
 import json
-import math
 import sys 
-from torch.nn import Linear, MSELoss
-from torch.optim import SGD, Adam
-from torch.optim.lr_scheduler import ExponentialLR
-import pandas as pd
 import numpy as np 
 from collections import OrderedDict
+from argparse import ArgumentParser
 import re
 import os
-import csv
-import glob
-import matplotlib.pyplot as plt 
-
-infile=sys.argv[1]
-outdir=sys.argv[2]
-
-pois=[x for x in json.loads(open("/afs/cern.ch/work/s/sesanche/private/TOP_EFT_masterplan/eft-combination-cms/extrapoConfigs/full_pois.json").read())]
+from python.scan_reader import CountEntries, IterateScan, ReadScan
+from python.tools import Matrix
+from python.fisher import do_pca
+
+# Fit of the quadratic surrogate 2*deltaNLL = x^T H x to a likelihood scan.
+# The model is linear in the coefficients of the upper-triangular products
+# x_i*x_j, so it is solved in closed form (weighted least squares); the
+# original gradient-descent fit in torch is kept as --solver adam.
+
+DEFAULT_POIS="/afs/cern.ch/work/s/sesanche/private/TOP_EFT_masterplan/eft-combination-cms/extrapoConfigs/full_pois.json"
+
+parser = ArgumentParser()
+parser.add_argument('infile', help='combine MultiDimFit output with the scan')
+parser.add_argument('outdir', help='where to write the _hessian.json and _basis_rotation.json')
+parser.add_argument('--pois', default=DEFAULT_POIS, help='JSON file with the POIs (keys)')
+parser.add_argument('--solver', default='lstsq', choices=['lstsq', 'adam'], help='closed-form least squares or the original torch fit')
+parser.add_argument('--weighting', default='none', choices=['none', 'relative'], help="'relative': weight every point by 1/(2*deltaNLL)^2")
+parser.add_argument('--chunk-size', dest='chunk_size', default=500000, type=int, help='scans with more points are fitted by accumulating the normal equations chunk by chunk')
+parser.add_argument('--extra-inputs', dest='extra_inputs', nargs='+', default=[], help='more scan files (or glob patterns) to include in the fit, e.g. refinement points')
+parser.add_argument('--workers', default=4, type=int, help='number of scan files read concurrently')
+parser.add_argument('--nepochs', default=10000, type=int, help='number of epochs (adam solver)')
+args = parser.parse_args()
+
+infile=args.infile
+infiles=[infile]+args.extra_inputs
+outdir=args.outdir
+
+pois=[x for x in json.loads(open(args.pois).read())]
 pois_to_remove = []#'cbwre', 'chtbre','clebqre', 'cleqt1re', 'cleqt3re', 'cqb1', 'cqb8', 'cqtqb1re', 'cqtqb8re', 'ctb1', 'ctb8']
 
 #for p in pois_to_remove:
 #    pois.remove( p ) 
 
-class Matrix(pd.DataFrame):
-
-    def __init__(self, matrix, columns=None, index=None, dtype=None, copy=True, eigenvalues=None):
-        if index is None: index=columns
-        # create a pd.DataFrame and add eigenvalues
-        super(Matrix, self).__init__(data=matrix, columns=columns, index=index, dtype=dtype, copy=copy)
-        self.eigenvalues = pd.Series(eigenvalues, index) if eigenvalues is not None else None
-
-    # _constructor: the result of an operation on a Matrix should also be a Matrix
-    @property
-    def _constructor(self):
-        # apply row slicing also to eigenvalues
-        if self.eigenvalues is not None:
-            new_ypars = [y for y in self.ypars if y in self.eigenvalues.index]
-            if len(new_ypars) > 0:
-                self.eigenvalues = self.eigenvalues.loc[new_ypars]
-            else:
-                self.eigenvalues = None
-        return Matrix
-
-    # _metadata: keep the eigenvalues when creating a new object
-    _metadata = ['eigenvalues']
-    
-    @classmethod
-    def fromDict(cls, d):
-        if not 'ypars' in d: d['ypars'] = d['xpars']
-        if not 'eigenvalues' in d: d['eigenvalues'] = None
-        return cls(d['matrix'], d['xpars'], d['ypars'], eigenvalues=d['eigenvalues'])
-
-    @classmethod
-    def fromJSON(cls, filename):
-        with open(filename,'r') as f:
-            d = json.load(f)
-        return cls.fromDict(d)
-
-    @classmethod
-    def fromDataFrame(cls, df, eigenvalues=None):
-        return cls(df.values, df.columns, df.index, eigenvalues=eigenvalues)
-
-    @classmethod
-    def fromTMatrix(cls, tmatrix, columns=None, index=None, eigenvalues=None):
-        N, M = tmatrix.GetNrows(), tmatrix.GetNcols()
-        arr = np.zeros((N,M))
-        for i in range(N):
-            for j in range(M):
-                arr[i][j] = tmatrix[i][j]
-
-        return cls(arr, columns, index, eigenvalues=eigenvalues)
-
-    @classmethod
-    def merge(cls, matrices):
-        if len(matrices) == 0: 
-            return cls(np.zeros((0,0)))
-        else:
-            pdcat = pd.concat((m for m in matrices), sort=False).fillna(0.)
-            return cls(pdcat.values, pdcat.columns, pdcat.index)
-
-    @property
-    def xpars(self): return self.columns.tolist()
-
-    @property
-    def ypars(self): return self.index.tolist()
-
-    @property
-    def matrix(self): return self.values
+# upper-triangular pairs (i <= j), in the order of the fitted coefficients
+triu_rows, triu_cols = np.triu_indices(len(pois))
+
+indices={}
+for count,(i1,i2) in enumerate(zip(triu_rows, triu_cols)):
+    indices[(pois[i1],pois[i2])]=count
+
+def design_matrix(x):
+    # products x_i*x_j (i <= j) of every point
+    return x[:,triu_rows]*x[:,triu_cols]
+
+def point_weights(target, weighting, epsilon=1e-8):
+    if weighting == 'relative':
+        return 1./(target**2+epsilon)
+    return np.ones_like(target)
+
+def hessian_from_coefficients( coefficients ):
+    # x^T H x = sum_i H_ii x_i^2 + sum_{i<j} 2 H_ij x_i x_j
+    hessian = np.zeros((len(pois), len(pois)))
+    hessian[triu_rows, triu_cols] = coefficients
+    off_diagonal = triu_rows != triu_cols
+    hessian[triu_rows[off_diagonal], triu_cols[off_diagonal]] /= 2.
+    hessian = np.triu(hessian) + np.triu(hessian, 1).T
+    return Matrix(hessian, pois, pois)
+
+def read_scan(step_size=None):
+    # (x, 2*deltaNLL) of the points of the scan, keeping quantileExpected > -0.5:
+    # everything at once, or chunk by chunk if step_size is given
+    if step_size is None:
+        yield ReadScan(infiles, pois, max_workers=args.workers)
+    else:
+        yield from IterateScan(infiles, pois, step_size=step_size, max_workers=args.workers)
+
+def solve_lstsq(x, target, weighting):
+    # the design matrix fits in memory: solve directly (SVD based, stable for ill-conditioned scans)
+    sqrt_w = np.sqrt(point_weights(target, weighting))
+    A = design_matrix(x)*sqrt_w[:,None]
+    coefficients, _, rank, _ = np.linalg.lstsq(A, target*sqrt_w, rcond=None)
+    if rank < A.shape[1]:
+        print(f"Warning: the scan only constrains {rank} of the {A.shape[1]} coefficients")
+    return coefficients
+
+def solve_normal_equations(chunks, weighting):
+    # accumulate A^T W A and A^T W y chunk by chunk, then solve the (equilibrated) normal equations
+    nterms = len(triu_rows)
+    normal = np.zeros((nterms, nterms))
+    rhs = np.zeros(nterms)
+    npoints = 0
+    for x, target in chunks:
+        A = design_matrix(x)
+        w = point_weights(target, weighting)
+        normal += A.T @ (A*w[:,None])
+        rhs += A.T @ (w*target)
+        npoints += len(target)
+    print(f"Accumulated the normal equations of {npoints} points")
+    scale = np.sqrt(np.diag(normal))
+    scale[scale == 0] = 1.
+    scaled = normal/np.outer(scale, scale)
+    coefficients, _, rank, _ = np.linalg.lstsq(scaled, rhs/scale, rcond=None)
+    if rank < nterms:
+        print(f"Warning: the scan only constrains {rank} of the {nterms} coefficients")
+    return coefficients/scale
+
+def relative_loss(coefficients, chunks):
+    num, den = 0., 0.
+    for x, target in chunks:
+        num += np.sum((design_matrix(x) @ coefficients - target)**2)
+        den += np.sum(target**2)
+    return num/(den+1e-8)
+
+def fit_adam(x, target, nepochs):
+    # original fit: full-batch gradient descent of the relative MSE in torch
+    import torch
+    import torch.nn as nn
+    from torch.nn import Linear
+    from torch.optim import Adam
+    from torch.optim.lr_scheduler import ExponentialLR
+    import matplotlib.pyplot as plt 
+
+    class QuadraticModel( torch.nn.Module ):
+        def __init__(self, ncoefs):
+            super(QuadraticModel, self).__init__()
+            self.fc1 = Linear( ncoefs, 1, bias=False)
+            self.fc2 = Linear( int((ncoefs*ncoefs-ncoefs)/2+ncoefs), 1, bias=False)
+
+        def forward(self, x):
+            x1 = x.unsqueeze(2)
+            x2 = x.unsqueeze(1)
+            xx = x1 * x2
+            indices = torch.triu_indices(*(xx.shape[1:]))
+            xx_upper = xx[:,indices[0],indices[1]]
+            return  self.fc2(xx_upper)  # self.fc1(x) + 
+
+    class RelativeMSELoss(nn.Module):
+        def __init__(self, epsilon=1e-8):
+            super(RelativeMSELoss, self).__init__()
+            self.epsilon = epsilon
+
+        def forward(self, y_pred, y_true):
+            numerator = torch.sum((y_pred - y_true) ** 2)
+            denominator = torch.sum(y_true ** 2) + self.epsilon
+            return numerator / denominator
+
+    x = torch.Tensor(x)
+    target = torch.Tensor(target)
+    model = QuadraticModel(len(pois))
+    optimizer = Adam(model.parameters(), lr=0.2)
+    scheduler = ExponentialLR(optimizer, gamma=0.9999)
+    rel_mse = RelativeMSELoss()
+
+    for epoch in range(nepochs):
+        optimizer.zero_grad()
+        loss=rel_mse(model(x).flatten(),target.flatten())
+        epoch_loss=loss.data
+        loss.backward()
+        optimizer.step()
+        scheduler.step()
+        if not (epoch%1000):
+            print(f'Epoch: {epoch}. Loss: {epoch_loss}')
+        if not (epoch%5000):
+            hessian = hessian_from_coefficients(model.fc2.weight.detach().numpy()[0])
+            values, vectors = np.linalg.eig(hessian)
+            min_eig = vectors[:,np.argmin(values)]
+            print("Minimum eigenvector", np.min(values), min_eig)
+            print("All eigenvalues", values)
+
+            if "ctG" in pois:
+                index_ctG=pois.index("ctG")
+                N = 1000
+                values = torch.zeros((N, len(pois)))
+                values[:,index_ctG] = torch.linspace(-1,1,steps=N)
+                plt.plot( values.numpy(), model(values).detach().numpy())
+                plt.savefig("plot.png")
+                plt.clf()
+
+    return model.fc2.weight.detach().numpy()[0]
 
-    # matrix multiplication with '*' operator
-    # A * B = A[:,B.x] * B[A.y,:]
-    def __mul__(self, other):
-        if isinstance(other, pd.DataFrame):
-            new_xpars = [x for x in other.index if x in self.columns]
-            return Matrix(np.dot(self.loc[:,new_xpars], other.loc[new_xpars,:]), index=self.index, columns=other.columns)
-        elif isinstance(other, np.ndarray) and other.shape[0] == self.shape[1]:
-            return Matrix(np.dot(self, other), index=self.index, columns=['x%s' % i for i in range(other.shape[1])])
-        elif isinstance(other, float) or isinstance(other, int):
-            return Matrix(other*self.matrix, columns=self.columns, index=self.index)
-        else:
-            return super(Matrix, self).__mul__(self, other)
-    
-    # right multiplication
-    def __rmul__(self, other):
-        if isinstance(other, pd.DataFrame):
-            new_ypars = [y for y in self.index if y in other.columns]
-            return Matrix(np.dot(other.loc[:,new_ypars], self.loc[new_ypars,:]), index=other.index, columns=self.columns)
-        elif isinstance(other, np.ndarray) and other.shape[1] == self.shape[0]:
-            return Matrix(np.dot(other, self), columns=self.columns, index=['y%s' % i for i in range(other.shape[0])])
-        elif isinstance(other, float) or isinstance(other, int):
-            return Matrix(other*self.matrix, columns=self.columns, index=self.index)
-        else:
-            return super(Matrix, self).__rmul__(self, other)
 
-    # addition
-    def __add__(self, other):
-        if isinstance(other, pd.DataFrame):
-            new_xpars = MergeLists([self.xpars, other.columns.tolist()], True)
-            new_ypars = MergeLists([self.ypars, other.index.tolist()], True)
-            return np.add(self.reindex(index=new_ypars,columns=new_xpars,fill_value=0.),
-                other.reindex(index=new_ypars,columns=new_xpars,fill_value=0.))
-        else:
-            return super(Matrix, self).__add__(self, other)
-
-    def triangular(self):
-        if not self.xpars == self.ypars:
-            print('Matrix.triangular(): xpars != ypars')
-            return self
-        else:
-            res = Matrix(np.zeros(self.shape), self.xpars)
-            for i in range(self.shape[0]):
-                res.iloc[i,i] = self.iloc[i,i]
-                for j in range(i):
-                    res.iloc[i,j] = self.iloc[i,j]+self.iloc[j,i]
-            return res
-
-    def symmetric(self):
-        if not self.xpars == self.ypars:
-            print('Matrix.symmetric(): xpars != ypars')
-            return self
-        else:
-            res = Matrix(np.zeros(self.shape), self.xpars)
-            for i in range(self.shape[0]):
-                res.iloc[i,i] = self.iloc[i,i]
-                for j in range(i):
-                    res.iloc[i,j] = (self.iloc[i,j]+self.iloc[j,i])/2.
-                    res.iloc[j,i] = (self.iloc[i,j]+self.iloc[j,i])/2.
-            return res
-
-    
-    def writeToJSON(self, filename):
-        res = OrderedDict()
-        res['xpars'] = self.xpars
-        if self.ypars != self.xpars: res['ypars'] = self.ypars
-        if self.eigenvalues is not None: res['eigenvalues'] = self.eigenvalues.tolist()
-        res['matrix'] = self.matrix.tolist()
-        
-        with open(filename,'w') as f:
-            json.dump(res, f, indent=2)
-
-    def get_ev(self, ypars=None):
-        if self.eigenvalues is None: return None
-        if ypars is None: ypars=self.ypars
-        return self.eigenvalues.loc[ypars]
-
-    def remove_XorY(self, x=[], y=[]):
-        keep_x = [p for p in self.xpars if not p in x]
-        keep_y = [p for p in self.ypars if not p in y]
-        return self.loc[keep_y,keep_x]
-
-
-
-
-class QuadraticModel( torch.nn.Module ):
-    def __init__(self, ncoefs):
-        super(QuadraticModel, self).__init__()
-        self.fc1 = Linear( ncoefs, 1, bias=False)
-        self.fc2 = Linear( int((ncoefs*ncoefs-ncoefs)/2+ncoefs), 1, bias=False)
-
-    def forward(self, x):
-        x1 = x.unsqueeze(2)
-        x2 = x.unsqueeze(1)
-        xx = x1 * x2
-        indices = torch.triu_indices(*(xx.shape[1:]))
-        xx_upper = xx[:,indices[0],indices[1]]
-        return  self.fc2(xx_upper)  # self.fc1(x) + 
-
-
-all_data=torch.Tensor( uproot.concatenate( [ f"{infile}:limit"], [ "2*deltaNLL", "quantileExpected"]+[x for x in pois], library='pd').values)
 path = os.path.dirname(infile)
 pattern = r"Lumi(\d+\.\d+)\.(.*?)\.MultiDimFit"
 match = re.search(pattern, infile)
-lumi = match.group(1)
-wps  = match.group(2)
-
-
-target = all_data[:,0]
-mask   = (all_data[:,1] > -0.5)
-x      = all_data[:,2:]
-
-#mask   = mask & ( torch.sum( torch.abs(other_pois), axis=1) == 0.) # removing stuff from the other pois
-
-x     =x[mask]
-target=target[mask]
-
-
-
-model = QuadraticModel(len(pois))
-    
-mseloss   = MSELoss()
-optimizer = Adam(model.parameters(), lr=0.2)
-scheduler = ExponentialLR(optimizer, gamma=0.9999)
-
-
-nepochs=10000
-
-indices={}; count=0
-for i1,op1 in enumerate(pois):
-    for i2,op2 in enumerate(pois):
-        if i2 < i1: continue
-        indices[(op1,op2)]=count
-        count=count+1
-
-def hessian_from_model( model ):
-
-    linears    = model.fc1.weight
-    quadratics = model.fc2.weight
-
-
-
-    hessian_matrix_numpy=[]
-    
-    for i1,op1 in enumerate(pois):
-        hessian_matrix_row=[]
-        for i2,op2 in enumerate(pois):
-            index=indices[(op1,op2)] if (op1,op2) in indices else indices[(op2,op1)]
-            factor=1
-            if op1 != op2:
-                factor=2
-            hessian_matrix_row.append( float(quadratics[0,index])/factor )
-        hessian_matrix_numpy.append( hessian_matrix_row)
-    
-    hessian_matrix_numpy=np.array(hessian_matrix_numpy)
-    dfHes = pd.DataFrame(hessian_matrix_numpy, index=pois, columns=pois)
-    return Matrix.fromDataFrame(dfHes)
-
-import torch
-import torch.nn as nn
-
-class RelativeMSELoss(nn.Module):
-    def __init__(self, epsilon=1e-8):
-        super(RelativeMSELoss, self).__init__()
-        self.epsilon = epsilon
-
-    def forward(self, y_pred, y_true):
-        numerator = torch.sum((y_pred - y_true) ** 2)
-        denominator = torch.sum(y_true ** 2) + self.epsilon
-        return numerator / denominator
-    
-rel_mse = RelativeMSELoss()
-
-for epoch in range(nepochs):
-    optimizer.zero_grad()
-    #loss=mseloss(model(x).flatten(),target.flatten())
-    loss=rel_mse(model(x).flatten(),target.flatten())
-    epoch_loss=loss.data
-    loss.backward()
-    optimizer.step()
-    scheduler.step()
-    if not (epoch%1000):
-        print(f'Epoch: {epoch}. Loss: {epoch_loss}')
-    if not (epoch%5000):
-        # add more data in the tricky parts
-        hessian = hessian_from_model(model)
-        values, vectors = np.linalg.eig(hessian)
-        min_eig = vectors[:,np.argmin(values)]
-        print("Minimum eigenvector", np.min(values), min_eig)
-        print("All eigenvalues", values)
-
-        index_ctG=pois.index("ctG")
-        N = 1000
-        values = torch.zeros((N, 26))
-        values[:,index_ctG] = torch.linspace(-1,1,steps=N)
-        plt.plot( values.numpy(), model(values).numpy())
-        plt.savefig("plot.png")
-        plt.clf()
-        
-        
-        # csv_file=f'{outdir}/scan.ESU.Linear.fixed.Lumi{lumi}.{wps}.more_data_at_epoch_{epoch}.csv'
-        # with open(csv_file, 'w', newline='') as csvfile:
-        #     scanwriter = csv.writer(csvfile, delimiter=',')
-        #     scanwriter.writerow(pois)
-        #     for i,factor in enumerate([0.1, 0.01, -0.1, -0.01]):
-        #         scanwriter.writerow( [factor*min_eig[i] for i in range(len(pois))])
-        # command = f'./fits_for_pca_extra.sh {wps} {path} {lumi}  more_data_at_epoch_{epoch} {outdir}'
-        # os.system(command)
-        # outfiles = glob.glob(f"{outdir}/higgsCombine.ESU.Linear.fixed.Lumi{lumi}.{wps}.extra.more_data_at_epoch_0.POINT.*.MultiDimFit.mH120.root")
-        # more_data=torch.Tensor( uproot.concatenate( outfiles, [ "2*deltaNLL", "quantileExpected"]+[p for p in pois], library='pd').values)
-            
-        # more_target = more_data[:,0]
-        # more_mask   = (more_data[:,1] > -0.5)
-        # more_x      = more_data[:,2:]
-
-        # more_x      = more_x[more_mask]
-        # more_target = more_target[more_mask]
-
-        # x = torch.cat([x,more_x],dim=0)
-        # target = torch.cat([target, more_target], dim=0)
-        # print(f"Now our data is shape {x.shape}, {target.shape}")
-
-dfHes = hessian_from_model( model )
+lumi = match.group(1) if match else None
+wps  = match.group(2) if match else None
+
+if args.solver == 'adam':
+    x, target = next(read_scan())
+    coefficients = fit_adam(x, target, args.nepochs)
+    chunks = lambda: [(x, target)]
+else:
+    nentries = CountEntries(infiles)
+    if nentries <= args.chunk_size:
+        x, target = next(read_scan())
+        coefficients = solve_lstsq(x, target, args.weighting)
+        chunks = lambda: [(x, target)]
+    else:
+        coefficients = solve_normal_equations(read_scan(args.chunk_size), args.weighting)
+        chunks = lambda: read_scan(args.chunk_size)
+
+print(f"Relative MSE of the fit: {relative_loss(coefficients, chunks())}")
+dfHes = hessian_from_coefficients( coefficients )
 
 outprefix=infile.replace(".MultiDimFit.mH120.root", "").split("/")[-1]
 dfHes.writeToJSON( f'{outdir}/{outprefix}_hessian.json')
 
 
-def do_pca(info_matrix, min_info=0., pois=None):
-    
-    # remove POI whose entry on the diagonal of the information matrix is < min_info
-    remove_poi = [p for p in info_matrix.xpars if abs(info_matrix.loc[p,p]) < min_info]
-    # remove POI that are not in the argument
-    if pois is not None:
-        remove_poi += [p for p in info_matrix.xpars if not (p in pois or p in remove_poi)]
-    info_matrix = info_matrix.remove_XorY(x=remove_poi, y=remove_poi)
-
-    eigenvectors, eigenvalues, vh = np.linalg.svd(info_matrix) # rotation_matrix = eigenvectors.T
-
-    # Make sure rotation matrix is orthogonal (R^T * R = 1)
-    assert(np.allclose(np.dot(eigenvectors, eigenvectors.T), np.identity(eigenvectors.shape[0])))
-    
-    xpars = info_matrix.xpars
-    ypars = ['EV%s' % (i+1) for i in range(len(eigenvalues))] # ypars = rotation_matrix * xpars
-    return Matrix(eigenvectors.T, xpars, ypars, eigenvalues=eigenvalues)
-    
-    
 basis_rotation = do_pca(dfHes)
 basis_rotation.writeToJSON( f'{outdir}/{outprefix}_basis_rotation.json')
-
@@ -0,0 +1,127 @@
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+from argparse import ArgumentParser
+
+from .tools import Matrix, Measurement
+
+# Linearized Fisher information of the cooked measurements
+#   I = A^T C^-1 A,   A[b,i] = d(prediction_b)/d(c_i)
+# computed directly from CMS_<measurement>.json (cov, sm) and
+# CMS_<measurement>_scalings.json (linear terms of mu_b = 1 + A_ib c_i + ...),
+# without combine fits. The matrices are written in the Matrix JSON format,
+# together with the do_pca basis rotation, and can be used by
+# drawContributions.py (--cooked).
+
+
+def ScalingsPath(measurement_path):
+    # eftcomb/measurements/CMS_x.json -> eftcomb/scalings/CMS_x_scalings.json
+    folder, name = os.path.split(measurement_path)
+    return os.path.join(os.path.dirname(folder), 'scalings', name.replace('.json', '_scalings.json'))
+
+
+def LinearTerms(scalings, pois=None):
+    # (nbins, npois) derivatives of mu_b at the SM, and the POI names
+    linear = OrderedDict()
+    for term in scalings['terms']:
+        ops, vals = term[0], term[1]
+        if len(ops) == 1 and (pois is None or ops[0] in pois):
+            linear[ops[0]] = np.asarray(vals, dtype=np.float64)
+    names = list(linear.keys())
+    A = np.stack([linear[p] for p in names], axis=1) if names else np.zeros((scalings['nbins'], 0))
+    return A, names
+
+
+def PredictionScale(measurement, rtol=0.05):
+    # The derivatives of mu must be expressed in the units of the covariance:
+    # if the variances match bf_unc^2 the measurement is a ratio to the SM
+    # (scale 1), if they match (bf_unc*sm)^2 it is absolute (scale sm).
+    var = np.diag(measurement.cov)
+    if np.allclose(var, measurement.bf_unc**2, rtol=rtol):
+        return np.ones(measurement.nbins)
+    if np.allclose(var, (measurement.bf_unc*measurement.sm)**2, rtol=rtol):
+        return np.asarray(measurement.sm, dtype=np.float64)
+    print('Warning: cannot tell whether the covariance is absolute or relative to the SM, assuming relative')
+    return np.ones(measurement.nbins)
+
+
+def InformationMatrix(measurement, scalings, pois=None):
+    # A^T C^-1 A through a Cholesky solve, for all the POIs at once
+    A, names = LinearTerms(scalings, pois)
+    if measurement.nbins != A.shape[0]:
+        raise ValueError('Measurement has {} bins but the scalings {}'.format(measurement.nbins, A.shape[0]))
+    A = A*PredictionScale(measurement)[:,None]
+    L = np.linalg.cholesky(np.asarray(measurement.cov, dtype=np.float64))
+    W = np.linalg.solve(L, A)
+    return Matrix(W.T @ W, names, names)
+
+
+def CombinedInformation(info_matrices):
+    # uncorrelated measurements: the information matrices add up (on the union of the POIs)
+    res = None
+    for m in info_matrices:
+        res = m if res is None else res + m
+    return res
+
+
+def do_pca(info_matrix, min_info=0., pois=None):
+
+    # remove POI whose entry on the diagonal of the information matrix is < min_info
+    remove_poi = [p for p in info_matrix.xpars if abs(info_matrix.loc[p,p]) < min_info]
+    # remove POI that are not in the argument
+    if pois is not None:
+        remove_poi += [p for p in info_matrix.xpars if not (p in pois or p in remove_poi)]
+    info_matrix = info_matrix.remove_XorY(x=remove_poi, y=remove_poi)
+
+    eigenvectors, eigenvalues, vh = np.linalg.svd(info_matrix) # rotation_matrix = eigenvectors.T
+
+    # Make sure rotation matrix is orthogonal (R^T * R = 1)
+    assert(np.allclose(np.dot(eigenvectors, eigenvectors.T), np.identity(eigenvectors.shape[0])))
+
+    xpars = info_matrix.xpars
+    ypars = ['EV%s' % (i+1) for i in range(len(eigenvalues))] # ypars = rotation_matrix * xpars
+    return Matrix(eigenvectors.T, xpars, ypars, eigenvalues=eigenvalues)
+
+
+def MeasurementName(measurement_path):
+    return os.path.basename(measurement_path).replace('.json', '')
+
+
+class FisherAnalysis(object):
+    # Same attributes as the EFTAnalysis used by drawContributions.py:
+    # channels, inputs[channel]['info_matrix'], info_matrix and basis_rotation
+
+    def __init__(self, measurement_paths, pois=None, min_info=0.):
+        self.channels = []
+        self.inputs = OrderedDict()
+        for path in measurement_paths:
+            name = MeasurementName(path)
+            with open(ScalingsPath(path)) as f:
+                scalings = json.load(f)
+            self.channels.append(name)
+            self.inputs[name] = {'info_matrix': InformationMatrix(Measurement.fromJSON(path), scalings, pois)}
+        self.info_matrix = CombinedInformation([self.inputs[ch]['info_matrix'] for ch in self.channels])
+        self.basis_rotation = do_pca(self.info_matrix, min_info=min_info, pois=pois)
+
+    def write(self, outdir):
+        if not os.path.isdir(outdir): os.makedirs(outdir)
+        for ch in self.channels:
+            self.inputs[ch]['info_matrix'].writeToJSON(os.path.join(outdir, '%s_info.json' % ch))
+        self.info_matrix.writeToJSON(os.path.join(outdir, 'combined_info.json'))
+        self.basis_rotation.writeToJSON(os.path.join(outdir, 'combined_basis_rotation.json'))
+
+
+if __name__ == '__main__':
+    # run from fit-utils: python -m python.fisher -m ../eftcomb/measurements/CMS_*.json -o info/
+    parser = ArgumentParser()
+    parser.add_argument('-m', '--measurements', nargs='+', required=True, help='cooked CMS_<measurement>.json files (the scalings are taken from ../scalings/)')
+    parser.add_argument('-o', '--outdir', default='.')
+    parser.add_argument('--pois', nargs='+', default=None)
+    parser.add_argument('--min-info', dest='min_info', default=0., type=float, help='remove POIs with a smaller diagonal information from the PCA')
+    args = parser.parse_args()
+
+    analysis = FisherAnalysis(args.measurements, args.pois, args.min_info)
+    analysis.write(args.outdir)
+    for p,ev in zip(analysis.basis_rotation.ypars, analysis.basis_rotation.eigenvalues):
+        print('{:>6} {:>12.4g}'.format(p, ev))
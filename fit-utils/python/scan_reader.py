@@ -0,0 +1,93 @@
+import glob
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Chunked reader of the 'limit' tree of combine MultiDimFit scans.
+# Only the target and the POI branches are read, the points with
+# quantileExpected <= -0.5 are dropped chunk by chunk, and the chunks of
+# several files are read concurrently and yielded as (x, target) arrays:
+#   x      : (npoints, npois) float64 values of the POIs
+#   target : (npoints,) float64 values of 2*deltaNLL
+
+TARGET = '2*deltaNLL'
+QUANTILE = 'quantileExpected'
+_DONE = object()
+
+
+def ExpandFiles(files):
+    # accept file names and glob patterns, keep the order and drop duplicates
+    if isinstance(files, str): files = [files]
+    res = []
+    for f in files:
+        for match in (sorted(glob.glob(f)) or [f]):
+            if match not in res: res.append(match)
+    return res
+
+
+def CountEntries(files, treename='limit'):
+    import uproot
+    return sum(uproot.open(f)[treename].num_entries for f in ExpandFiles(files))
+
+
+def _ConvertChunk(chunk, pois, min_quantile):
+    mask = np.asarray(chunk[QUANTILE]) > min_quantile
+    x = np.empty((int(np.count_nonzero(mask)), len(pois)), dtype=np.float64)
+    for i,p in enumerate(pois):
+        x[:,i] = np.asarray(chunk[p])[mask]
+    return x, np.asarray(chunk[TARGET], dtype=np.float64)[mask]
+
+
+def _ReadFile(filename, pois, treename, step_size, min_quantile, out, stop):
+    import uproot
+    branches = [TARGET, QUANTILE]+list(pois)
+    for chunk in uproot.iterate({filename: treename}, branches, step_size=step_size, library='np'):
+        if stop.is_set(): return
+        out.put(_ConvertChunk(chunk, pois, min_quantile))
+
+
+def IterateScan(files, pois, treename='limit', step_size='100 MB', max_workers=4, min_quantile=-0.5):
+    # Yield the (x, target) chunks of all the files. Files are read by up to
+    # max_workers threads (decompression releases the GIL); at most
+    # 2*max_workers chunks are kept in memory waiting to be consumed, and the
+    # chunks of different files may come in any order.
+    files = ExpandFiles(files)
+    if len(files) == 0: return
+    out = queue.Queue(maxsize=2*max_workers)
+    stop = threading.Event()
+
+    def worker(filename):
+        try:
+            _ReadFile(filename, pois, treename, step_size, min_quantile, out, stop)
+        except Exception as e:
+            out.put(e)
+        finally:
+            out.put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(files)))
+    for f in files: pool.submit(worker, f)
+    ndone = 0
+    try:
+        while ndone < len(files):
+            item = out.get()
+            if item is _DONE:
+                ndone += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # stop and unblock the producers if the consumer stopped early
+        stop.set()
+        while ndone < len(files):
+            if out.get() is _DONE: ndone += 1
+        pool.shutdown()
+
+
+def ReadScan(files, pois, **kwargs):
+    # the whole scan in memory, as a single (x, target) pair
+    chunks = list(IterateScan(files, pois, **kwargs))
+    if len(chunks) == 0:
+        return np.zeros((0, len(pois))), np.zeros(0)
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
@@ -2,11 +2,74 @@ import numpy as np
 import pandas as pd
 import yaml
 import json
+import struct
+import hashlib
 from itertools import chain
 from math import sqrt
-from ROOT import TMatrixDSym, gROOT, TH2D
 from collections import OrderedDict
 
+# Binary format of Measurement and Matrix (the JSON stays the interchange
+# format): magic, header length (uint64), JSON header with the schema
+# version, metadata, content hash and the offset/shape of every array, then
+# the float64 arrays, contiguous and aligned, so they can be memory-mapped.
+BINARY_MAGIC = b'TCOMBBIN'
+BINARY_SCHEMA_VERSION = 1
+BINARY_ALIGNMENT = 64
+MEASUREMENT_ARRAYS = ['sm', 'sm_unc', 'bf', 'bf_unc', 'cov', 'cov_th', 'cov_hessian']
+
+def ContentHash(arrays, metadata):
+    h = hashlib.sha256(json.dumps(metadata, sort_keys=True).encode())
+    for name, arr in arrays.items():
+        h.update(name.encode())
+        h.update(str(arr.shape).encode())
+        h.update(np.ascontiguousarray(arr, dtype='<f8').tobytes())
+    return h.hexdigest()
+
+def WriteBinary(filename, kind, arrays, metadata):
+    arrays = OrderedDict((k, np.ascontiguousarray(v, dtype='<f8')) for k, v in arrays.items())
+    layout, offset = OrderedDict(), 0
+    for name, arr in arrays.items():
+        layout[name] = {'offset': offset, 'shape': list(arr.shape)}
+        offset += arr.size
+    header = json.dumps(OrderedDict([
+        ('schema_version', BINARY_SCHEMA_VERSION),
+        ('kind', kind),
+        ('metadata', metadata),
+        ('arrays', layout),
+        ('content_hash', ContentHash(arrays, metadata)),
+    ])).encode()
+    # pad the header so that the data starts on an aligned offset
+    start = len(BINARY_MAGIC) + 8 + len(header)
+    header += b' ' * (-start % BINARY_ALIGNMENT)
+    with open(filename, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for arr in arrays.values():
+            f.write(arr.tobytes())
+
+def ReadBinary(filename, kind=None, verify=False):
+    # returns (metadata, {name: array}); the arrays are copy-on-write memory maps
+    with open(filename, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError('{} is not a top-comb binary file'.format(filename))
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    if header['schema_version'] > BINARY_SCHEMA_VERSION:
+        raise ValueError('{} has schema version {}, only up to {} is supported'.format(filename, header['schema_version'], BINARY_SCHEMA_VERSION))
+    if kind is not None and header['kind'] != kind:
+        raise ValueError('{} contains a {}, not a {}'.format(filename, header['kind'], kind))
+    data_start = len(BINARY_MAGIC) + 8 + header_len
+    size = sum(int(np.prod(a['shape'])) for a in header['arrays'].values())
+    data = np.memmap(filename, dtype='<f8', mode='c', offset=data_start, shape=(size,)) if size > 0 else np.zeros(0)
+    arrays = OrderedDict()
+    for name, a in header['arrays'].items():
+        n = int(np.prod(a['shape']))
+        arrays[name] = data[a['offset']:a['offset']+n].reshape(a['shape'])
+    if verify and ContentHash(arrays, header['metadata']) != header['content_hash']:
+        raise ValueError('Content hash mismatch in {}'.format(filename))
+    return header['metadata'], arrays
+
 class Measurement(object):
 
     def __init__(self, nbins, bin_labels, sm, sm_unc, bf, bf_unc, cov, cov_th=None, cov_hessian=None):
@@ -17,8 +80,8 @@ class Measurement(object):
         self.bf = np.array(bf)
         self.bf_unc = np.array(bf_unc)
         self.cov = np.array(cov)
-        self.cov_th = np.array(cov_th)
-        self.cov_hessian = np.array(cov_hessian)
+        self.cov_th = np.array(cov_th) if cov_th is not None else None
+        self.cov_hessian = np.array(cov_hessian) if cov_hessian is not None else None
 
     @classmethod
     def fromJSON(cls, filename):
@@ -29,7 +92,7 @@ class Measurement(object):
     @classmethod
     def fromYAML(cls, filename):
         with open(filename) as yamlfile:
-            input = yaml.load(yamlfile)
+            input = yaml.safe_load(yamlfile)
         return cls.fromDict(input)
 
     @classmethod
@@ -37,142 +100,138 @@ class Measurement(object):
         nbins = d['nbins'] if 'nbins' in d else len(d['bin_labels'])
         sm_unc = np.array(d['sm_unc']) if 'sm_unc' in d else np.zeros(nbins)
         bf_unc = np.array(d['bf_unc']) if 'bf_unc' in d else np.array([np.sqrt(d['cov'][i][i]) for i in range(nbins)])
-        cov_th = np.array(d['cov_th']) if 'cov_th' in d else None
-        cov_hessian = np.array(d['cov_hessian']) if 'cov_hessian' in d else None
+        cov_th = np.array(d['cov_th']) if d.get('cov_th') is not None else None
+        cov_hessian = np.array(d['cov_hessian']) if d.get('cov_hessian') is not None else None
         return cls(nbins=nbins, bin_labels=d['bin_labels'], sm=np.array(d['sm']), sm_unc=sm_unc, bf=np.array(d['bf']), bf_unc=bf_unc, cov=np.array(d['cov']), cov_th=cov_th, cov_hessian=cov_hessian)
 
+    @classmethod
+    def fromBinary(cls, filename, verify=False):
+        # the arrays are memory-mapped (copy-on-write): they are only read when used
+        metadata, arrays = ReadBinary(filename, kind='Measurement', verify=verify)
+        res = cls.__new__(cls)
+        res.nbins = int(metadata['nbins'])
+        res.bin_labels = list(metadata['bin_labels'])
+        for name in MEASUREMENT_ARRAYS:
+            setattr(res, name, arrays.get(name))
+        return res
+
+    def toDict(self):
+        res = OrderedDict([
+            ('nbins', int(self.nbins)),
+            ('bf', self.bf.tolist()),
+            ('bf_unc', self.bf_unc.tolist()),
+            ('cov', self.cov.tolist()),
+        ])
+        if self.cov_th is not None: res['cov_th'] = self.cov_th.tolist()
+        if self.cov_hessian is not None: res['cov_hessian'] = self.cov_hessian.tolist()
+        res['sm'] = self.sm.tolist()
+        res['sm_unc'] = self.sm_unc.tolist()
+        res['bin_labels'] = self.bin_labels
+        return res
+
     def writeToJSON(self, filename):
         with open(filename, 'w') as outfile:
-            if self.cov_th is not None and self.cov_hessian is not None:
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('cov_th', self.cov_th.tolist()),
-                    ('cov_hessian', self.cov_hessian.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            elif self.cov_th is not None:
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('cov_th', self.cov_th.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            elif self.cov_hessian is not None:
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('cov_hessian', self.cov_hessian.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            else :
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            outfile.write(json.dumps(res, sort_keys=False, indent=2))
+            outfile.write(json.dumps(self.toDict(), sort_keys=False, indent=2))
 
     def writeToYAML(self, filename):
         with open(filename, 'w') as outfile:
-            if self.cov_th is not None and self.cov_hessian is not None:
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('cov_th', self.cov_th.tolist()),
-                    ('cov_hessian', self.cov_hessian.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            elif self.cov_th is not None:
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('cov_th', self.cov_th.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            elif self.cov_hessian is not None:
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('cov_hessian', self.cov_hessian.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            else :
-                res = OrderedDict([
-                    ('nbins', int(self.nbins)),
-                    ('bf', self.bf.tolist()),
-                    ('bf_unc', self.bf_unc.tolist()),
-                    ('cov', self.cov.tolist()),
-                    ('sm', self.sm.tolist()),
-                    ('sm_unc', self.sm_unc.tolist()),
-                    ('bin_labels', self.bin_labels)
-                ])
-            yaml.dump(res,outfile,default_flow_style=False, allow_unicode=True)
+            # plain dict: yaml cannot represent an OrderedDict with safe_dump
+            yaml.safe_dump(dict(self.toDict()), outfile, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+    def writeToBinary(self, filename):
+        arrays = OrderedDict((name, getattr(self, name)) for name in MEASUREMENT_ARRAYS if getattr(self, name) is not None)
+        WriteBinary(filename, 'Measurement', arrays, {'nbins': int(self.nbins), 'bin_labels': self.bin_labels})
 
 def ReadMeasurement(measurement_file):
     if measurement_file.split('.')[-1]=='yaml':
         measurement = Measurement.fromYAML(measurement_file)
     elif measurement_file.split('.')[-1]=='json':
         measurement = Measurement.fromJSON(measurement_file)
+    elif measurement_file.split('.')[-1]=='bin':
+        measurement = Measurement.fromBinary(measurement_file)
     else: 
         print('File format not supported: {}'.format(measurement_file))
     return measurement
 
-# Matrix: a pandas dataframe with some additions
-#  - matrix multiplications with '*' operator
+# Matrix: a labelled 2D matrix backed by a contiguous numpy array
+#  - rows labelled by 'ypars' (index), columns by 'xpars' (columns)
+#  - matrix multiplications with '*' operator, aligned on the labels
+#  - label-based selection with .loc, like a pandas DataFrame
 #  - save and load from JSON files
-#  - new attribute 'eigenvalues'
-class Matrix(pd.DataFrame):
+#  - new attribute 'eigenvalues' (a pandas Series indexed by the ypars)
+class _MatrixLoc(object):
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    @staticmethod
+    def _positions(key, labels, lookup):
+        # positions of a label, a list of labels or a slice; scalar labels give an int
+        if isinstance(key, slice):
+            if key == slice(None): return np.arange(len(labels))
+            start = 0 if key.start is None else lookup[key.start]
+            stop = len(labels) if key.stop is None else lookup[key.stop]+1
+            return np.arange(start, stop)[::key.step or 1]
+        if isinstance(key, (list, tuple, np.ndarray, pd.Index)):
+            return np.array([lookup[k] for k in key], dtype=int)
+        return lookup[key]
+
+    def _split(self, key):
+        return key if isinstance(key, tuple) else (key, slice(None))
+
+    def __getitem__(self, key):
+        m = self.matrix
+        ykey, xkey = self._split(key)
+        iy = self._positions(ykey, m.ypars, m._ylookup)
+        ix = self._positions(xkey, m.xpars, m._xlookup)
+        if np.ndim(iy) == 0 and np.ndim(ix) == 0:
+            return m._values[iy, ix]
+        if np.ndim(iy) == 0 or np.ndim(ix) == 0:
+            # a single row or column: pandas Series, like DataFrame.loc
+            if np.ndim(iy) == 0:
+                return pd.Series(m._values[iy, ix], index=[m.xpars[i] for i in ix])
+            return pd.Series(m._values[iy, ix], index=[m.ypars[i] for i in iy])
+        ypars = [m.ypars[i] for i in iy]
+        eigenvalues = m.get_ev(ypars) if m.eigenvalues is not None else None
+        return Matrix(m._values[np.ix_(iy, ix)], [m.xpars[i] for i in ix], ypars, eigenvalues=eigenvalues)
+
+    def __setitem__(self, key, value):
+        m = self.matrix
+        ykey, xkey = self._split(key)
+        iy = self._positions(ykey, m.ypars, m._ylookup)
+        ix = self._positions(xkey, m.xpars, m._xlookup)
+        if np.ndim(iy) == 0 or np.ndim(ix) == 0:
+            m._values[iy, ix] = value
+        else:
+            m._values[np.ix_(iy, ix)] = value
+
+
+class Matrix(object):
+
+    __array_priority__ = 100
 
     def __init__(self, matrix, columns=None, index=None, dtype=None, copy=True, eigenvalues=None):
+        if isinstance(matrix, Matrix):
+            if columns is None: columns = matrix.xpars
+            if index is None: index = matrix.ypars
+            matrix = matrix._values
+        elif isinstance(matrix, pd.DataFrame):
+            if columns is None: columns = matrix.columns
+            if index is None: index = matrix.index
+            matrix = matrix.values
         if index is None: index=columns
-        # create a pd.DataFrame and add eigenvalues
-        super(Matrix, self).__init__(data=matrix, columns=columns, index=index, dtype=dtype, copy=copy)
-        self.eigenvalues = pd.Series(eigenvalues, index) if eigenvalues is not None else None
+        values = np.array(matrix, dtype=dtype or np.float64) if copy else np.asarray(matrix, dtype=dtype or np.float64)
+        if values.size == 0 and values.ndim != 2:
+            values = values.reshape((len(index) if index is not None else 0, len(columns) if columns is not None else 0))
+        self._values = values
+        self._xpars = [x for x in columns] if columns is not None else ['x%s' % i for i in range(values.shape[1])]
+        self._ypars = [y for y in index] if index is not None else ['y%s' % i for i in range(values.shape[0])]
+        if values.shape != (len(self._ypars), len(self._xpars)):
+            raise ValueError('Matrix: shape {} does not match {} ypars x {} xpars'.format(values.shape, len(self._ypars), len(self._xpars)))
+        self._xlookup = dict((x,i) for i,x in enumerate(self._xpars))
+        self._ylookup = dict((y,i) for i,y in enumerate(self._ypars))
+        self.eigenvalues = pd.Series(np.asarray(eigenvalues, dtype=np.float64), self._ypars) if eigenvalues is not None else None
 
-    # _constructor: the result of an operation on a Matrix should also be a Matrix
-    @property
-    def _constructor(self):
-        # apply row slicing also to eigenvalues
-        if self.eigenvalues is not None:
-            new_ypars = [y for y in self.ypars if y in self.eigenvalues.index]
-            if len(new_ypars) > 0:
-                self.eigenvalues = self.eigenvalues.loc[new_ypars]
-            else:
-                self.eigenvalues = None
-        return Matrix
-
-    # _metadata: keep the eigenvalues when creating a new object
-    _metadata = ['eigenvalues']
-    
     @classmethod
     def fromDict(cls, d):
         if not 'ypars' in d: d['ypars'] = d['xpars']
@@ -185,6 +244,11 @@ class Matrix(pd.DataFrame):
             d = json.load(f)
         return cls.fromDict(d)
 
+    @classmethod
+    def fromBinary(cls, filename, verify=False):
+        metadata, arrays = ReadBinary(filename, kind='Matrix', verify=verify)
+        return cls(arrays['matrix'], metadata['xpars'], metadata['ypars'], copy=False, eigenvalues=arrays.get('eigenvalues'))
+
     @classmethod
     def fromDataFrame(cls, df, eigenvalues=None):
         return cls(df.values, df.columns, df.index, eigenvalues=eigenvalues)
@@ -192,89 +256,130 @@ class Matrix(pd.DataFrame):
     @classmethod
     def fromTMatrix(cls, tmatrix, columns=None, index=None, eigenvalues=None):
         N, M = tmatrix.GetNrows(), tmatrix.GetNcols()
-        arr = np.zeros((N,M))
-        for i in range(N):
-            for j in range(M):
-                arr[i][j] = tmatrix[i][j]
-
+        # copy the whole (row-major) array at once
+        arr = np.frombuffer(tmatrix.GetMatrixArray(), dtype=np.float64, count=N*M).reshape(N, M).copy()
         return cls(arr, columns, index, eigenvalues=eigenvalues)
 
     @classmethod
     def merge(cls, matrices):
+        # stack the rows of the matrices, on the union of their columns (missing entries are 0)
         if len(matrices) == 0: 
-            return cls(np.zeros((0,0)))
-        else:
-            pdcat = pd.concat((m for m in matrices), sort=False).fillna(0.)
-            return cls(pdcat.values, pdcat.columns, pdcat.index)
+            return cls(np.zeros((0,0)), [], [])
+        xpars = MergeLists([m.xpars for m in matrices], True)
+        ypars = MergeLists([m.ypars for m in matrices], True)
+        res = cls(np.zeros((len(ypars), len(xpars))), xpars, ypars)
+        ylookup = dict((y,i) for i,y in enumerate(ypars))
+        for m in matrices:
+            res._values[np.ix_([ylookup[y] for y in m.ypars], [res._xlookup[x] for x in m.xpars])] = m._values
+        return res
+
+    def to_dataframe(self):
+        return pd.DataFrame(self._values, index=self.ypars, columns=self.xpars)
+
+    @property
+    def xpars(self): return list(self._xpars)
+
+    @property
+    def ypars(self): return list(self._ypars)
+
+    # pandas-like accessors
+    @property
+    def columns(self): return pd.Index(self._xpars)
+
+    @property
+    def index(self): return pd.Index(self._ypars)
+
+    @property
+    def matrix(self): return self._values
 
     @property
-    def xpars(self): return self.columns.tolist()
+    def values(self): return self._values
 
     @property
-    def ypars(self): return self.index.tolist()
+    def shape(self): return self._values.shape
 
     @property
-    def matrix(self): return self.values
+    def loc(self): return _MatrixLoc(self)
+
+    @property
+    def T(self):
+        return Matrix(self._values.T, self.ypars, self.xpars, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        return self._values if dtype is None else self._values.astype(dtype)
+
+    def __len__(self): return self._values.shape[0]
+
+    def __repr__(self): return repr(self.to_dataframe())
+
+    def copy(self):
+        return Matrix(self._values, self.xpars, self.ypars, eigenvalues=self.eigenvalues)
+
+    # positions of labels in the rows/columns
+    def _xindex(self, labels): return np.array([self._xlookup[x] for x in labels], dtype=int)
+    def _yindex(self, labels): return np.array([self._ylookup[y] for y in labels], dtype=int)
 
     # matrix multiplication with '*' operator
     # A * B = A[:,B.x] * B[A.y,:]
     def __mul__(self, other):
-        if isinstance(other, pd.DataFrame):
-            new_xpars = [x for x in other.index if x in self.columns]
-            return Matrix(np.dot(self.loc[:,new_xpars], other.loc[new_xpars,:]), index=self.index, columns=other.columns)
-        elif isinstance(other, np.ndarray) and other.shape[0] == self.shape[1]:
-            return Matrix(np.dot(self, other), index=self.index, columns=['x%s' % i for i in range(other.shape[1])])
-        elif isinstance(other, float) or isinstance(other, int):
-            return Matrix(other*self.matrix, columns=self.columns, index=self.index)
-        else:
-            return super(Matrix, self).__mul__(self, other)
+        if isinstance(other, Matrix):
+            new_xpars = [x for x in other.ypars if x in self._xlookup]
+            return Matrix(self._values[:, self._xindex(new_xpars)] @ other._values[other._yindex(new_xpars), :], other.xpars, self.ypars, copy=False)
+        elif isinstance(other, pd.DataFrame):
+            return self * Matrix(other)
+        elif isinstance(other, np.ndarray) and other.ndim == 2 and other.shape[0] == self.shape[1]:
+            return Matrix(self._values @ other, index=self.ypars, columns=['x%s' % i for i in range(other.shape[1])], copy=False)
+        elif isinstance(other, (float, int, np.floating, np.integer)):
+            return Matrix(other*self._values, columns=self.xpars, index=self.ypars, copy=False)
+        return NotImplemented
     
     # right multiplication
     def __rmul__(self, other):
         if isinstance(other, pd.DataFrame):
-            new_ypars = [y for y in self.index if y in other.columns]
-            return Matrix(np.dot(other.loc[:,new_ypars], self.loc[new_ypars,:]), index=other.index, columns=self.columns)
-        elif isinstance(other, np.ndarray) and other.shape[1] == self.shape[0]:
-            return Matrix(np.dot(other, self), columns=self.columns, index=['y%s' % i for i in range(other.shape[0])])
-        elif isinstance(other, float) or isinstance(other, int):
-            return Matrix(other*self.matrix, columns=self.columns, index=self.index)
-        else:
-            return super(Matrix, self).__rmul__(self, other)
-
-    # addition
+            return Matrix(other) * self
+        elif isinstance(other, np.ndarray) and other.ndim == 2 and other.shape[1] == self.shape[0]:
+            return Matrix(other @ self._values, columns=self.xpars, index=['y%s' % i for i in range(other.shape[0])], copy=False)
+        elif isinstance(other, (float, int, np.floating, np.integer)):
+            return Matrix(other*self._values, columns=self.xpars, index=self.ypars, copy=False)
+        return NotImplemented
+
+    # addition, on the union of the labels (missing entries are 0)
     def __add__(self, other):
         if isinstance(other, pd.DataFrame):
-            new_xpars = MergeLists([self.xpars, other.columns.tolist()], True)
-            new_ypars = MergeLists([self.ypars, other.index.tolist()], True)
-            return np.add(self.reindex(index=new_ypars,columns=new_xpars,fill_value=0.),
-                other.reindex(index=new_ypars,columns=new_xpars,fill_value=0.))
-        else:
-            return super(Matrix, self).__add__(self, other)
+            other = Matrix(other)
+        if isinstance(other, Matrix):
+            new_xpars = MergeLists([self.xpars, other.xpars], True)
+            new_ypars = MergeLists([self.ypars, other.ypars], True)
+            res = Matrix(np.zeros((len(new_ypars), len(new_xpars))), new_xpars, new_ypars)
+            for m in (self, other):
+                res._values[np.ix_(res._yindex(m.ypars), res._xindex(m.xpars))] += m._values
+            return res
+        elif isinstance(other, (float, int, np.floating, np.integer, np.ndarray)):
+            return Matrix(self._values + other, self.xpars, self.ypars, copy=False)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self + (-1.)*other
+
+    def __neg__(self):
+        return (-1.)*self
 
     def triangular(self):
+        # lower triangle with the sum of the symmetric off-diagonal elements
         if not self.xpars == self.ypars:
             print('Matrix.triangular(): xpars != ypars')
             return self
         else:
-            res = Matrix(np.zeros(self.shape), self.xpars)
-            for i in range(self.shape[0]):
-                res.iloc[i,i] = self.iloc[i,i]
-                for j in range(i):
-                    res.iloc[i,j] = self.iloc[i,j]+self.iloc[j,i]
-            return res
+            return Matrix(np.tril(self._values + self._values.T, -1) + np.diag(np.diag(self._values)), self.xpars, copy=False)
 
     def symmetric(self):
         if not self.xpars == self.ypars:
             print('Matrix.symmetric(): xpars != ypars')
             return self
         else:
-            res = Matrix(np.zeros(self.shape), self.xpars)
-            for i in range(self.shape[0]):
-                res.iloc[i,i] = self.iloc[i,i]
-                for j in range(i):
-                    res.iloc[i,j] = (self.iloc[i,j]+self.iloc[j,i])/2.
-                    res.iloc[j,i] = (self.iloc[i,j]+self.iloc[j,i])/2.
-            return res
+            return Matrix((self._values + self._values.T)/2., self.xpars, copy=False)
 
     
     def writeToJSON(self, filename):
@@ -287,6 +392,16 @@ class Matrix(pd.DataFrame):
         with open(filename,'w') as f:
             json.dump(res, f, indent=2)
 
+    def writeToBinary(self, filename):
+        arrays = OrderedDict([('matrix', self.matrix)])
+        if self.eigenvalues is not None: arrays['eigenvalues'] = self.eigenvalues.values
+        WriteBinary(filename, 'Matrix', arrays, {'xpars': self.xpars, 'ypars': self.ypars})
+
+    def contentHash(self):
+        arrays = OrderedDict([('matrix', self._values)])
+        if self.eigenvalues is not None: arrays['eigenvalues'] = self.eigenvalues.values
+        return ContentHash(arrays, {'xpars': self.xpars, 'ypars': self.ypars})
+
     def get_ev(self, ypars=None):
         if self.eigenvalues is None: return None
         if ypars is None: ypars=self.ypars
@@ -307,6 +422,15 @@ def ReadIndependent(entry, col=0):
         return [(X['low'], X['high']) for X in values]
 
 
+def _ErrorPair(err):
+    # (plus, minus) of a hepData error entry, (0, 0) if it is neither sym nor asym
+    if 'symerror' in err:
+        return float(err['symerror']), float(err['symerror'])
+    elif 'asymerror' in err:
+        return float(err['asymerror']['plus']), float(err['asymerror']['minus'])
+    return 0., 0.
+
+
 def ReadDependent(entry, col=0, error=list(), sym_errors=True):
     # Extract the central values or the uncertainties from a column in the
     # hepData YAML. To extract the errors, supply a list of error indicies
@@ -314,27 +438,14 @@ def ReadDependent(entry, col=0, error=list(), sym_errors=True):
     # default.
     vals = entry['dependent_variables'][col]['values']
     if len(error) > 0:
-        res = list()
-        for v in vals:
-            sum_hi_sq = 0.
-            sum_lo_sq = 0.
-            for ecol in error:
-                err = v['errors'][ecol]
-                if 'symerror' in err:
-                    sum_hi_sq += pow(float(err['symerror']), 2)
-                    sum_lo_sq += pow(float(err['symerror']), 2)
-                elif 'asymerror' in err:
-                    sum_hi_sq += pow(float(err['asymerror']['plus']), 2)
-                    sum_lo_sq += pow(float(err['asymerror']['minus']), 2)
-            sum_hi = sqrt(sum_hi_sq)
-            sum_lo = sqrt(sum_lo_sq)
-            if sym_errors:
-                res.append((sum_lo + sum_hi) / 2.)
-            else:
-                res.append((-1. * sum_lo, +1. * sum_hi))
-        return np.array(res)
+        # Shape (npoints, nerrors, 2): the plus and minus of each selected error
+        pairs = np.array([[_ErrorPair(v['errors'][ecol]) for ecol in error] for v in vals], dtype=float)
+        sum_hi, sum_lo = np.sqrt(np.sum(pairs**2, axis=1)).T
+        if sym_errors:
+            return (sum_lo + sum_hi) / 2.
+        return np.stack([-1. * sum_lo, +1. * sum_hi], axis=1)
     else:
-        return np.array([float(X['value']) for X in entry['dependent_variables'][col]['values']])
+        return np.array([float(X['value']) for X in vals])
 
 
 def MergeLists(lists, skip_repeated_elements=False):
@@ -387,40 +498,40 @@ def ReadYodaFile(in_file,title=None,col=None):
             elif line.startswith('#') and not '# BEGIN' in line:
                 table_header = line.split(' ')[1:]
             elif line[0].isdigit() or (line[0]=='-' and line[1].isdigit()):
-                table_raw.append([float(nr) for nr in line.split(' ')])
+                table_raw.append(line)
 
         if len(table_raw) == 0: continue
-        
-        table = dict()
-        while len(table_header) < len(table_raw[0]):
+
+        # Parse all the numeric lines at once
+        data = np.atleast_2d(np.loadtxt(table_raw, dtype=float))
+        while len(table_header) < data.shape[1]:
             table_header.append('col%s' % len(table_header))
-        for i,h in enumerate(table_header):
-            table[h] = [line[i] for line in table_raw]
-        
-        res[table_title] = table
-    
+        res[table_title] = dict((h, data[:,i]) for i,h in enumerate(table_header[:data.shape[1]]))
+
     if col is not None:
-        res = dict((k,v[col]) for k,v in res.items() if v.has_key(col))    
+        res = dict((k,v[col]) for k,v in res.items() if col in v)
     if title is not None:
         res = res[title]
     return res
 
 
 def CovTMatrix(cov):
-    if isinstance(cov, pd.DataFrame): 
+    from ROOT import TMatrixDSym
+    if isinstance(cov, (pd.DataFrame, Matrix)): 
         cov = cov.values
+    cov = np.ascontiguousarray(cov, dtype=np.float64)
     shape = np.shape(cov)
     assert(shape[0] == shape[1])
     N = shape[0]
     res = TMatrixDSym(N)
-    for i in range(N):
-        for j in range(N):
-            res[i][j] = cov[i][j]
+    # copy the whole (row-major) array at once
+    res.SetMatrixArray(cov.ravel())
     return res
 
 def MergeCov(covs=list()):
     # Input: list of TMatrixD
     # Output: block-diagonal TMatrixD from combination of inputs
+    from ROOT import TMatrixDSym
     Ntot = sum([X.GetNcols() for X in covs])
     cov = TMatrixDSym(Ntot)
     pos = 0
@@ -3,4 +3,7 @@ from .gridpack_utils import _prepare_gridpack
 from .nanogen_utils import _prepare_nanogen
 
 from .submit_gen import submit_gridpack
-from .submit_gen import submit_nanogen
\ No newline at end of file
+from .submit_gen import submit_nanogen
+
+from .backends import get_backend
+from .job_sizing import size_nanogen_jobs
\ No newline at end of file
@@ -0,0 +1,449 @@
+"""
+backends
+---------------------------------------------------------------------
+Execution backends used by the `submit` mode. A backend knows how to
+run the gridpack and NanoGEN jobs prepared by `setup` for one process
+folder. The condor backend keeps the historical behaviour, while the
+local backend runs the rendered job scripts on a bounded pool of
+worker processes so that small productions can run on a workstation
+or in CI.
+"""
+import os
+import re
+import glob
+import shlex
+import shutil
+import signal
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils import (
+    create_dir,
+    get_logger,
+    JobLedger,
+    condor_ads,
+    parse_cluster_id,
+)
+from .submit_gen import (
+    submit_gridpack,
+    submit_nanogen,
+    build_nanogen_command,
+)
+
+logger = get_logger(__name__)
+
+# Attributes of a condor job copied into its resubmission description: {ClassAd attribute: submit command}
+_RESUBMIT_ATTRIBUTES = {
+    "Cmd": "executable",
+    "Arguments": "arguments",
+    "Iwd": "initialdir",
+    "Out": "output",
+    "Err": "error",
+    "UserLog": "log",
+    "Environment": "environment",
+    "TransferInput": "transfer_input_files",
+    "TransferOutput": "transfer_output_files",
+    "TransferOutputRemaps": "transfer_output_remaps",
+    "ShouldTransferFiles": "should_transfer_files",
+    "WhenToTransferOutput": "when_to_transfer_output",
+    "RequestCpus": "request_cpus",
+    "RequestMemory": "request_memory",
+    "RequestDisk": "request_disk",
+    "JobFlavour": "+JobFlavour",
+    "MaxRuntime": "+MaxRuntime",
+}
+# Submit commands whose value is written as a quoted string
+_QUOTED_COMMANDS = ("arguments", "environment", "transfer_output_remaps")
+
+
+@dataclass
+class LocalJob:
+    """A single job to be executed by the local backend."""
+    name: str
+    script: str
+    workdir: Path
+    kind: str = "gridpack"
+    process: Optional[str] = None
+    nevents: Optional[int] = None
+    args: List[str] = field(default_factory=list)
+    inputs: List[str] = field(default_factory=list)
+    outputs: Dict[str, str] = field(default_factory=dict)
+
+
+class ExecutionBackend:
+    """Interface shared by all the execution backends."""
+
+    name = None
+
+    def __init__(self, ledger: Optional[JobLedger] = None):
+        self.ledger = ledger
+
+    def _record(self, **job):
+        """Record a job in the ledger, if one is attached. Returns the job id."""
+        if self.ledger is None:
+            return None
+        return self.ledger.add_job(backend=self.name, **job)
+
+    def submit_gridpack(self, proc_folder: str, environment: Dict[str, Any]):
+        raise NotImplementedError
+
+    def submit_nanogen(self, proc_folder: str, environment: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class CondorBackend(ExecutionBackend):
+    """Submit the jobs to HTCondor (default)."""
+
+    name = "condor"
+
+    def submit_gridpack(self, proc_folder, environment):
+        stdout = submit_gridpack(proc_folder, environment.get("submit", False))
+        if stdout is None:
+            return
+        procname = proc_folder.rstrip("/").split("/")[-1]
+        cluster_id = parse_cluster_id(stdout)
+        self._record(
+            kind="gridpack",
+            name=f"{procname}_runGridpack",
+            process=procname,
+            cluster_id=cluster_id,
+            proc_id=0,
+            inputs=[os.path.join(proc_folder, "cards.tgz")],
+            log_path=os.path.join(proc_folder, f"{procname}_runGridpack.0.stdlog"),
+            resubmit_cmd=["condor_submit", "run_gridpack_batch.jds"],
+            resubmit_cwd=proc_folder,
+        )
+        return {"njobs": 1, "cluster_id": cluster_id}
+
+    @staticmethod
+    def _submit_description(ad) -> str:
+        """Submit description rerunning the single job described by a ClassAd."""
+        lines = []
+        for attribute, command in _RESUBMIT_ATTRIBUTES.items():
+            value = ad.get(attribute)
+            if value is None or (isinstance(value, str) and value.startswith("/Expr(")):
+                # Unset, or an expression that cannot be copied as a value
+                continue
+            if isinstance(value, str) and (command in _QUOTED_COMMANDS or command.startswith("+")):
+                value = '"' + value.replace('"', '""') + '"'
+            lines.append(f"{command} = {value}")
+        lines.append("queue 1")
+        return "\n".join(lines) + "\n"
+
+    def submit_nanogen(self, proc_folder, environment):
+        stdout = submit_nanogen(proc_folder, environment)
+        if stdout is None:
+            return
+        procname = proc_folder.rstrip("/").split("/")[-1]
+        cluster_id = parse_cluster_id(stdout)
+        njobs = int(environment.get("njobs"))
+        outdir = os.path.join(environment.get("outpath"), environment.get("tag"), "NANOGEN", procname)
+
+        # The condor user log written by mc-prod and a resubmission description
+        # per job are taken from the ClassAds of the submitted cluster. Jobs
+        # without them are followed with condor_q/condor_history by the ledger.
+        ads = {}
+        if cluster_id is not None:
+            ads = {int(ad["ProcId"]): ad for ad in condor_ads([cluster_id], ["ProcId", *_RESUBMIT_ATTRIBUTES])}
+        if len(ads) < njobs:
+            logger.warning(
+                f"{procname}: found {len(ads)} out of {njobs} jobs of cluster {cluster_id} in the queue, "
+                "the others cannot be resubmitted"
+            )
+        resubmit_dir = os.path.join(proc_folder, "nanogen_resubmit")
+        if ads:
+            create_dir(resubmit_dir)
+
+        jobs = []
+        for ijob in range(njobs):
+            name = f"{procname}_nanogen_{ijob}"
+            job = dict(
+                backend=self.name,
+                kind="nanogen",
+                name=name,
+                process=procname,
+                cluster_id=cluster_id,
+                proc_id=ijob,
+                inputs=[os.path.join(proc_folder, "fragment.py")],
+                outputs=[os.path.join(outdir, f"batch{ijob}", "GEN.root")],
+                nevents=int(environment.get("nevents_per_job")),
+            )
+            ad = ads.get(ijob)
+            if ad is not None:
+                if ad.get("UserLog"):
+                    job["log_path"] = os.path.join(ad.get("Iwd") or "", ad["UserLog"])
+                description = os.path.join(resubmit_dir, f"{name}.jds")
+                with open(description, "w") as f:
+                    f.write(self._submit_description(ad))
+                job["resubmit_cmd"] = ["condor_submit", description]
+                job["resubmit_cwd"] = proc_folder
+            jobs.append(job)
+        if self.ledger is not None:
+            self.ledger.add_jobs(jobs)
+        return {"njobs": njobs, "cluster_id": cluster_id}
+
+
+class LocalBackend(ExecutionBackend):
+    """
+    Run the job scripts on the local machine.
+
+    Jobs are executed on a pool of at most `max_workers` concurrent
+    processes. Each job runs inside its own working directory, where the
+    input files are copied and the stdout/stderr are captured. Optional
+    memory (MB) and wall time (s) limits are applied to every job. The
+    memory limit caps the virtual address space (`ulimit -v`), which for
+    cmsRun/ROOT jobs is usually much larger than the memory in use.
+    """
+
+    name = "local"
+
+    def __init__(
+            self,
+            max_workers: Optional[int] = None,
+            max_memory: Optional[int] = None,
+            max_walltime: Optional[int] = None,
+            jobs_dir: Optional[str] = None,
+            ledger: Optional[JobLedger] = None,
+        ):
+        super().__init__(ledger)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_memory = max_memory
+        self.max_walltime = max_walltime
+        self.jobs_dir = jobs_dir
+
+    # ---- Job preparation
+    def _job_dir(self, proc_folder, environment, label):
+        jobs_dir = self.jobs_dir or os.path.join(
+            environment.get("workdir"),
+            environment.get("measurement"),
+            "local_jobs",
+        )
+        procname = proc_folder.rstrip("/").split("/")[-1]
+        return Path(jobs_dir) / procname / label
+
+    def gridpack_jobs(self, proc_folder, environment) -> List[LocalJob]:
+        """Build the (single) job that produces the gridpack of a process."""
+        procname = proc_folder.rstrip("/").split("/")[-1]
+        gridpack_dir = os.path.join(
+            environment.get("outpath"),
+            environment.get("tag"),
+            "gridpacks",
+            procname,
+        )
+        return [
+            LocalJob(
+                name=f"{procname}_runGridpack",
+                process=procname,
+                script=os.path.join(proc_folder, "run_gridpack_batch.sh"),
+                workdir=self._job_dir(proc_folder, environment, "gridpack"),
+                inputs=[os.path.join(proc_folder, "cards.tgz")],
+                outputs={"gridpack.tar.xz": gridpack_dir},
+            )
+        ]
+
+    @staticmethod
+    def _script_mtimes(folder) -> Dict[str, int]:
+        return {
+            path: os.stat(path).st_mtime_ns
+            for path in glob.glob(os.path.join(folder, "**", "*.sh"), recursive=True)
+        }
+
+    @staticmethod
+    def _natural_key(path):
+        """Sort batch2 before batch10."""
+        return [int(tok) if tok.isdigit() else tok for tok in re.split(r"(\d+)", path)]
+
+    def nanogen_jobs(self, proc_folder, environment) -> List[LocalJob]:
+        """
+        Render the NanoGEN job scripts with mc-prod (without submitting them)
+        and build one local job per rendered script. The scripts are the ones
+        printed by mc-prod or, if it does not print them, the ones it created
+        or rewrote during this render: scripts left over from earlier renders
+        are never used.
+        """
+        procname = proc_folder.rstrip("/").split("/")[-1]
+        mcprod = environment.get("mcprod")
+        cwd = os.path.dirname(mcprod)
+        process_dir = os.path.join(mcprod, "processes", procname)
+        cmd = build_nanogen_command(procname, environment, submit=False)
+
+        before = self._script_mtimes(process_dir)
+        result = subprocess.run(cmd, check=True, cwd=cwd, capture_output=True, text=True)
+        logger.debug(result.stdout.strip())
+        printed = {
+            os.path.abspath(os.path.join(cwd, token))
+            for token in result.stdout.split()
+            if token.endswith(".sh") and os.path.isfile(os.path.join(cwd, token))
+        }
+        if printed:
+            scripts = sorted(printed, key=self._natural_key)
+        else:
+            scripts = sorted(
+                (path for path, mtime in self._script_mtimes(process_dir).items() if before.get(path) != mtime),
+                key=self._natural_key,
+            )
+
+        njobs = int(environment.get("njobs"))
+        if len(scripts) != njobs:
+            raise RuntimeError(
+                f"mc-prod rendered {len(scripts)} job script(s) for {procname}, expected one per job ({njobs})"
+            )
+
+        return [
+            LocalJob(
+                name=f"{procname}_nanogen_{ijob}",
+                kind="nanogen",
+                process=procname,
+                nevents=int(environment.get("nevents_per_job")),
+                script=script,
+                args=[str(ijob)],
+                workdir=self._job_dir(proc_folder, environment, f"nanogen/batch{ijob}"),
+                outputs={"GEN.root": os.path.join(
+                    environment.get("outpath"), environment.get("tag"), "NANOGEN", procname, f"batch{ijob}"
+                )},
+            )
+            for ijob, script in enumerate(scripts)
+        ]
+
+    # ---- Execution
+    def _command(self, job, script) -> str:
+        """
+        Shell command running a job script. The memory limit is applied with
+        `ulimit -v` in the shell that execs the script (no preexec_fn, which is
+        not safe in the worker threads).
+        """
+        cmd = " ".join(shlex.quote(arg) for arg in ["bash", os.path.basename(script), *job.args])
+        if self.max_memory:
+            cmd = f"ulimit -v {int(self.max_memory) * 1024} && exec {cmd}"
+        return cmd
+
+    def _rerun_command(self, job, script):
+        """Shell command rerunning a job and copying its outputs (used by the resubmission)."""
+        cmd = self._command(job, script)
+        if self.max_memory:
+            # Keep the limit local to the job, not to the copies
+            cmd = f"( {cmd} )"
+        for output, destination in job.outputs.items():
+            cmd += f" && mkdir -p {shlex.quote(destination)} && cp {shlex.quote(output)} {shlex.quote(destination)}"
+        return cmd
+
+    def run_job(self, job: LocalJob) -> Dict[str, Any]:
+        """Run a single job in its working directory and capture its logs."""
+        create_dir(job.workdir)
+        for infile in job.inputs:
+            shutil.copy2(infile, job.workdir)
+        script = shutil.copy2(job.script, job.workdir)
+
+        stdout_path = job.workdir / f"{job.name}.stdout"
+        stderr_path = job.workdir / f"{job.name}.stderr"
+        start = time.time()
+        status = "done"
+        with open(stdout_path, "w") as stdout, open(stderr_path, "w") as stderr:
+            proc = subprocess.Popen(
+                ["bash", "-c", self._command(job, script)],
+                cwd=job.workdir,
+                stdout=stdout,
+                stderr=stderr,
+                start_new_session=True,
+            )
+            try:
+                returncode = proc.wait(timeout=self.max_walltime)
+            except subprocess.TimeoutExpired:
+                # Kill the whole process group, not only the bash wrapper
+                os.killpg(proc.pid, signal.SIGKILL)
+                returncode = proc.wait()
+                status = "timeout"
+        walltime = time.time() - start
+
+        if status != "timeout" and returncode != 0:
+            status = "failed"
+
+        job_id = self._record(
+            kind=job.kind,
+            name=job.name,
+            process=job.process,
+            state="done" if status == "done" else "failed",
+            inputs=job.inputs,
+            outputs=[os.path.join(dest, out) for out, dest in job.outputs.items()],
+            nevents=job.nevents,
+            resubmit_cmd=["bash", "-c", self._rerun_command(job, script)],
+            resubmit_cwd=str(job.workdir),
+        )
+        if job_id is not None:
+            self.ledger.update(job_id, started_at=start, finished_at=start + walltime, exit_code=returncode)
+
+        if status == "done":
+            for output, destination in job.outputs.items():
+                output_path = job.workdir / output
+                if not output_path.exists():
+                    logger.warning(f"{job.name}: expected output {output} not found")
+                    continue
+                create_dir(destination)
+                shutil.copy2(output_path, destination)
+
+        return {
+            "name": job.name,
+            "status": status,
+            "returncode": returncode,
+            "walltime": walltime,
+            "stdout": str(stdout_path),
+            "stderr": str(stderr_path),
+        }
+
+    def run(self, jobs: List[LocalJob], do_submit: bool) -> Optional[Dict[str, int]]:
+        """Execute a list of jobs on the bounded worker pool and summarize them."""
+        if not do_submit:
+            for job in jobs:
+                logger.info(f"Dry-run: would run {job.script} {' '.join(job.args)} in {job.workdir}")
+            return None
+
+        logger.info(f"Running {len(jobs)} job(s) locally on {self.max_workers} worker(s)")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self.run_job, jobs))
+
+        for res in results:
+            if res["status"] == "done":
+                logger.info(f"{res['name']} finished in {res['walltime']:.0f} s")
+            else:
+                logger.error(f"{res['name']} {res['status']} (return code {res['returncode']}). See {res['stderr']}")
+        return {
+            "njobs": len(results),
+            "failed": sum(res["status"] != "done" for res in results),
+        }
+
+    def submit_gridpack(self, proc_folder, environment):
+        return self.run(self.gridpack_jobs(proc_folder, environment), environment.get("submit", False))
+
+    def submit_nanogen(self, proc_folder, environment):
+        if not environment.get("submit", False):
+            cmd = build_nanogen_command(proc_folder.rstrip("/").split("/")[-1], environment, submit=False)
+            logger.info(f"Dry-run: would render the NanoGEN jobs with: {' '.join(cmd)}")
+            logger.info(f"Dry-run: and run {environment.get('njobs')} job(s) locally")
+            return None
+        return self.run(self.nanogen_jobs(proc_folder, environment), True)
+
+
+BACKEND_REGISTRY = {
+    "condor": CondorBackend,
+    "local": LocalBackend,
+}
+
+
+def get_backend(environment: Dict[str, Any], ledger: Optional[JobLedger] = None) -> ExecutionBackend:
+    """Instantiate the execution backend selected in the environment."""
+    name = environment.get("backend", "condor")
+    if name not in BACKEND_REGISTRY:
+        raise ValueError(f"Unknown backend '{name}'. Available backends: {', '.join(BACKEND_REGISTRY)}")
+
+    if name == "local":
+        return LocalBackend(
+            max_workers=environment.get("max_workers"),
+            max_memory=environment.get("max_memory"),
+            max_walltime=environment.get("max_walltime"),
+            ledger=ledger,
+        )
+    return BACKEND_REGISTRY[name](ledger=ledger)
@@ -0,0 +1,112 @@
+"""
+job_sizing
+---------------------------------------------------------------------
+Choose the NanoGEN job split of a process from the throughput measured
+in previous jobs. The measured events/s and failure rate are read from
+the job ledger, and the number of events per job is chosen so that a
+job lasts for a target duration.
+"""
+import math
+import statistics
+from typing import Any, Dict, Optional
+
+from utils import (
+    JobLedger,
+    get_logger
+)
+
+logger = get_logger(__name__)
+
+
+def measure_throughput(
+        ledger: JobLedger,
+        process: str,
+        min_jobs: int = 5
+    ) -> Optional[Dict[str, float]]:
+    """
+    Return the median events/s and the failure rate of the finished NanoGEN
+    jobs of a process, or None if not enough jobs have been measured. The
+    run times are the start/end times of the last execution of every job
+    (condor user log, condor_history or local run), so the ledger should
+    have been polled before. Every resubmission counts as a failure.
+    """
+    done = ledger.jobs(state="done", kind="nanogen", process=process)
+    failed = ledger.jobs(state="failed", kind="nanogen", process=process)
+
+    rates = [
+        job["nevents"] / (job["finished_at"] - job["started_at"])
+        for job in done
+        if job["nevents"] and job["started_at"] and job["finished_at"] and job["finished_at"] > job["started_at"]
+    ]
+    if len(rates) < min_jobs:
+        return None
+
+    nfailures = sum(job["attempts"] for job in failed) + sum(job["attempts"] - 1 for job in done)
+
+    return {
+        "events_per_second": statistics.median(rates),
+        "failure_rate": nfailures / (len(done) + nfailures),
+        "njobs_measured": len(rates),
+    }
+
+
+def choose_job_split(
+        total_events: int,
+        events_per_second: float,
+        target_duration: float,
+        failure_rate: float = 0.,
+    ) -> Dict[str, Any]:
+    """
+    Pick the number of events per job so that a job lasts `target_duration`
+    seconds, and the number of jobs needed to produce `total_events` once
+    the expected failures are accounted for.
+    """
+    nevents_per_job = max(1, int(events_per_second * target_duration))
+    efficiency = max(1. - failure_rate, 0.05)
+    njobs = math.ceil(total_events / nevents_per_job / efficiency)
+    cpu_hours = njobs * nevents_per_job / events_per_second / 3600.
+    return {
+        "njobs": njobs,
+        "nevents_per_job": nevents_per_job,
+        "expected_job_hours": nevents_per_job / events_per_second / 3600.,
+        "expected_cpu_hours": cpu_hours,
+    }
+
+
+def size_nanogen_jobs(
+        ledger: JobLedger,
+        process: str,
+        environment: Dict[str, Any]
+    ) -> Dict[str, Any]:
+    """
+    Return the `njobs` and `nevents_per_job` to be used for a process. The total
+    number of requested events (njobs x nevents_per_job) is kept, the split is
+    adapted to the measured throughput. Falls back to the requested values
+    when there are no measurements.
+    """
+    njobs = int(environment.get("njobs"))
+    nevents_per_job = int(environment.get("nevents_per_job"))
+    total_events = njobs * nevents_per_job
+    target_duration = float(environment.get("target_job_duration")) * 3600.
+
+    measured = measure_throughput(ledger, process, environment.get("min_measured_jobs", 5))
+    if measured is None:
+        logger.warning(f"{process}: not enough finished jobs in the ledger to measure the throughput.")
+        logger.info(f"{process}: keeping {njobs} jobs x {nevents_per_job} events")
+        return {"njobs": njobs, "nevents_per_job": nevents_per_job}
+
+    split = choose_job_split(
+        total_events,
+        measured["events_per_second"],
+        target_duration,
+        measured["failure_rate"],
+    )
+    logger.info(
+        f"{process}: measured {measured['events_per_second']:.3f} events/s and "
+        f"{measured['failure_rate']:.1%} failures over {measured['njobs_measured']} jobs"
+    )
+    logger.info(
+        f"{process}: {split['njobs']} jobs x {split['nevents_per_job']} events "
+        f"(~{split['expected_job_hours']:.1f} h per job, {split['expected_cpu_hours']:.0f} CPU hours in total)"
+    )
+    return {"njobs": split["njobs"], "nevents_per_job": split["nevents_per_job"]}
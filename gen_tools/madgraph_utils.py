@@ -5,7 +5,7 @@ from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 from .utils import write_text
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 import numpy as np
 
 from utils import (
@@ -169,13 +169,24 @@ def prepare_reweightcards(
     # Write reweight card
     return "\n".join(lines)
 
-def _generate_reweight_points(operators: List[Tuple[str, Any]]) -> List[np.ndarray]:
+def _generate_reweight_points(
+        operators: List[Tuple[str, Any]],
+        dropped_pairs: Optional[List[Tuple[str, str]]] = None
+    ) -> List[np.ndarray]:
     """
-    Generate all reweighting points including SM point.
+    Generate all reweighting points including SM point. Points varying
+    one of the `dropped_pairs` (see gen_tools/prescreening.py) are skipped.
     """
     rwgt_points = get_rwgt_points(operators, 1)
     if len(operators) > 2:
-        rwgt_points += get_rwgt_points(operators, 2)
+        pair_points = get_rwgt_points(operators, 2)
+        if dropped_pairs:
+            dropped = {frozenset(pair[:2]) for pair in dropped_pairs}
+            pair_points = [
+                point for point in pair_points
+                if frozenset(p for p, v in point if float(v) != 0) not in dropped
+            ]
+        rwgt_points += pair_points
 
     # Add SM point by cloning last point and zeroing couplings
     if rwgt_points:
@@ -188,7 +199,8 @@ def _generate_reweight_points(operators: List[Tuple[str, Any]]) -> List[np.ndarr
 def _build_reweight_readme(
         outdir: Path,
         rwgt_points: List[np.ndarray],
-        operators: List[Tuple[str, Any]]
+        operators: List[Tuple[str, Any]],
+        prescreening: Optional[Dict[str, Any]] = None
     ) -> str:
 
     """
@@ -211,9 +223,39 @@ def _build_reweight_readme(
         label = "SM" if not nonzero else ", ".join(nonzero)
         lines.append(f"| {label} | {i} |")
 
+    if prescreening:
+        lines += _build_prescreening_section(prescreening, len(rwgt_points))
+
     with open( outdir / "README.md", "w") as f:
         f.write( "\n".join(lines) )
 
+def _build_prescreening_section(prescreening: Dict[str, Any], npoints: int) -> List[str]:
+    """
+    README lines summarizing the operator prescreening and the saving.
+    """
+    ndropped = prescreening["npoints_before"] - npoints
+    fmt = lambda val: "not found" if val is None else f"{val:.3g}"
+
+    lines = [
+        "",
+        "## Prescreening",
+        f"Operator pairs with a cross term below {prescreening['threshold']} in the dim6top tables "
+        f"{prescreening['tables']} were removed from the reweight card.",
+        f"Reweighting points: {prescreening['npoints_before']} -> {npoints} "
+        f"({ndropped / prescreening['npoints_before']:.0%} fewer weights to compute and store).",
+        "",
+        "| Operator | Squared term |",
+        "| :------- | :----------- |",
+    ]
+    lines += [f"| {op} | {fmt(val)} |" for op, val in prescreening["operators"]]
+    lines += [
+        "",
+        "| Dropped pair | Cross term |",
+        "| :----------- | :--------- |",
+    ]
+    lines += [f"| {op1}, {op2} | {fmt(val)} |" for op1, op2, val in prescreening["dropped_pairs"]]
+    return lines
+
 def _build_reweight_mapping(
         outdir: Path,
         rwgt_points: List[np.ndarray],
@@ -0,0 +1,88 @@
+"""
+prescreening
+---------------------------------------------------------------------
+Rank the operators and operator pairs of a measurement by their impact
+on the cross section, using the dim6top tables in utils/dim6top_tables.
+Pairs whose cross term is negligible in all the selected tables can be
+dropped from the reweight card, since the corresponding points do not
+constrain anything.
+"""
+import itertools
+import os
+from typing import Any, Dict, List, Tuple
+
+from utils import get_logger
+from utils.plot_dim6top_tables import parse_latex_table
+
+logger = get_logger(__name__)
+
+DIM6TOP_TABLES_PATH = "utils/dim6top_tables/arxiv"
+
+
+def load_quadratic_tables(tables: List[str], path: str = DIM6TOP_TABLES_PATH):
+    """
+    Load the squared (quadratic) dim6top tables of the given processes
+    (e.g. ["tta", "tt"]), indexed by the UFO operator names.
+    """
+    dfs = {}
+    for table in tables:
+        fname = os.path.join(path, f"squared_{table}.tex")
+        if not os.path.exists(fname):
+            raise FileNotFoundError(f"dim6top table {fname} not found")
+        df = parse_latex_table(fname, label_format="dim6top")
+        dfs[table] = df.set_index(df.columns[0]).fillna(0.)
+    return dfs
+
+
+def _max_abs(dfs, op1, op2):
+    """Largest |coefficient| of (op1, op2) over the tables. The tables are triangular."""
+    vals = []
+    for df in dfs.values():
+        for a, b in ((op1, op2), (op2, op1)):
+            if a in df.index and b in df.columns:
+                vals.append(abs(float(df.loc[a, b])))
+    return max(vals) if vals else None
+
+
+def rank_operators(dfs, operator_names: List[str]) -> List[Tuple[str, float]]:
+    """Operators sorted by the size of their squared term."""
+    ranking = [(op, _max_abs(dfs, op, op)) for op in operator_names]
+    return sorted(ranking, key=lambda x: -1 if x[1] is None else x[1], reverse=True)
+
+
+def rank_pairs(dfs, operator_names: List[str]) -> List[Tuple[str, str, float]]:
+    """Operator pairs sorted by the size of their cross term."""
+    ranking = [(op1, op2, _max_abs(dfs, op1, op2)) for op1, op2 in itertools.combinations(operator_names, 2)]
+    return sorted(ranking, key=lambda x: -1 if x[2] is None else x[2], reverse=True)
+
+
+def prescreen_operators(
+        operators: List[Tuple[str, Any]],
+        config: Dict[str, Any]
+    ) -> Dict[str, Any]:
+    """
+    Return the ranking of the operators and of the pairs, and the pairs
+    whose cross term is below `config["threshold"]` in all the tables
+    listed in `config["tables"]`. Pairs involving an operator missing
+    from the tables are always kept.
+    """
+    tables = config.get("tables", [])
+    threshold = float(config.get("threshold", 0.))
+    dfs = load_quadratic_tables(tables, config.get("path", DIM6TOP_TABLES_PATH))
+
+    operator_names = [op[0] for op in operators]
+    missing = [op for op in operator_names if all(op not in df.index for df in dfs.values())]
+    if missing:
+        logger.warning(f"Operators not found in the dim6top tables {tables}, keeping all their pairs: {missing}")
+
+    pairs = rank_pairs(dfs, operator_names)
+    dropped = [(op1, op2, val) for op1, op2, val in pairs if val is not None and val < threshold]
+    logger.info(f"Prescreening: dropping {len(dropped)} of {len(pairs)} operator pairs (threshold {threshold})")
+
+    return {
+        "tables": tables,
+        "threshold": threshold,
+        "operators": rank_operators(dfs, operator_names),
+        "pairs": pairs,
+        "dropped_pairs": dropped,
+    }
@@ -5,28 +5,27 @@ from utils import (
 )
 logger = get_logger(__name__)
 
-cwd = os.getcwd()
 def submit_gridpack( proc_folder, do_submit ):
     """Submit gridpack generation job for a given process folder."""
     logger.info(f"Submitting gridpack generation for process folder: {proc_folder}")
     cmd = ["condor_submit", "run_gridpack_batch.jds"]
     if do_submit:
-        os.chdir( proc_folder )
-        subprocess.run(
+        result = subprocess.run(
             cmd,
-            check=True
+            cwd=proc_folder,
+            check=True,
+            capture_output=True,
+            text=True
         )
-        os.chdir( cwd )
+        logger.info( result.stdout.strip() )
+        return result.stdout
     else:
         logger.info(f"Dry-run: would submit gridpack generation in {proc_folder}")
         logger.info(f"To submit, run: cd {proc_folder}; {' '.join(cmd)}; cd -")
 
-def submit_nanogen( proc_folder, environment ):
-    """Submit nanogen generation job for a given process folder."""
-    logger.info(f"Submitting nanogen generation for process folder: {proc_folder}")
+def build_nanogen_command( process, environment, submit=True ):
+    """Build the mc-prod command that prepares (and submits) the nanogen jobs of a process."""
     tag = environment.get("tag")
-    process = proc_folder.rstrip("/").split("/")[-1]
-
     outpath = f"{environment.get('outpath')}/{tag}/NANOGEN/"
     cmd = [
         "python3", 
@@ -37,16 +36,27 @@ def submit_nanogen( proc_folder, environment ):
         f"--nevents-per-job", str(environment.get('nevents_per_job')),
         f"--njobs", str(environment.get('njobs')),
         "--backend", "condor", 
-        "--submit", 
     ]
+    if submit:
+        cmd.append("--submit")
+    return cmd
+
+def submit_nanogen( proc_folder, environment ):
+    """Submit nanogen generation job for a given process folder."""
+    logger.info(f"Submitting nanogen generation for process folder: {proc_folder}")
+    process = proc_folder.rstrip("/").split("/")[-1]
+
+    cmd = build_nanogen_command( process, environment )
     if environment.get("submit", False):
-        subprocess.run(
+        result = subprocess.run(
             cmd,
-            check=True
+            cwd=environment.get("mainpath"),
+            check=True,
+            capture_output=True,
+            text=True
         )
+        logger.info( result.stdout.strip() )
+        return result.stdout
     else:
         logger.info(f"Dry-run: would submit nanogen generation in {proc_folder}")
         logger.info(f"To submit, run: {' '.join(cmd)}")
-
-
-
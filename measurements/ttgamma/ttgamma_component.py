@@ -12,6 +12,14 @@ from utils import (
     get_logger
 )
 
+from utils.covariance import cov_from_corr
+
+from utils.eft_scaling import (
+    fit_quadratic,
+    log_fit_quality,
+    scaling_json_terms
+)
+
 from utils.hepdata_to_root import (
     read_hepdata_to_th1,
     read_hepdata_to_graph
@@ -66,12 +74,7 @@ class ttgamma_component(components.component):
 
         # Convert correlation matrix to covariance matrix
         nbins = len(datavalues)
-        data_totalcov = np.zeros( (nbins, nbins) )
-
-        data_totalcorr_reshape = data_totalcorr.reshape( (nbins, nbins) )
-        for i in range( nbins ):
-            for j in range( nbins ):
-                data_totalcov[i][j] = data_totalcorr_reshape[i][j] * dataerrors[i] * dataerrors[j]
+        data_totalcov = cov_from_corr( data_totalcorr, dataerrors )
 
         sm, smlabels = components.component.read_hepdata(
             self.central_values,
@@ -110,81 +113,54 @@ class ttgamma_component(components.component):
             group_index=2
         )
 
-        filter_histograms = [ 
-            f"TTGEFT__{opname}" for opname in mapping.keys() 
+        # The mapping also has an "SM" entry: it must only enter once
+        filter_histograms = [ "TTGEFT__SM" ] + [ 
+            f"TTGEFT__{point}" for point in mapping.keys() if point != "SM"
         ]
         
         shapes = components.component.read_cmgrdf_shapes( 
             self.eftshapes,
             filter_histograms = filter_histograms
         )
-
-        sm = components.component.read_cmgrdf_shapes(
-            self.eftshapes,
-            filter_histograms = [ "TTGEFT__SM" ]
-        )["TTGEFT__SM"]
+        sm = shapes["TTGEFT__SM"]
+
+        # Every available reweight point (plus the SM) enters the fit of the
+        # quadratic parametrization. The normalization to the lumi and the
+        # bin widths cancels in the relative terms, it is kept for clarity.
+        lumi = TopCombEnv().lumis[ self.dataset ]
+        operators = sorted({ op for point in mapping.values() for op in point["all_couplings"] })
+        points = [ ("SM", {}) ] + [
+            (name, point["all_couplings"]) for name, point in mapping.items()
+            if name != "SM" and f"TTGEFT__{name}" in shapes
+        ]
+        missing = [ name for name in mapping if name != "SM" and f"TTGEFT__{name}" not in shapes ]
+        if missing:
+            logger.warning(f"No EFT shape for the reweight points: {', '.join(missing)}")
+
+        couplings = np.array([
+            [ float(values.get(op, 0.)) for op in operators ] for _, values in points
+        ])
+        xsecs = [
+            shapes[f"TTGEFT__{name}"].divide_by_width().scale( 1. / lumi ) for name, _ in points
+        ]
+        fit = fit_quadratic(
+            operators,
+            couplings,
+            np.array([ xsec.contents for xsec in xsecs ]),
+            np.array([ xsec.variances[1:-1] for xsec in xsecs ]),
+        )
+        log_fit_quality( fit, self.get_bin_labels( sm.nbins ) )
 
         ret = {
-            "bin_labels" : self.get_bin_labels( len(sm) ),
-            "terms" : [],
-            "parameters" : [],
+            "bin_labels" : self.get_bin_labels( sm.nbins ),
+            **scaling_json_terms( fit ),
             "nbins" : len(smlabels),
             "bin_edges" : smlabels,
             "sm_vals" : smhepdata.tolist(),
+            "fit" : {
+                "chi2" : fit.chi2.tolist(),
+                "ndof" : fit.ndof,
+            },
         }
 
-        
-        for shape in shapes.values():
-            # Let's skip these for the moment
-            if "minus" in shape.GetName() or "SM" in shape.GetName():
-                continue
-            term = shape.GetName().split("__")[-1]
-
-            op_list = term.split("_")
-
-            if len(op_list) == 1:
-                op_name = op_list[0].replace("1p0", "")
-                if op_name not in mapping:
-                    ret["parameters"].append( op_name )
-
-            opnames = [
-                op.replace("1p0", "") for op in op_list 
-            ]
-
-            scaling = [
-                opnames,
-                [], # Central values
-                [], # errors
-            ] 
-        
-            for ibin in range(1, shape.GetNbinsX() + 1):
-                bin_content = shape.GetBinContent(ibin)
-                bin_error = shape.GetBinError(ibin)
-
-                # Divide by lumi
-                bin_content /= TopCombEnv().lumis[ self.dataset]
-                bin_error /= TopCombEnv().lumis[ self.dataset]
-
-
-                # Divide by width
-                bin_width = shape.GetXaxis().GetBinWidth(ibin)
-                bin_content /= bin_width
-                bin_error /= bin_width
-
-                sm_content = sm.GetBinContent(ibin)
-                sm_content /= TopCombEnv().lumis[ self.dataset]
-                sm_content /= bin_width
-
-                if sm != 0:
-                    # scaling[1].append(bin_content / sm[ibin-1])
-                    # scaling[2].append(bin_error / sm[ibin-1]) # No error for the moment
-                    scaling[1].append(bin_content / sm_content )
-                    scaling[2].append(bin_error / sm_content )
-                else:
-                    scaling[1].append(ibin, 0.0)
-                    scaling[2].append(ibin, 0.0)
-
-                
-            ret["terms"].append( scaling )  
-            
         return ret
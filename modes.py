@@ -53,8 +53,17 @@ def _setup():
         # Setup the common part (reweighting maps and whatnot)
         measurement_dir = Path(environment.get("workdir")) / measurement_name
         os.makedirs( measurement_dir , exist_ok=True )
+        # Optionally drop the operator pairs with a negligible cross term
+        prescreening = None
+        if measurement_config.get("prescreening"):
+            # Needs pandas, only imported when used
+            from gen_tools.prescreening import prescreen_operators
+            prescreening = prescreen_operators(operators, measurement_config.get("prescreening"))
+            prescreening["npoints_before"] = len(madgraph_utils._generate_reweight_points(operators))
+
         rwgt_points = madgraph_utils._generate_reweight_points(
-            operators
+            operators,
+            prescreening["dropped_pairs"] if prescreening else None
         )
 
         # Save a mapping json tied to the measurement phase space
@@ -68,7 +77,8 @@ def _setup():
         madgraph_utils._build_reweight_readme(
             measurement_dir,
             rwgt_points,
-            operators
+            operators,
+            prescreening
         )
 
         ## Process each sample
@@ -124,69 +134,179 @@ def _setup():
     
     return setup_gen_config
 
+def _select_processes(process_folders, patterns):
+    """Select process folders by name, glob pattern or 'all'."""
+    import fnmatch
+    if any( pattern.lower() == "all" for pattern in patterns ):
+        return process_folders
+    selected = []
+    for pattern in patterns:
+        matches = fnmatch.filter(process_folders, pattern)
+        if not matches:
+            logger.warning(f"No process folder matches '{pattern}'")
+        selected.extend( m for m in matches if m not in selected )
+    return selected
+
+def _ask_processes(process_folders):
+    """Interactive selection of the process folders (only used from a terminal)."""
+    try:
+        choice = input("\nSelect process folder number (or 'all' to submit all): ").strip()
+        
+        if choice.lower() == 'all':
+            return process_folders
+        choice_idx = int(choice) - 1
+        if 0 <= choice_idx < len(process_folders):
+            return [process_folders[choice_idx]]
+        logger.error(f"Invalid selection. Please choose between 1 and {len(process_folders)}")
+    except ValueError:
+        logger.error("Invalid input. Please enter a number or 'all'")
+    except KeyboardInterrupt:
+        logger.info("\nSubmission cancelled by user.")
+    return []
+
 def _submit_gen():
     """Builder for setting up GEN related aspects."""
-    from gen_tools import submit_gridpack, submit_nanogen
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    from gen_tools import get_backend, size_nanogen_jobs
+    from utils import JobLedger
     def submit_gen( environment ):
         """Submit gridpack or nanogen generation jobs based on the environment settings."""
         what = environment.get("what") 
-        submit = environment.get("submit")
         combdir = environment.get("workdir")
         measurement_name = environment.get("measurement")
 
+        if what not in ("gridpack", "nanogen"):
+            logger.error(f"Unknown 'what' option: {what}. Choose between 'gridpack' or 'nanogen'.")
+            return
+
         # Check if the processes directory exists
         processes_path = os.path.join(combdir, measurement_name, "mcgen")
-        print( os.listdir( processes_path ) )
         if not os.path.isdir(processes_path):
             logger.error(f"No 'processes' folder found in {combdir}. Run setup first.")
             return
         
         # List all folders inside processes
-        process_folders = [f for f in os.listdir(processes_path) 
-                          if os.path.isdir(os.path.join(processes_path, f))]
+        process_folders = sorted(f for f in os.listdir(processes_path) 
+                          if os.path.isdir(os.path.join(processes_path, f)))
         
         if not process_folders:
             logger.error(f"No process folders found in {processes_path}")
             return
         
-        # Display available folders and ask user to select
         logger.info(f"Found {len(process_folders)} process folder(s) in {processes_path}:")
         for idx, folder in enumerate(process_folders, 1):
             logger.debug(f"  {idx}. {folder}")
         
-        # Get user input
-        try:
-            choice = input("\nSelect process folder number (or 'all' to submit all): ").strip()
-            
-            if choice.lower() == 'all':
-                selected_folders = process_folders
-            else:
-                choice_idx = int(choice) - 1
-                if 0 <= choice_idx < len(process_folders):
-                    selected_folders = [process_folders[choice_idx]]
-                else:
-                    logger.error(f"Invalid selection. Please choose between 1 and {len(process_folders)}")
-                    return
-        except ValueError:
-            logger.error("Invalid input. Please enter a number or 'all'")
+        # Select the processes from the command line, or ask if running from a terminal
+        patterns = environment.get("processes")
+        if patterns:
+            selected_folders = _select_processes( process_folders, patterns )
+        elif sys.stdin.isatty():
+            selected_folders = _ask_processes( process_folders )
+        else:
+            logger.error("No processes selected. Use --processes (names, globs or 'all').")
             return
-        except KeyboardInterrupt:
-            logger.info("\nSubmission cancelled by user.")
+
+        if not selected_folders:
+            logger.error("No process selected for submission")
             return
         
-        # Submit selected folders
-        for proc in selected_folders:
+        # Submit selected folders through the chosen execution backend
+        ledger = JobLedger( os.path.join(combdir, "jobs.sqlite") )
+        backend = get_backend( environment, ledger = ledger )
+        logger.info(f"Using the '{backend.name}' execution backend")
+        if what == "nanogen" and environment.get("target_job_duration"):
+            # Measure the throughput on up-to-date job states, once for all the processes
+            ledger.poll()
+
+        def submit_one( proc ):
             proc_folder = os.path.join(processes_path, proc)
             logger.info(f"Submitting {proc}...")
-            
-            if what == "gridpack":
-                submit_gridpack( proc_folder, submit )
-            elif what == "nanogen":
-                submit_nanogen( proc_folder, environment )
+            try:
+                if what == "gridpack":
+                    return proc, backend.submit_gridpack( proc_folder, environment ), None
+                proc_environment = environment
+                if environment.get("target_job_duration"):
+                    # Adapt the job split to the throughput measured in previous jobs
+                    proc_environment = {
+                        **environment,
+                        **size_nanogen_jobs( ledger, proc, environment ),
+                    }
+                return proc, backend.submit_nanogen( proc_folder, proc_environment ), None
+            except Exception as e:
+                return proc, None, e
+
+        # The local backend already runs the jobs on a pool: one process at a time
+        nworkers = 1 if backend.name == "local" else min(environment.get("parallel_submit") or 8, len(selected_folders))
+        with ThreadPoolExecutor( max_workers = nworkers ) as pool:
+            results = list( pool.map( submit_one, selected_folders ) )
+
+        # Gather everything into one summary
+        logger.info(f"Submission summary ({what}, {backend.name} backend):")
+        nfailed = 0
+        for proc, result, error in results:
+            if error is not None:
+                nfailed += 1
+                logger.error(f"  {proc}: FAILED ({error})")
+            elif result is None:
+                logger.info(f"  {proc}: dry-run")
             else:
-                logger.error(f"Unknown 'what' option: {what}. Choose between 'gridpack' or 'nanogen'.")
+                details = ", ".join( f"{k}={v}" for k, v in result.items() if v is not None )
+                logger.info(f"  {proc}: submitted ({details})")
+        if nfailed:
+            logger.error(f"{nfailed} out of {len(results)} process(es) failed to submit")
     return submit_gen
 
+def _status():
+    """Builder for 'status' mode."""
+    import time
+    from utils import JobLedger
+    def job_status( environment ) -> None:
+        """
+        Poll the job ledger, resubmit failed jobs and duplicate stragglers
+        if requested, and print a summary of the production.
+        """
+        ledger_path = environment.get("ledger") or os.path.join(environment.get("workdir"), "jobs.sqlite")
+        if not os.path.exists(ledger_path):
+            logger.error(f"No job ledger found in {ledger_path}. Submit some jobs first.")
+            return
+
+        ledger = JobLedger( ledger_path )
+        while True:
+            ledger.poll()
+            if environment.get("resubmit"):
+                nresub = ledger.resubmit_failed(
+                    max_retries = environment.get("max_retries"),
+                    backoff = environment.get("backoff"),
+                )
+                logger.info(f"Resubmitted {nresub} failed job(s)")
+            if environment.get("stragglers") is not None:
+                ndup = ledger.duplicate_stragglers( factor = environment.get("stragglers") )
+                logger.info(f"Duplicated {ndup} straggler(s)")
+
+            # Failed jobs are only waited for while they will be resubmitted
+            summary = ledger.summary(
+                kind = environment.get("kind"),
+                max_retries = environment.get("max_retries") if environment.get("resubmit") else None,
+            )
+            logger.info(f"Jobs in {ledger_path}: {summary['total']}")
+            for state, count in sorted(summary["counts"].items()):
+                logger.info(f"  {state:<12} {count}")
+            if summary["throughput_per_hour"] is not None:
+                eta_hours = summary["eta_seconds"] / 3600.
+                logger.info(f"Throughput: {summary['throughput_per_hour']:.1f} jobs/h. ETA: {eta_hours:.1f} h")
+            if summary["exhausted"]:
+                names = ", ".join(summary["exhausted"][:10]) + (", ..." if len(summary["exhausted"]) > 10 else "")
+                logger.warning(f"{len(summary['exhausted'])} failed job(s) will not be resubmitted: {names}")
+
+            watch = environment.get("watch")
+            if not watch or summary["remaining"] == 0:
+                break
+            time.sleep( watch )
+
+    return job_status
+
 def _reinterpret():
     """Builder for 'reinterpret' mode."""
     from reinterpret_tools.reinterpret import reinterpret_one_measurement
@@ -227,36 +347,27 @@ def _reinterpret():
     return make_reinterpretation
 
 def _cook():
-    """Builder for 'reinterpret' mode."""
+    """Builder for 'cook' mode."""
     def cook_inputs( environment ) -> None:
 
         """
         Top-level entry to prepare the inputs for the combination,
         based on the results of the reinterpretation.
         """
-        main_config = environment.get("main_config")["MEASUREMENTS"]
-        measurement_name = environment.get("measurement")
-        measurement_config = main_config.get( measurement_name )
-        observable = measurement_config.get("observable")
-
-        logger.info(f"Preparing inputs for measurement {measurement_name}, observable {observable}")
-
-        config_path = os.path.join(
-            "measurements",
-            measurement_name,
-            "observable_configs",
-            f"{observable}.yaml"
-        )
-        from utils.combination_chef import CombinationChef
-        chef = CombinationChef(
-            measurement_name=measurement_name,
-            observable=observable,
-            config_path=config_path,
-            environment=environment,
+        from utils.combination_chef import cook_all
+        if environment.get("all"):
+            measurement_names = environment.get("main_config").get("MEASUREMENTS_LIST", [])
+        else:
+            measurement_names = [ environment.get("measurement") ]
+
+        logger.info(f"Preparing inputs for measurements {', '.join(measurement_names)}")
+        cook_all(
+            environment,
+            measurement_names,
+            ncores = environment.get("ncores"),
+            force = environment.get("force"),
         )
 
-        
-
     return cook_inputs 
 
 def _setup_combine():
@@ -298,6 +409,9 @@ MODE_REGISTRY = {
     "submit": {
         "funcs": [_submit_gen],
     },
+    "status": {
+        "funcs": [_status],
+    },
     "reinterpret": {
         "funcs": [_reinterpret],
     },
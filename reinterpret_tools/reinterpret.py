@@ -8,6 +8,7 @@ from utils import (
     get_logger,
     load_module_from_path
 )
+from utils.histogram_sidecar import write_sidecars
 from environment import TopCombEnv
 
 from CMGRDF import Processor
@@ -266,4 +267,7 @@ def reinterpret_one_measurement(
         f"{outpath}/{measurement_name}" + "/{flow}",
         maxRatioRange=(0.5, 1.5),
         showRatio=True,
-    )
\ No newline at end of file
+    )
+
+    # Binary sidecars of the JSON outputs, for fast partial reads
+    write_sidecars(f"{outpath}/{measurement_name}")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Measure the start-up time of every top-comb.py mode: the driver and the
+mode builders are imported in a fresh interpreter (without running the
+mode) and the heavy dependencies that got loaded are reported. Exits with
+an error if a mode loads a heavy dependency it is not allowed to, or if it
+takes longer than --max-seconds, so it can be used to catch regressions.
+
+Run it from the top-level folder:
+    python3 scripts/benchmark_startup.py [-m setup submit] [-n 3] [--max-seconds 2]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+sys.path.insert(0, __file__.rsplit("/", 2)[0])  # toplevel path
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+HEAVY_MODULES = ["ROOT", "CMGRDF", "torch", "pandas", "uproot"]
+
+# Heavy modules each mode is expected to need
+ALLOWED_MODULES = {
+    "setup": [],
+    "submit": [],
+    "status": [],
+    "setup_combine": [],
+    "reinterpret": ["ROOT", "CMGRDF", "pandas"],
+    "cook": ["ROOT", "pandas"],
+}
+
+PROBE = """
+import sys, time, json, importlib.util
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("topcomb_main", "top-comb.py")
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+from modes import MODE_REGISTRY
+error = None
+try:
+    for builder in MODE_REGISTRY[{mode!r}]["funcs"]:
+        builder()
+except ImportError as e:
+    error = str(e)
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "heavy": [m for m in {heavy!r} if m in sys.modules],
+    "error": error,
+}}))
+"""
+
+
+def add_parsing_options():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--modes", nargs="+", default=list(ALLOWED_MODULES), help="Modes to benchmark.")
+    parser.add_argument("-n", "--repeat", default=3, type=int, help="Number of measurements per mode (the fastest is kept).")
+    parser.add_argument("--max-seconds", dest="max_seconds", default=None, type=float, help="Fail if a mode takes longer to start.")
+    return parser.parse_args()
+
+
+def probe_mode(mode):
+    """Import the driver and the builders of a mode in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(mode=mode, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Probing mode {mode} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    opts = add_parsing_options()
+    failures = []
+    for mode in opts.modes:
+        results = [probe_mode(mode) for _ in range(opts.repeat)]
+        best = min(results, key=lambda r: r["seconds"])
+        unexpected = sorted(set(best["heavy"]) - set(ALLOWED_MODULES.get(mode, [])))
+
+        msg = f"{mode:>14}: {best['seconds']:.2f} s, heavy modules: {', '.join(best['heavy']) or 'none'}"
+        if best["error"]:
+            msg += f" (builder could not be imported: {best['error']})"
+        logger.info(msg)
+
+        if unexpected:
+            failures.append(f"{mode} loads {', '.join(unexpected)}")
+        if opts.max_seconds is not None and best["seconds"] > opts.max_seconds:
+            failures.append(f"{mode} takes {best['seconds']:.2f} s to start (max {opts.max_seconds} s)")
+
+    for failure in failures:
+        logger.error(failure)
+    sys.exit(1 if failures else 0)
@@ -62,7 +62,8 @@ if __name__ == "__main__":
     channels = logistics.get("channels")
 
     for ch in channels:
-        jsonfiles = glob.glob(f"{inpath}/{ch}/*.json")
+        # Skip the index files of the binary sidecars
+        jsonfiles = [f for f in glob.glob(f"{inpath}/{ch}/*.json") if not f.endswith(".hist.json")]
         for json_file in jsonfiles:
             plot_name = json_file.split("/")[-1].replace(".json", "")
             logger.info(f"Processing {json_file}...")
@@ -26,9 +26,28 @@ def add_submit_gen_parser(subparsers):
     submit_gen_parser = subparsers.add_parser("submit", help="Prepare code for generating gridpacks and nanogen inputs.")
     submit_gen_parser.add_argument("-w", "--what", default="gridpack", help="Choose between: gridpack/nanogen")
     submit_gen_parser.add_argument("-s", "--submit", default=False, action = "store_true", help="Actually submit or dry run.")
-    submit_gen_parser.add_argument("-j", "--njobs", default = 5000, help="How many jobs to submit.")
-    submit_gen_parser.add_argument("-n", "--nevents-per-job", dest = "nevents_per_job", default = 200, help="How many nanogen events are run per jobs.")
+    submit_gen_parser.add_argument("-j", "--njobs", default = 5000, type=int, help="How many jobs to submit.")
+    submit_gen_parser.add_argument("-n", "--nevents-per-job", dest = "nevents_per_job", default = 200, type=int, help="How many nanogen events are run per jobs.")
+    submit_gen_parser.add_argument("--target-job-duration", dest="target_job_duration", default=None, type=float, help="Adapt the nanogen job split so that jobs last this many hours, based on previous jobs of the same process. The total number of events (njobs x nevents-per-job) is kept.")
+    submit_gen_parser.add_argument("--min-measured-jobs", dest="min_measured_jobs", default=5, type=int, help="Minimum number of finished jobs needed to measure the throughput of a process.")
+    submit_gen_parser.add_argument("-p", "--processes", nargs="+", default=None, help="Processes to submit: names, glob patterns or 'all'. Asked interactively if not given.")
+    submit_gen_parser.add_argument("--parallel-submit", dest="parallel_submit", default=8, type=int, help="How many processes are submitted concurrently.")
+    submit_gen_parser.add_argument("-b", "--backend", default="condor", choices=["condor", "local"], help="Where to run the jobs: HTCondor or the local machine.")
+    submit_gen_parser.add_argument("--max-workers", dest="max_workers", default=None, type=int, help="Maximum number of concurrent jobs (local backend only).")
+    submit_gen_parser.add_argument("--max-memory", dest="max_memory", default=None, type=int, help="Virtual memory limit per job in MB (local backend only). Applied with 'ulimit -v', which caps the address space and not the memory in use: cmsRun/ROOT jobs reserve much more address space than they touch, so allow a generous margin.")
+    submit_gen_parser.add_argument("--max-walltime", dest="max_walltime", default=None, type=int, help="Wall time limit per job in seconds (local backend only).")
     
+def add_status_parser(subparsers):
+    """Add options for monitoring the submitted jobs."""
+    status_parser = subparsers.add_parser("status", help="Summarize, resubmit and follow the submitted jobs.")
+    status_parser.add_argument("--ledger", default=None, help="Path to the job ledger (default: <workdir>/jobs.sqlite).")
+    status_parser.add_argument("-k", "--kind", default=None, help="Only consider jobs of this kind: gridpack/nanogen/merge")
+    status_parser.add_argument("-r", "--resubmit", default=False, action="store_true", help="Resubmit failed jobs.")
+    status_parser.add_argument("--max-retries", dest="max_retries", default=3, type=int, help="Maximum number of resubmissions per job.")
+    status_parser.add_argument("--backoff", default=600., type=float, help="Base delay in seconds before resubmitting (doubled at each attempt).")
+    status_parser.add_argument("--stragglers", default=None, type=float, help="Duplicate running jobs slower than this factor times the median run time.")
+    status_parser.add_argument("-w", "--watch", default=None, type=int, help="Keep polling every N seconds until all jobs are finished.")
+
 def add_reinterpret_parser(subparsers):
     """Add options for reinterpretation."""
     reinterpret_parser = subparsers.add_parser("reinterpret", help="Run the reinterpretation of differential measurements.")
@@ -41,6 +60,9 @@ def add_reinterpret_parser(subparsers):
 def add_cook_inputs_parser(subparsers):
     """Add options for reinterpretation."""
     cook_parser = subparsers.add_parser("cook", help="Prepare the input json files to the combination code.")
+    cook_parser.add_argument("--all", default=False, action="store_true", help="Cook all the measurements in MEASUREMENTS_LIST (and all their observables).")
+    cook_parser.add_argument("--ncores", default=4, type=int, help="Number of measurements/observables cooked concurrently.")
+    cook_parser.add_argument("-f", "--force", default=False, action="store_true", help="Cook again even if the inputs did not change.")
 
 def add_combine_parser(subparsers):
     """Add options for combine."""
@@ -56,6 +78,7 @@ def main():
     subparsers = parser.add_subparsers(dest="mode")
     add_setup_parser(subparsers)
     add_submit_gen_parser(subparsers)
+    add_status_parser(subparsers)
     add_reinterpret_parser(subparsers)
     add_cook_inputs_parser(subparsers)
     add_combine_parser(subparsers)
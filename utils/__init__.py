@@ -1,4 +1,26 @@
 from .auxiliars import *
 from .check_reweight_card import *
 from .logger import *
-from .json_to_root import read_json_histograms, JSONtoROOTConverter
\ No newline at end of file
+
+# Lazily imported attributes: {name: submodule}. The submodules are only
+# imported on first access, so that modes that do not need them start fast.
+_LAZY_ATTRIBUTES = {
+    "JobLedger": "job_ledger",
+    "parse_cluster_id": "job_ledger",
+    "condor_ads": "job_ledger",
+    "read_json_histograms": "json_to_root",
+    "JSONtoROOTConverter": "json_to_root",
+    "Histogram": "histogram",
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        module = importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
@@ -10,16 +10,20 @@ import shutil
 import json
 
 import importlib.util
+from functools import lru_cache
 # Create the logger instance
 from utils.logger import get_logger
 logger = get_logger( __name__ )
 
 
-from environment import TopCombEnv
-settings = TopCombEnv().model_dump()
-main_path = settings.get("mainpath")
-if main_path is None:
-    raise ValueError("mainpath not found in environment settings")
+@lru_cache(maxsize=None)
+def get_main_path():
+    """ Main path of the framework, read from the environment settings on first use """
+    from environment import TopCombEnv
+    main_path = TopCombEnv().model_dump().get("mainpath")
+    if main_path is None:
+        raise ValueError("mainpath not found in environment settings")
+    return main_path
 
 def load_config( config_path ) -> dict:
     """ Loads a configuration file written in yml format """
@@ -58,10 +62,8 @@ def create_workdir_info_file(workdir: str):
 
 def open_template( template_file ):
     """Read and return the content of a template file """
-    if main_path is None:
-        raise ValueError("mainpath not found in environment settings")
     with open(
-            os.path.join(main_path, template_file)
+            os.path.join(get_main_path(), template_file)
         ) as f:
         return f.read()
 
@@ -1,64 +1,124 @@
-
 """ Class to handle things that are required by the combination code """
+import os
+import glob
+import json
+import inspect
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
 from environment import TopCombEnv
 from .auxiliars import (
     load_config, 
     get_logger,
 )
-
-from .json_to_root import read_json_histograms
-import json
-from .hepdata_to_root import (
-    read_hepdata_to_graph,
-    read_hepdata_to_th1
+from .component_registry import (
+    get_component,
+    get_observables,
 )
 
 
 logger = get_logger(__name__)
 
+MANIFEST_NAME = "cook_manifest.json"
+# Bump to invalidate all the cooked outputs after a change of code that is
+# not covered by shared_code_files
+CODE_VERSION = 1
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
-from components import ttgamma_component
+def hash_inputs(paths: List[str]) -> str:
+    """ Combined hash of the contents of the input files (missing files are recorded as such) """
+    digest = hashlib.sha256(f"code version {CODE_VERSION}".encode())
+    for path in sorted(set(paths)):
+        digest.update(path.encode())
+        digest.update((_hash_file(path) if os.path.isfile(path) else "missing").encode())
+    return digest.hexdigest()
+
+
+def shared_code_files() -> List[str]:
+    """
+    Code shared by the components: the utils package, the environment and the
+    fit-utils tools, so that a change of e.g. the scaling fit invalidates the
+    cooked outputs.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    files = glob.glob(os.path.join(repo_dir, "utils", "*.py"))
+    files += glob.glob(os.path.join(repo_dir, "fit-utils", "python", "*.py"))
+    files.append(os.path.join(repo_dir, "environment.py"))
+    return sorted(files)
 
 
 class CombinationChef:
     """Class to handle things that are required by the combination code."""
 
-    components = {
-        "ttgamma" : ttgamma_component
-}
     def __init__(
             self, 
             measurement_name: str, 
             observable: str,
             config_path: str,
             environment: TopCombEnv,
+            output_stem: Optional[str] = None,
+            outpath: str = "eftcomb",
             ):
 
             self.measurement_name = measurement_name
             self.observable = observable
             self.config_path = config_path
             self.environment = environment
+            self.output_stem = output_stem or f"CMS_{measurement_name}"
+            self.outpath = outpath
 
             logger.info(f"Using configuration from {config_path}")
             self.observable_config = load_config( self.config_path )
+            self.inputs = self.observable_config.get("components", {})
+            self.component = get_component( environment.get("measurements_path"), self.measurement_name )
+
+    @property
+    def outputs(self) -> Dict[str, str]:
+        return {
+            "measurement": os.path.join(self.outpath, "measurements", f"{self.output_stem}.json"),
+            "scalings": os.path.join(self.outpath, "scalings", f"{self.output_stem}_scalings.json"),
+        }
+
+    def input_files(self) -> List[str]:
+        """
+        Files the outputs depend on: the configuration, every configured
+        component input (inputs that are not reachable, e.g. on EOS, are
+        hashed as missing), the component code and the shared code.
+        """
+        files = [self.config_path, self.environment.get("config", "main.yml")]
+        files += [v.strip() for v in self.inputs.values() if isinstance(v, str)]
+        files.append(inspect.getfile(self.component))
+        files += shared_code_files()
+        return files
+
+    def input_hash(self) -> str:
+        return hash_inputs(self.input_files())
+
+    def cook(self) -> None:
+        component_inst = self.component(
+            dataset = self.observable_config.get("dataset", ""),
+            **self.inputs
+        )
 
-            component = self.components.get( self.measurement_name )
-            inputs = self.observable_config.get("components", {})
-            
-            component_inst = component(
-                dataset = self.observable_config.get("dataset", ""),
-                **inputs
-            )
+        for path in self.outputs.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
 
-            measurement = component_inst.prepare_measurements()
-            measurement.writeToJSON(
-                f"eftcomb/measurements/CMS_{self.measurement_name}.json"
-            )
+        measurement = component_inst.prepare_measurements()
+        measurement.writeToJSON( self.outputs["measurement"] )
 
-            eftscaling = component_inst.prepare_scalings()
-            with open(f"eftcomb/scalings/CMS_{self.measurement_name}_scalings.json", "w") as f:
-                json.dump(eftscaling, f, indent=4)
-            
+        eftscaling = component_inst.prepare_scalings()
+        with open(self.outputs["scalings"], "w") as f:
+            json.dump(eftscaling, f, indent=4)
+        logger.info(f"Cooked {self.measurement_name} ({self.observable}): {', '.join(self.outputs.values())}")
 
     def _prepare_measurement_jsons(self):
         """
@@ -80,5 +140,86 @@ class CombinationChef:
         values.
         """
 
-        
 
+def _cook_task(task: Dict) -> Dict:
+    """ Worker of the process pool: cook one measurement/observable """
+    chef = CombinationChef(**task["chef"])
+    chef.cook()
+    return task
+
+
+def cooking_tasks(environment: Dict, measurement_names: List[str]) -> List[Dict]:
+    """ One task per measurement and observable, with the hash of its inputs """
+    main_config = environment.get("main_config")["MEASUREMENTS"]
+    measurements_path = environment.get("measurements_path")
+    chef_env = {
+        "measurements_path": measurements_path,
+        "config": environment.get("config"),
+    }
+    tasks = []
+    for measurement_name in measurement_names:
+        observables = get_observables(main_config.get(measurement_name), measurements_path, measurement_name)
+        if not observables:
+            logger.warning(f"No observable configured for measurement {measurement_name}, skipping it")
+            continue
+        for observable in observables:
+            # Keep the historical output names when there is only one observable
+            output_stem = f"CMS_{measurement_name}" if len(observables) == 1 else f"CMS_{measurement_name}_{observable}"
+            chef_args = {
+                "measurement_name": measurement_name,
+                "observable": observable,
+                "config_path": os.path.join(measurements_path, measurement_name, "observable_configs", f"{observable}.yaml"),
+                "environment": chef_env,
+                "output_stem": output_stem,
+            }
+            tasks.append({"key": output_stem, "chef": chef_args})
+    return tasks
+
+
+def cook_all(environment: Dict, measurement_names: List[str], ncores: int = 4, force: bool = False) -> None:
+    """
+    Cook every measurement and observable concurrently on a process pool.
+    Outputs whose inputs have the same hash as in the previous run (stored
+    in `eftcomb/cook_manifest.json`) are skipped unless `force` is set.
+    """
+    manifest_path = os.path.join("eftcomb", MANIFEST_NAME)
+    manifest = load_config(manifest_path) if os.path.exists(manifest_path) else {}
+
+    todo = []
+    for task in cooking_tasks(environment, measurement_names):
+        try:
+            chef = CombinationChef(**task["chef"])
+        except (KeyError, FileNotFoundError) as e:
+            logger.error(f"Cannot cook {task['key']}: {e}")
+            continue
+        task["hash"] = chef.input_hash()
+        up_to_date = manifest.get(task["key"], {}).get("hash") == task["hash"]
+        if up_to_date and all(os.path.exists(p) for p in chef.outputs.values()) and not force:
+            logger.info(f"Inputs of {task['key']} are unchanged, skipping it")
+            continue
+        todo.append(task)
+
+    if not todo:
+        logger.info("All the outputs are up to date")
+        return
+
+    logger.info(f"Cooking {len(todo)} output(s) with {ncores} processes")
+    failures = []
+    with ProcessPoolExecutor(max_workers=max(1, min(ncores, len(todo)))) as pool:
+        futures = {pool.submit(_cook_task, task): task for task in todo}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Cooking {task['key']} failed: {e}")
+                failures.append(task["key"])
+                continue
+            manifest[task["key"]] = {"hash": task["hash"], "config": task["chef"]["config_path"]}
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    if failures:
+        raise RuntimeError(f"Cooking failed for: {', '.join(failures)}")
@@ -0,0 +1,75 @@
+"""
+Registry of the combination components, discovered from the measurement
+folders: every `measurements/<name>/*_component.py` module that defines a
+subclass of `utils.components.component` registers it under `<name>`.
+"""
+import os
+import sys
+import glob
+import inspect
+import importlib.util
+from functools import lru_cache
+from typing import Dict, List
+
+from .auxiliars import get_logger
+from .components import component
+
+logger = get_logger(__name__)
+
+
+def _load_module(path: str, module_name: str):
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+@lru_cache(maxsize=None)
+def discover_components(measurements_path: str) -> Dict[str, type]:
+    """ Return {measurement name: component class} for all the measurement folders """
+    registry = {}
+    for path in sorted(glob.glob(os.path.join(measurements_path, "*", "*_component.py"))):
+        measurement_name = os.path.basename(os.path.dirname(path))
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            module = _load_module(path, module_name)
+        except ImportError as e:
+            logger.warning(f"Could not import the component of {measurement_name} ({path}): {e}")
+            continue
+
+        classes = [
+            obj for _, obj in inspect.getmembers(module, inspect.isclass)
+            if issubclass(obj, component) and obj is not component and obj.__module__ == module.__name__
+        ]
+        if len(classes) != 1:
+            logger.warning(f"Expected one component class in {path}, found {len(classes)}; skipping it")
+            continue
+        registry[measurement_name] = classes[0]
+    return registry
+
+
+def get_component(measurements_path: str, measurement_name: str) -> type:
+    registry = discover_components(os.path.abspath(measurements_path))
+    if measurement_name not in registry:
+        raise KeyError(
+            f"No component found for measurement {measurement_name}. "
+            f"Available: {', '.join(registry) or 'none'}"
+        )
+    return registry[measurement_name]
+
+
+def get_observables(measurement_config: Dict, measurements_path: str, measurement_name: str) -> List[str]:
+    """
+    Observables of a measurement: the `observable` entry of its main
+    configuration (a name or a list), or all its observable configurations.
+    """
+    observables = (measurement_config or {}).get("observable")
+    if observables:
+        return [observables] if isinstance(observables, str) else list(observables)
+    configs = glob.glob(os.path.join(measurements_path, measurement_name, "observable_configs", "*.yaml"))
+    return sorted(os.path.splitext(os.path.basename(c))[0] for c in configs)
@@ -2,22 +2,13 @@
 """ Class to handle things that are required by the combination code """
 import numpy as np
 from environment import TopCombEnv
-import ROOT
-from .auxiliars import (
-    get_logger,
-    load_config
-)
+from .auxiliars import get_logger
 
 from .json_to_root import read_json_histograms
-
-from .hepdata_to_root import (
-    read_hepdata_to_graph,
-    read_hepdata_to_th1
-)
-
-from eftcomb.python.tools import (
-    ReadDependent,
-    ReadIndependent
+from .hepdata import (
+    load_hepdata_raw,
+    read_dependent,
+    read_independent
 )
 
 logger = get_logger(__name__)
@@ -50,7 +41,8 @@ class component:
         """
         Read HEPData JSON file and convert to ROOT TH1D histogram.
         """
-        data = load_config(json_path)
+        import ROOT
+        data = load_hepdata_raw(json_path)
         
         if 'histos' not in data:
             raise ValueError("JSON file does not contain 'histos' key")
@@ -77,19 +69,24 @@ class component:
     @staticmethod
     def read_hepdata( json_path, group_index=0, error = None ):
         """
-        Read HEPData JSON file and convert to ROOT TGraphAsymmErrors.
+        Read a column of a HEPData table (central values, or the errors in
+        `error` summed in quadrature) and the bin labels. The parsed file is
+        cached, so reading several columns of the same table is cheap.
         """
-        data = load_config(json_path)
         if error is not None:
-            dependent = ReadDependent( data, col = group_index, error = error )
+            dependent = read_dependent( json_path, col = group_index, error = error )
         else:
-            dependent = ReadDependent( data, col = group_index )
+            dependent = read_dependent( json_path, col = group_index )
 
-        independent = ReadIndependent( data, col = 0 )
+        independent = read_independent( json_path, col = 0 )
 
         return dependent, independent
     
     @staticmethod
-    def read_cmgrdf_shapes(json_path, filter_histograms = []):
-        histograms = read_json_histograms( json_path, filter_histograms = filter_histograms )
+    def read_cmgrdf_shapes(json_path, filter_histograms = [], as_numpy = True):
+        """
+        Read the CMGRDF shapes, by default as NumPy-backed histograms keyed by
+        histogram name (ROOT TH1D objects with as_numpy=False).
+        """
+        histograms = read_json_histograms( json_path, filter_histograms = filter_histograms, as_numpy = as_numpy )
         return histograms
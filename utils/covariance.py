@@ -0,0 +1,207 @@
+"""
+Covariance matrices of the measurements and of their combination.
+
+Covariances are built with vectorized outer products. The global covariance
+of several measurements is kept block-sparse: one dense block per
+measurement on the diagonal, plus the inter-measurement correlation blocks
+that were explicitly provided. The Cholesky factorization (per diagonal
+block when there is no inter-measurement correlation) is cached for
+repeated chi2 evaluations, and the dense and ROOT forms are only built on
+demand.
+"""
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .auxiliars import get_logger
+logger = get_logger(__name__)
+
+
+def cov_from_corr(corr: np.ndarray, errors: np.ndarray) -> np.ndarray:
+    """Covariance from a correlation matrix (or a flattened one) and the uncertainties."""
+    errors = np.asarray(errors, dtype=float)
+    corr = np.asarray(corr, dtype=float).reshape(len(errors), len(errors))
+    return corr * np.outer(errors, errors)
+
+
+def corr_from_cov(cov: np.ndarray) -> np.ndarray:
+    """Correlation matrix of a covariance; rows/columns with a null variance are 0."""
+    cov = np.asarray(cov, dtype=float)
+    std = np.sqrt(np.diag(cov))
+    inv = np.where(std > 0, 1. / np.where(std > 0, std, 1.), 0.)
+    return cov * np.outer(inv, inv)
+
+
+def cov_from_sources(sources: Sequence[np.ndarray], correlations: Optional[Sequence[np.ndarray]] = None) -> np.ndarray:
+    """
+    Sum of the covariances of several uncertainty sources, each given as an
+    array of per-bin uncertainties. Sources are fully correlated across the
+    bins unless their correlation matrix is given.
+    """
+    sources = np.atleast_2d(np.asarray(sources, dtype=float))
+    if correlations is None:
+        # sum_k outer(s_k, s_k) in one product
+        return sources.T @ sources
+    return sum(cov_from_corr(corr, src) for src, corr in zip(sources, correlations))
+
+
+def cross_covariance(errors_a: np.ndarray, errors_b: np.ndarray, corr: np.ndarray) -> np.ndarray:
+    """Off-diagonal block between two measurements from their uncertainties and correlation."""
+    corr = np.asarray(corr, dtype=float).reshape(len(errors_a), len(errors_b))
+    return corr * np.outer(errors_a, errors_b)
+
+
+def to_root(cov: np.ndarray):
+    """Copy a covariance into a ROOT TMatrixDSym in one call."""
+    from ROOT import TMatrixDSym
+    cov = np.ascontiguousarray(cov, dtype=np.float64)
+    res = TMatrixDSym(cov.shape[0])
+    res.SetMatrixArray(cov.ravel())
+    return res
+
+
+class BlockCovariance:
+    """
+    Block-sparse symmetric covariance of several measurements.
+
+    Diagonal blocks are added per measurement with `add_block`, and the
+    correlation blocks between two measurements with `set_cross_block`
+    (the transposed block is implied).
+    """
+
+    def __init__(self):
+        self.blocks = OrderedDict()
+        self.labels = OrderedDict()
+        self.cross = {}
+        self._cholesky = None
+
+    # ---- Construction
+    def add_block(self, name: str, cov: np.ndarray, labels: Optional[Sequence[str]] = None):
+        cov = np.asarray(cov, dtype=float)
+        if cov.ndim != 2 or cov.shape[0] != cov.shape[1]:
+            raise ValueError(f"Covariance of {name} is not square: {cov.shape}")
+        if name in self.blocks:
+            raise ValueError(f"Block {name} already exists")
+        self.blocks[name] = cov
+        self.labels[name] = list(labels) if labels is not None else [f"{name}_{i}" for i in range(len(cov))]
+        self._cholesky = None
+
+    def set_cross_block(self, name_a: str, name_b: str, cov: np.ndarray):
+        cov = np.asarray(cov, dtype=float)
+        expected = (len(self.blocks[name_a]), len(self.blocks[name_b]))
+        if cov.shape != expected:
+            raise ValueError(f"Cross block {name_a}/{name_b} has shape {cov.shape}, expected {expected}")
+        names = list(self.blocks)
+        if names.index(name_a) > names.index(name_b):
+            name_a, name_b, cov = name_b, name_a, cov.T
+        self.cross[(name_a, name_b)] = cov
+        self._cholesky = None
+
+    # ---- Structure
+    @property
+    def size(self) -> int:
+        return sum(len(b) for b in self.blocks.values())
+
+    def offsets(self) -> Dict[str, Tuple[int, int]]:
+        """(start, stop) of every block in the global ordering."""
+        res, start = {}, 0
+        for name, block in self.blocks.items():
+            res[name] = (start, start + len(block))
+            start += len(block)
+        return res
+
+    @property
+    def bin_labels(self) -> List[str]:
+        return [label for labels in self.labels.values() for label in labels]
+
+    @property
+    def is_block_diagonal(self) -> bool:
+        return not any(np.any(c) for c in self.cross.values())
+
+    def block(self, name_a: str, name_b: Optional[str] = None) -> np.ndarray:
+        """Block of the covariance between two measurements (zeros if not correlated)."""
+        name_b = name_a if name_b is None else name_b
+        if name_a == name_b:
+            return self.blocks[name_a]
+        if (name_a, name_b) in self.cross:
+            return self.cross[(name_a, name_b)]
+        if (name_b, name_a) in self.cross:
+            return self.cross[(name_b, name_a)].T
+        return np.zeros((len(self.blocks[name_a]), len(self.blocks[name_b])))
+
+    def diagonal(self) -> np.ndarray:
+        return np.concatenate([np.diag(b) for b in self.blocks.values()]) if self.blocks else np.zeros(0)
+
+    # ---- Export, on demand
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros((self.size, self.size))
+        offsets = self.offsets()
+        for name, (start, stop) in offsets.items():
+            dense[start:stop, start:stop] = self.blocks[name]
+        for (name_a, name_b), cov in self.cross.items():
+            (sa, ea), (sb, eb) = offsets[name_a], offsets[name_b]
+            dense[sa:ea, sb:eb] = cov
+            dense[sb:eb, sa:ea] = cov.T
+        return dense
+
+    def to_root(self):
+        return to_root(self.to_dense())
+
+    # ---- Linear algebra
+    def _factorize(self):
+        """Inverse Cholesky factors: one per block, or a global one if there are cross blocks."""
+        if self._cholesky is None:
+            if self.is_block_diagonal:
+                self._cholesky = [
+                    (start, stop, np.linalg.inv(np.linalg.cholesky(self.blocks[name])))
+                    for name, (start, stop) in self.offsets().items()
+                ]
+            else:
+                logger.debug(f"Factorizing the dense {self.size}x{self.size} covariance")
+                self._cholesky = [(0, self.size, np.linalg.inv(np.linalg.cholesky(self.to_dense())))]
+        return self._cholesky
+
+    def whiten(self, residuals: np.ndarray) -> np.ndarray:
+        """L^-1 r, so that chi2 = |L^-1 r|^2. Accepts (nbins,) or (nbins, nvectors)."""
+        residuals = np.asarray(residuals, dtype=float)
+        out = np.empty_like(residuals)
+        for start, stop, inv_l in self._factorize():
+            out[start:stop] = inv_l @ residuals[start:stop]
+        return out
+
+    def chi2(self, residuals: np.ndarray):
+        """r^T C^-1 r, for one residual vector or for the columns of a (nbins, n) array."""
+        return np.sum(self.whiten(residuals)**2, axis=0)
+
+    def inverse(self) -> np.ndarray:
+        """Dense inverse of the covariance, from the cached factorization."""
+        inv = np.zeros((self.size, self.size))
+        for start, stop, inv_l in self._factorize():
+            inv[start:stop, start:stop] = inv_l.T @ inv_l
+        return inv
+
+
+def global_covariance(
+        measurements: Dict[str, object],
+        correlations: Optional[Dict[Tuple[str, str], np.ndarray]] = None
+    ) -> BlockCovariance:
+    """
+    Block-sparse covariance of several measurements ({name: Measurement},
+    with `cov` and `bin_labels`). `correlations` gives the inter-measurement
+    correlation matrices, {(name_a, name_b): corr}, which are scaled by the
+    uncertainties of the diagonal of each `cov`.
+    """
+    res = BlockCovariance()
+    for name, measurement in measurements.items():
+        res.add_block(name, measurement.cov, measurement.bin_labels)
+    for (name_a, name_b), corr in (correlations or {}).items():
+        res.set_cross_block(
+            name_a,
+            name_b,
+            cross_covariance(
+                np.sqrt(np.diag(measurements[name_a].cov)),
+                np.sqrt(np.diag(measurements[name_b].cov)),
+                corr
+            )
+        )
+    return res
@@ -0,0 +1,169 @@
+"""
+Per-bin quadratic EFT parametrization fitted from the reweight points.
+
+The yield of every bin at a point c of the Wilson coefficients is modelled as
+
+    N(c) = N_SM + sum_i A_i c_i + sum_{i<=j} B_ij c_i c_j
+
+and the coefficients of all the bins are obtained at once from a weighted
+least-squares fit to all the available reweight points (SM, single-operator
+and pairwise). The scaling JSON stores the coefficients relative to N_SM,
+in the EFT2obs convention mu(c) = 1 + sum_i A_i c_i + sum_{i<=j} B_ij c_i c_j.
+
+The reweight points are weights of the same generated events, so they are
+strongly correlated, while the fit treats them as independent. The chi2/ndof
+and the coefficient uncertainties are therefore only indicative (a check of
+how well the quadratic model interpolates the points), not calibrated.
+"""
+import numpy as np
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Dict, List, Sequence, Tuple
+
+from .auxiliars import get_logger
+logger = get_logger(__name__)
+
+
+@dataclass
+class ScalingFit:
+    """Result of the per-bin fit; arrays have one column per bin."""
+    operators: List[str]
+    # Terms of the parametrization: (), (op,), (op, op) or (op1, op2)
+    terms: List[Tuple[str, ...]]
+    # Shape (nterms, nbins)
+    coefficients: np.ndarray
+    uncertainties: np.ndarray
+    # Shape (nterms, nterms, nbins)
+    covariance: np.ndarray
+    # Shape (npoints, nbins), in units of the yield uncertainty
+    residuals: np.ndarray
+    chi2: np.ndarray
+    ndof: int
+
+
+def quadratic_terms(operators: Sequence[str], couplings: np.ndarray) -> List[Tuple[str, ...]]:
+    """
+    Terms that can be constrained by the points: the SM, the linear and
+    quadratic terms of every operator, and the cross terms of the pairs of
+    operators that are both non-zero in at least one point.
+    """
+    nonzero = couplings != 0
+    terms = [()]
+    terms += [(op,) for op in operators]
+    terms += [(op, op) for op in operators]
+    terms += [
+        (operators[i], operators[j])
+        for i, j in combinations(range(len(operators)), 2)
+        if np.any(nonzero[:, i] & nonzero[:, j])
+    ]
+    return terms
+
+
+def design_matrix(operators: Sequence[str], terms: Sequence[Tuple[str, ...]], couplings: np.ndarray) -> np.ndarray:
+    """Monomials of every term evaluated at every point, shape (npoints, nterms)."""
+    index = {op: i for i, op in enumerate(operators)}
+    columns = [
+        np.prod(couplings[:, [index[op] for op in term]], axis=1) if term else np.ones(len(couplings))
+        for term in terms
+    ]
+    return np.stack(columns, axis=1)
+
+
+def fit_quadratic(
+        operators: Sequence[str],
+        couplings: np.ndarray,
+        yields: np.ndarray,
+        variances: np.ndarray,
+    ) -> ScalingFit:
+    """
+    Fit the quadratic parametrization of every bin at once.
+
+    couplings: (npoints, noperators) values of the Wilson coefficients
+    yields, variances: (npoints, nbins) yields at every point and their
+    variances, used as weights. Null variances are replaced by the smallest
+    positive one of the bin (or 1 if there is none).
+
+    The points are treated as independent, which reweighted points sharing
+    the same events are not: the returned uncertainties, covariance and chi2
+    are not calibrated.
+    """
+    operators = list(operators)
+    couplings = np.asarray(couplings, dtype=float)
+    yields = np.asarray(yields, dtype=float)
+    variances = np.asarray(variances, dtype=float)
+
+    terms = quadratic_terms(operators, couplings)
+    X = design_matrix(operators, terms, couplings)
+    npoints, nterms = X.shape
+    if npoints < nterms:
+        raise ValueError(f"{npoints} reweight points cannot constrain {nterms} terms")
+
+    positive = np.where(variances > 0, variances, np.inf)
+    floor = np.min(positive, axis=0)
+    floor = np.where(np.isfinite(floor), floor, 1.)
+    weights = 1. / np.where(variances > 0, variances, floor)
+
+    # Normal equations of all the bins: (nbins, nterms, nterms) and (nbins, nterms)
+    normal = np.einsum("pb,pi,pj->bij", weights, X, X)
+    rhs = np.einsum("pb,pi,pb->bi", weights, X, yields)
+    covariance = np.linalg.pinv(normal, hermitian=True)
+    coefficients = np.einsum("bij,bj->bi", covariance, rhs)
+
+    residuals = (yields - X @ coefficients.T) * np.sqrt(weights)
+    chi2 = np.sum(residuals**2, axis=0)
+
+    return ScalingFit(
+        operators=operators,
+        terms=terms,
+        coefficients=coefficients.T,
+        uncertainties=np.sqrt(np.clip(np.diagonal(covariance, axis1=1, axis2=2), 0., None)).T,
+        covariance=np.moveaxis(covariance, 0, -1),
+        residuals=residuals,
+        chi2=chi2,
+        ndof=npoints - nterms,
+    )
+
+
+def relative_terms(fit: ScalingFit) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Coefficients of the non-SM terms divided by the SM one, with their
+    uncertainties (including the correlation with the SM coefficient).
+    Bins with a null SM coefficient are set to 0.
+    """
+    sm = fit.coefficients[0]
+    safe_sm = np.where(sm != 0, sm, 1.)
+    rel = np.where(sm != 0, fit.coefficients[1:] / safe_sm, 0.)
+
+    # Gradient of c_k / c_0 with respect to (c_0, c_k)
+    var_sm = fit.covariance[0, 0]
+    var_k = np.diagonal(fit.covariance, axis1=0, axis2=1).T[1:]
+    cov_k_sm = fit.covariance[1:, 0]
+    var_rel = (var_k - 2. * rel * cov_k_sm + rel**2 * var_sm) / safe_sm**2
+    err = np.where(sm != 0, np.sqrt(np.clip(var_rel, 0., None)), 0.)
+    return rel, err
+
+
+def log_fit_quality(fit: ScalingFit, bin_labels: Sequence[str] = ()):
+    """Summarize the goodness of the fit of every bin."""
+    labels = list(bin_labels) or [str(i) for i in range(fit.chi2.size)]
+    if fit.ndof == 0:
+        logger.info("Scaling fit has no degrees of freedom: the points are interpolated exactly")
+        return
+    for label, chi2, residuals in zip(labels, fit.chi2, fit.residuals.T):
+        logger.info(
+            f"Scaling fit, bin {label}: chi2/ndof = {chi2:.2f}/{fit.ndof} (correlated points, not calibrated), "
+            f"max |pull| = {np.max(np.abs(residuals)):.2f}"
+        )
+
+
+def scaling_json_terms(fit: ScalingFit) -> Dict:
+    """`parameters` and `terms` blocks of the EFT2obs-style scaling JSON."""
+    rel, err = relative_terms(fit)
+    terms = [
+        [list(term), values.tolist(), errors.tolist()]
+        for term, values, errors in zip(fit.terms[1:], rel, err)
+    ]
+    return {
+        "parameters": list(fit.operators),
+        "terms": terms,
+    }
@@ -0,0 +1,219 @@
+"""
+Cached ingestion of HEPData (YAML/JSON) and YODA files.
+
+Files are parsed once with the C-accelerated YAML loader when available,
+the tables are converted to NumPy arrays, and the result is memoized per
+(path, size, mtime) within the process. The parsed tables are also
+pickled in an on-disk cache (`<cache_dir>/hepdata`), so that the next
+process reading the same, unchanged, file skips the parsing.
+"""
+import io
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import yaml
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+from utils.logger import get_logger
+logger = get_logger( __name__ )
+
+CACHE_VERSION = 1
+_MEMORY_CACHE = {}
+
+
+@dataclass
+class DependentVariable:
+    """One dependent column: the values and the errors of every point."""
+    name: str
+    values: np.ndarray
+    # Shape (npoints, nerrors); missing errors are 0
+    err_plus: np.ndarray
+    err_minus: np.ndarray
+    error_labels: List[str] = field(default_factory=list)
+
+
+@dataclass
+class HEPDataTable:
+    """A HEPData table with its columns converted to arrays."""
+    dependent: List[DependentVariable]
+    # Bin labels, or (low, high) bin ranges, as in ReadIndependent
+    independent: List[list]
+    raw: Dict
+
+
+def _cache_dir():
+    from environment import TopCombEnv
+    return os.path.join(TopCombEnv().cache_dir, "hepdata")
+
+
+def _file_key(path: str):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _to_float(value) -> float:
+    return float(value) if value not in (None, "") else 0.
+
+
+def _convert_dependent(column: Dict) -> DependentVariable:
+    points = column.get("values", [])
+    nerrors = max((len(p.get("errors", [])) for p in points), default=0)
+    err_plus = np.zeros((len(points), nerrors))
+    err_minus = np.zeros((len(points), nerrors))
+    labels = [""] * nerrors
+    for ipoint, point in enumerate(points):
+        for ierr, err in enumerate(point.get("errors", [])):
+            labels[ierr] = labels[ierr] or err.get("label", "")
+            if "symerror" in err:
+                err_plus[ipoint, ierr] = err_minus[ipoint, ierr] = _to_float(err["symerror"])
+            elif "asymerror" in err:
+                err_plus[ipoint, ierr] = _to_float(err["asymerror"]["plus"])
+                err_minus[ipoint, ierr] = _to_float(err["asymerror"]["minus"])
+    return DependentVariable(
+        name=column.get("header", {}).get("name", ""),
+        values=np.array([_to_float(p.get("value")) for p in points]),
+        err_plus=err_plus,
+        err_minus=err_minus,
+        error_labels=labels,
+    )
+
+
+def _convert_independent(column: Dict) -> list:
+    points = column.get("values", [])
+    if points and "value" in points[0]:
+        return [p["value"] for p in points]
+    return [(p["low"], p["high"]) for p in points]
+
+
+def _parse(path: str) -> Dict:
+    with open(path) as f:
+        if path.endswith((".yml", ".yaml")):
+            return yaml.load(f, Loader=SafeLoader)
+        elif path.endswith(".json"):
+            return json.load(f)
+    raise ValueError(f"Unsupported HEPData file format: {path}")
+
+
+def _parse_table(path: str) -> HEPDataTable:
+    raw = _parse(path)
+    return HEPDataTable(
+        dependent=[_convert_dependent(c) for c in raw.get("dependent_variables", [])],
+        independent=[_convert_independent(c) for c in raw.get("independent_variables", [])],
+        raw=raw,
+    )
+
+
+def _cached(path: str, kind: str, parser):
+    """Memoize `parser(path)` in memory and on disk, keyed on the file path, size and mtime."""
+    key = _file_key(path) + (kind,)
+    if key in _MEMORY_CACHE:
+        return _MEMORY_CACHE[key]
+
+    digest = hashlib.sha1(repr((CACHE_VERSION,) + key).encode()).hexdigest()
+    cache_file = os.path.join(_cache_dir(), f"{digest}.pkl")
+    result = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                result = pickle.load(f)
+        except Exception as e:
+            logger.debug(f"Ignoring unreadable cache {cache_file}: {e}")
+
+    if result is None:
+        result = parser(path)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logger.debug(f"Could not write the cache {cache_file}: {e}")
+
+    _MEMORY_CACHE[key] = result
+    return result
+
+
+def load_hepdata(path: str) -> HEPDataTable:
+    """Parsed HEPData table (YAML or JSON), cached."""
+    return _cached(path, "hepdata", _parse_table)
+
+
+def load_hepdata_raw(path: str) -> Dict:
+    """Parsed content of a HEPData file as plain python objects, cached."""
+    return load_hepdata(path).raw
+
+
+def read_independent(path: str, col: int = 0) -> list:
+    """Bin labels, or (low, high) bin ranges, of an independent column."""
+    return list(load_hepdata(path).independent[col])
+
+
+def read_dependent(
+        path: str,
+        col: int = 0,
+        error: Sequence[int] = (),
+        sym_errors: bool = True
+    ) -> np.ndarray:
+    """
+    Central values of a dependent column or, if `error` is given, the sum in
+    quadrature of those error columns. Errors are symmetrized by default,
+    otherwise an array of (-low, +high) pairs is returned. Same conventions
+    as ReadDependent in fit-utils/python/tools.py.
+    """
+    column = load_hepdata(path).dependent[col]
+    if len(error) == 0:
+        return column.values.copy()
+    error = list(error)
+    hi = np.sqrt(np.sum(column.err_plus[:, error]**2, axis=1))
+    lo = np.sqrt(np.sum(column.err_minus[:, error]**2, axis=1))
+    if sym_errors:
+        return (lo + hi) / 2.
+    return np.stack([-lo, hi], axis=1)
+
+
+def _parse_yoda(path: str) -> Dict[str, Dict[str, np.ndarray]]:
+    """Parse the tables of a YODA file into {title: {column: array}}."""
+    res = {}
+    with open(path) as f:
+        blocks = f.read().split("# BEGIN")[1:]
+    for block in blocks:
+        block = block.split("# END")[0]
+        title, header, numeric = "", [], []
+        for line in block.splitlines()[1:]:
+            line = " ".join(line.split())
+            if not line:
+                continue
+            if line.split("=")[0] == "Title":
+                title = line.split("=", 1)[1]
+            elif line.startswith("#"):
+                header = line.split(" ")[1:]
+            elif line[0].isdigit() or (line[0] == "-" and len(line) > 1 and line[1].isdigit()):
+                numeric.append(line)
+        if not numeric:
+            continue
+        data = np.atleast_2d(np.loadtxt(io.StringIO("\n".join(numeric))))
+        header = header + [f"col{i}" for i in range(len(header), data.shape[1])]
+        res[title] = {h: data[:, i] for i, h in enumerate(header[:data.shape[1]])}
+    return res
+
+
+def read_yoda(path: str, title: Optional[str] = None, col: Optional[str] = None):
+    """
+    Tables of a YODA file as {title: {column: array}}, cached. Optionally
+    select one table by title and/or one column.
+    """
+    res = _cached(path, "yoda", _parse_yoda)
+    if col is not None:
+        res = {k: v[col] for k, v in res.items() if col in v}
+    if title is not None:
+        res = res[title]
+    return res
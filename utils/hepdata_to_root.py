@@ -1,12 +1,13 @@
 import ROOT
-from .auxiliars import get_logger, load_config
+from .auxiliars import get_logger
+from .hepdata import load_hepdata_raw
 logger = get_logger(__name__)
 
 def read_hepdata_to_th1(json_path, group_index=0):
     """
     Read HEPData JSON file and convert to ROOT TH1D histogram.
     """
-    data = load_config(json_path)
+    data = load_hepdata_raw(json_path)
     
     if 'histos' not in data:
         raise ValueError("JSON file does not contain 'histos' key")
@@ -34,7 +35,7 @@ def read_hepdata_to_graph(json_path, group_index=0, error_label="total uncertain
     """
     Read HEPData JSON file and convert to ROOT TGraphAsymmErrors.
     """
-    data = load_config(json_path)
+    data = load_hepdata_raw(json_path)
     
     values = data.get("values", [])
     
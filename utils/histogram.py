@@ -0,0 +1,205 @@
+"""
+Lightweight NumPy-backed 1D histogram, used to manipulate the CMGRDF
+shapes without ROOT. Values and variances include the underflow (index
+0) and overflow (index -1) bins, following the ROOT convention, so that
+the in-range bins are `values[1:-1]`.
+"""
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Union
+
+
+class Histogram:
+    """
+    A 1D histogram with variable binning.
+
+    Arithmetic with another histogram (same binning) or a scalar/array is
+    vectorized; variances are propagated assuming uncorrelated inputs.
+    """
+
+    def __init__(
+            self,
+            edges: Sequence[float],
+            values: Optional[Sequence[float]] = None,
+            variances: Optional[Sequence[float]] = None,
+            name: str = "",
+            xtitle: str = "",
+            ytitle: str = "",
+        ):
+        self.edges = np.asarray(edges, dtype=float)
+        nbins = len(self.edges) - 1
+        self.values = np.zeros(nbins + 2) if values is None else np.asarray(values, dtype=float)
+        self.variances = np.zeros(nbins + 2) if variances is None else np.asarray(variances, dtype=float)
+        if self.values.shape != (nbins + 2,) or self.variances.shape != (nbins + 2,):
+            raise ValueError(f"Histogram {name}: expected {nbins + 2} values (including flow bins)")
+        self.name = name
+        self.xtitle = xtitle
+        self.ytitle = ytitle
+
+    # ---- Construction
+    @classmethod
+    def from_cmgrdf(cls, name: str, histo_data: Dict) -> "Histogram":
+        """Build a histogram from one entry of the `histos` block of a CMGRDF JSON."""
+        central = histo_data["central"]
+        return cls(
+            edges=histo_data["axes"]["x"]["bins"],
+            values=central["values"],
+            variances=np.square(central["errors"]),
+            name=name,
+            xtitle=histo_data["axes"]["x"].get("title", ""),
+            ytitle=histo_data["axes"]["y"].get("title", ""),
+        )
+
+    def copy(self, name: Optional[str] = None) -> "Histogram":
+        return Histogram(
+            self.edges.copy(),
+            self.values.copy(),
+            self.variances.copy(),
+            name=self.name if name is None else name,
+            xtitle=self.xtitle,
+            ytitle=self.ytitle,
+        )
+
+    # ---- Properties of the in-range bins
+    @property
+    def nbins(self) -> int:
+        return len(self.edges) - 1
+
+    def __len__(self) -> int:
+        return self.nbins
+
+    @property
+    def widths(self) -> np.ndarray:
+        return np.diff(self.edges)
+
+    @property
+    def centers(self) -> np.ndarray:
+        return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+    @property
+    def contents(self) -> np.ndarray:
+        """Values of the in-range bins."""
+        return self.values[1:-1]
+
+    @property
+    def errors(self) -> np.ndarray:
+        """Uncertainties of the in-range bins."""
+        return np.sqrt(self.variances[1:-1])
+
+    def integral(self, flow: bool = False) -> float:
+        return float(self.values.sum() if flow else self.contents.sum())
+
+    # ---- Arithmetic
+    def _check_compatible(self, other: "Histogram"):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError(f"Histograms {self.name} and {other.name} have different binnings")
+
+    @staticmethod
+    def _as_flow_array(factor, nbins):
+        """Broadcast a scalar or an array of in-range values to all the bins."""
+        factor = np.asarray(factor, dtype=float)
+        if factor.ndim == 1 and len(factor) == nbins:
+            factor = np.concatenate([[1.], factor, [1.]])
+        return factor
+
+    def __add__(self, other: Union["Histogram", float]) -> "Histogram":
+        out = self.copy()
+        if isinstance(other, Histogram):
+            self._check_compatible(other)
+            out.values = self.values + other.values
+            out.variances = self.variances + other.variances
+        else:
+            out.values = self.values + other
+        return out
+
+    __radd__ = __add__
+
+    def __sub__(self, other: Union["Histogram", float]) -> "Histogram":
+        return self + (other * -1.)
+
+    def __mul__(self, other: Union["Histogram", float, np.ndarray]) -> "Histogram":
+        out = self.copy()
+        if isinstance(other, Histogram):
+            self._check_compatible(other)
+            out.values = self.values * other.values
+            out.variances = self.variances * other.values**2 + other.variances * self.values**2
+        else:
+            factor = self._as_flow_array(other, self.nbins)
+            out.values = self.values * factor
+            out.variances = self.variances * factor**2
+        return out
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other: Union["Histogram", float, np.ndarray]) -> "Histogram":
+        """Division; bins with a null denominator are set to 0."""
+        out = self.copy()
+        if isinstance(other, Histogram):
+            self._check_compatible(other)
+            den = other.values
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.where(den != 0, self.values / den, 0.)
+                rel2 = np.where(den != 0, other.variances / den**2, 0.)
+                out.variances = np.where(den != 0, self.variances / den**2 + ratio**2 * rel2, 0.)
+            out.values = ratio
+        else:
+            factor = self._as_flow_array(other, self.nbins)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out.values = np.where(factor != 0, self.values / factor, 0.)
+                out.variances = np.where(factor != 0, self.variances / factor**2, 0.)
+        return out
+
+    def scale(self, factor: float) -> "Histogram":
+        """Scale in place (like TH1::Scale) and return self."""
+        self.values = self.values * factor
+        self.variances = self.variances * factor**2
+        return self
+
+    # ---- Binning
+    def divide_by_width(self) -> "Histogram":
+        """Return the histogram normalized to the bin widths (flow bins untouched)."""
+        return self / self.widths
+
+    def rebin(self, new_edges: Sequence[float]) -> "Histogram":
+        """
+        Merge bins into `new_edges`, which must be a subset of the current
+        edges. Contents outside the new range go to the flow bins.
+        """
+        new_edges = np.asarray(new_edges, dtype=float)
+        idx = np.searchsorted(self.edges, new_edges)
+        if np.any(idx >= len(self.edges)) or not np.allclose(self.edges[idx], new_edges):
+            raise ValueError(f"Histogram {self.name}: new edges are not a subset of the current ones")
+
+        # Boundaries in the flow-included arrays: bin i (1-based) starts at edge i-1
+        bounds = np.concatenate([[0], idx + 1, [len(self.values)]])
+        values = np.add.reduceat(self.values, bounds[:-1])
+        variances = np.add.reduceat(self.variances, bounds[:-1])
+        out = self.copy()
+        out.edges, out.values, out.variances = new_edges, values, variances
+        return out
+
+    # ---- Conversion
+    def to_root(self, name: Optional[str] = None):
+        """Convert to a ROOT TH1D (only needed for plotting)."""
+        import ROOT
+        name = self.name if name is None else name
+        hist = ROOT.TH1D(name, name, self.nbins, self.edges)
+        hist.GetXaxis().SetTitle(self.xtitle)
+        hist.GetYaxis().SetTitle(self.ytitle)
+        for ibin, (val, var) in enumerate(zip(self.values, self.variances)):
+            hist.SetBinContent(ibin, val)
+            hist.SetBinError(ibin, np.sqrt(var))
+        return hist
+
+    def __repr__(self) -> str:
+        return f"Histogram({self.name!r}, nbins={self.nbins}, integral={self.integral():.6g})"
+
+
+def histograms_from_cmgrdf(data: Dict, filter_histograms: List[str] = [], prefix: str = "") -> Dict[str, Histogram]:
+    """Build the histograms of a CMGRDF JSON, keeping only `filter_histograms` if given."""
+    if "histos" not in data:
+        raise ValueError("JSON file does not contain 'histos' key")
+    return {
+        name: Histogram.from_cmgrdf(f"{prefix}{name}", histo_data)
+        for name, histo_data in data["histos"].items()
+        if not filter_histograms or name in filter_histograms
+    }
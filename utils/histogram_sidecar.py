@@ -0,0 +1,158 @@
+"""
+Binary sidecar for the CMGRDF JSON histogram outputs.
+
+For `<plot>.json` two files are written next to it:
+  - `<plot>.hist.npy`: the values and variances (flow bins included) of all
+    the histograms, stored contiguously as one float64 array,
+  - `<plot>.hist.json`: a small index with, for each histogram name, its
+    offset in the array, its binning and axis titles.
+Reading a few histograms then only touches their slices of the memory-mapped
+array instead of parsing the whole JSON. A sidecar is only used if it was
+built from the current version of the JSON file (same size and mtime).
+
+Usage:
+    python3 utils/histogram_sidecar.py <json files or folders>
+"""
+import os
+import sys
+import glob
+import json
+import numpy as np
+from typing import Dict, List
+
+try:
+    from utils.logger import get_logger
+    from utils.histogram import Histogram
+except ImportError:
+    from logger import get_logger
+    from histogram import Histogram
+logger = get_logger( __name__ )
+
+SIDECAR_VERSION = 1
+
+
+def sidecar_paths(json_path: str):
+    """ Paths of the data and index files of the sidecar of a JSON file """
+    stem = json_path[:-len(".json")] if json_path.endswith(".json") else json_path
+    return f"{stem}.hist.npy", f"{stem}.hist.json"
+
+
+def _source_info(json_path: str) -> Dict[str, int]:
+    stat = os.stat(json_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_sidecar(json_path: str) -> bool:
+    """ Build the sidecar of a CMGRDF JSON file. Returns False if it has no histograms """
+    with open(json_path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or "histos" not in data:
+        return False
+
+    data_path, index_path = sidecar_paths(json_path)
+    binnings = []
+    histograms = {}
+    chunks = []
+    offset = 0
+    for name, histo_data in data["histos"].items():
+        edges = [float(edge) for edge in histo_data["axes"]["x"]["bins"]]
+        if edges not in binnings:
+            binnings.append(edges)
+        values = np.asarray(histo_data["central"]["values"], dtype=np.float64)
+        variances = np.square(np.asarray(histo_data["central"]["errors"], dtype=np.float64))
+        chunks += [values, variances]
+        histograms[name] = {
+            "offset": offset,
+            "size": len(values),
+            "binning": binnings.index(edges),
+            "xtitle": histo_data["axes"]["x"].get("title", ""),
+            "ytitle": histo_data["axes"]["y"].get("title", ""),
+        }
+        offset += 2 * len(values)
+
+    index = {
+        "version": SIDECAR_VERSION,
+        "source": _source_info(json_path),
+        "binnings": binnings,
+        "histograms": histograms,
+    }
+
+    # Write both files atomically, the index last since it validates the data
+    tmp_data = f"{data_path}.tmp.npy"
+    np.save(tmp_data, np.concatenate(chunks) if chunks else np.zeros(0))
+    os.replace(tmp_data, data_path)
+    with open(f"{index_path}.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(f"{index_path}.tmp", index_path)
+    return True
+
+
+def _load_index(json_path: str):
+    """ Return the sidecar index if it exists and is up to date, None otherwise """
+    data_path, index_path = sidecar_paths(json_path)
+    if not (os.path.exists(index_path) and os.path.exists(data_path)):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get("version") != SIDECAR_VERSION:
+        return None
+    if os.path.exists(json_path) and index.get("source") != _source_info(json_path):
+        logger.debug(f"Sidecar of {json_path} is outdated, ignoring it")
+        return None
+    return index
+
+
+def has_sidecar(json_path: str) -> bool:
+    return _load_index(json_path) is not None
+
+
+def read_sidecar(
+        json_path: str,
+        filter_histograms: List[str] = [],
+        prefix: str = ""
+    ) -> Dict[str, Histogram]:
+    """
+    Read the requested histograms (all if empty) from the sidecar of a JSON
+    file, through a memory map. Raises FileNotFoundError if there is no valid
+    sidecar.
+    """
+    index = _load_index(json_path)
+    if index is None:
+        raise FileNotFoundError(f"No valid sidecar for {json_path}")
+    data_path, _ = sidecar_paths(json_path)
+    array = np.load(data_path, mmap_mode="r")
+
+    histograms = {}
+    for name, meta in index["histograms"].items():
+        if filter_histograms and name not in filter_histograms:
+            continue
+        start, size = meta["offset"], meta["size"]
+        histograms[name] = Histogram(
+            edges=index["binnings"][meta["binning"]],
+            values=np.array(array[start:start + size]),
+            variances=np.array(array[start + size:start + 2 * size]),
+            name=f"{prefix}{name}",
+            xtitle=meta["xtitle"],
+            ytitle=meta["ytitle"],
+        )
+    return histograms
+
+
+def write_sidecars(path: str) -> int:
+    """ Build (or refresh) the sidecars of all the JSON files below a folder. Returns how many were written """
+    json_files = [path] if os.path.isfile(path) else glob.glob(os.path.join(path, "**", "*.json"), recursive=True)
+    nwritten = 0
+    for json_path in json_files:
+        if json_path.endswith(".hist.json") or has_sidecar(json_path):
+            continue
+        try:
+            nwritten += write_sidecar(json_path)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Could not build the sidecar of {json_path}: {e}")
+    logger.info(f"Wrote {nwritten} histogram sidecar(s) in {path}")
+    return nwritten
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        write_sidecars(path)
@@ -0,0 +1,468 @@
+"""
+Local job ledger (sqlite) used to keep track of the generation and
+merge jobs. Every submitted job is recorded together with its inputs
+and outputs. The poller reads the HTCondor user logs to update the job
+states, resubmits failed jobs with an exponential backoff and can
+duplicate stragglers that run much longer than their siblings.
+
+This module only depends on the standard library so that it can also
+be used by the standalone scripts living in this folder (e.g.
+`merge_output.py`).
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import statistics
+import subprocess
+from datetime import datetime
+
+try:
+    from utils.logger import get_logger
+except ImportError:
+    from logger import get_logger
+logger = get_logger( __name__ )
+
+# Job states
+SUBMITTED = "submitted"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+HELD = "held"
+SUPERSEDED = "superseded"
+ACTIVE_STATES = (SUBMITTED, RUNNING, HELD)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    process TEXT,
+    name TEXT NOT NULL,
+    backend TEXT,
+    cluster_id TEXT,
+    proc_id INTEGER,
+    state TEXT NOT NULL,
+    attempts INTEGER DEFAULT 1,
+    inputs TEXT,
+    outputs TEXT,
+    nevents INTEGER,
+    log_path TEXT,
+    resubmit_cmd TEXT,
+    resubmit_cwd TEXT,
+    exit_code INTEGER,
+    submitted_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    next_retry_at REAL,
+    duplicate_of INTEGER
+)
+"""
+
+_JSON_FIELDS = ("inputs", "outputs", "resubmit_cmd")
+
+
+def parse_cluster_id(stdout):
+    """Extract the cluster id from the output of condor_submit."""
+    match = re.search(r"submitted to cluster (\d+)", stdout or "")
+    return match.group(1) if match else None
+
+
+def _parse_log_time(stamp):
+    """Parse the timestamps used in HTCondor user logs."""
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%m/%d %H:%M:%S"):
+        try:
+            parsed = datetime.strptime(stamp, fmt)
+        except ValueError:
+            continue
+        if fmt == "%m/%d %H:%M:%S":
+            # Old-style logs do not carry the year
+            parsed = parsed.replace(year=datetime.now().year)
+        return parsed.timestamp()
+    return None
+
+
+def parse_condor_log(log_path):
+    """
+    Parse an HTCondor user log.
+
+    Returns a dictionary keyed by "cluster.proc" with the state of each job
+    found in the log and the submission/start/end timestamps.
+    """
+    jobs = {}
+    if not os.path.exists(log_path):
+        return jobs
+
+    event_re = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ \S+)")
+    current = None
+    with open(log_path) as log:
+        for line in log:
+            match = event_re.match(line)
+            if match:
+                code, cluster, proc, stamp = match.groups()
+                key = f"{cluster}.{int(proc)}"
+                current = jobs.setdefault(key, {"cluster_id": cluster, "proc_id": int(proc), "state": SUBMITTED})
+                stamp = _parse_log_time(stamp)
+                if code == "000":
+                    current["submitted_at"] = stamp
+                elif code == "001":
+                    current["state"] = RUNNING
+                    current["started_at"] = stamp
+                elif code == "005":
+                    current["finished_at"] = stamp
+                elif code in ("009", "002"):
+                    current["state"] = FAILED
+                    current["finished_at"] = stamp
+                elif code == "012":
+                    current["state"] = HELD
+                elif code == "013":
+                    current["state"] = RUNNING if current.get("started_at") else SUBMITTED
+                continue
+
+            if current is None:
+                continue
+            ret = re.search(r"return value (-?\d+)", line)
+            if ret:
+                current["exit_code"] = int(ret.group(1))
+                current["state"] = DONE if current["exit_code"] == 0 else FAILED
+            elif "Abnormal termination" in line:
+                current["state"] = FAILED
+    return jobs
+
+
+# HTCondor JobStatus codes
+_CONDOR_STATES = {1: SUBMITTED, 2: RUNNING, 3: FAILED, 4: DONE, 5: HELD, 6: RUNNING, 7: RUNNING}
+_CONDOR_ATTRIBUTES = ("ClusterId", "ProcId", "JobStatus", "ExitCode", "JobCurrentStartDate", "CompletionDate")
+
+
+def condor_ads(cluster_ids, attributes, history=False):
+    """
+    Job ClassAds of the given clusters from condor_q (or condor_history),
+    as a list of dictionaries. Returns an empty list if the query fails.
+    """
+    cmd = ["condor_history" if history else "condor_q", *map(str, cluster_ids),
+           "-json", "-attributes", ",".join(attributes)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    except OSError as e:
+        logger.debug(f"Cannot run {cmd[0]}: {e}")
+        return []
+    if result.returncode != 0:
+        logger.debug(f"{cmd[0]} failed: {result.stderr.strip()}")
+        return []
+    try:
+        return json.loads(result.stdout) if result.stdout.strip() else []
+    except ValueError:
+        logger.debug(f"Cannot parse the output of {cmd[0]}")
+        return []
+
+
+def query_condor(keys):
+    """
+    State of the given "cluster.proc" jobs from condor_q and, for the jobs
+    that left the queue, condor_history. Same format as parse_condor_log.
+    """
+    clusters = sorted({key.split(".")[0] for key in keys})
+    if not clusters:
+        return {}
+    ads = condor_ads(clusters, _CONDOR_ATTRIBUTES)
+    in_queue = {f"{ad['ClusterId']}.{ad['ProcId']}" for ad in ads}
+    # condor_history is slow: only ask for the clusters of the jobs out of the queue
+    history = sorted({key.split(".")[0] for key in keys if key not in in_queue})
+    if history:
+        ads = condor_ads(history, _CONDOR_ATTRIBUTES, history=True) + ads
+
+    jobs = {}
+    for ad in ads:
+        state = _CONDOR_STATES.get(ad.get("JobStatus"))
+        if state is None:
+            continue
+        entry = {"cluster_id": str(ad["ClusterId"]), "proc_id": int(ad["ProcId"]), "state": state}
+        if ad.get("JobCurrentStartDate"):
+            entry["started_at"] = float(ad["JobCurrentStartDate"])
+        if state in (DONE, FAILED) and ad.get("CompletionDate"):
+            entry["finished_at"] = float(ad["CompletionDate"])
+        if state == DONE and ad.get("ExitCode") is not None:
+            entry["exit_code"] = int(ad["ExitCode"])
+            if entry["exit_code"] != 0:
+                entry["state"] = FAILED
+        # Later ads (condor_q) take precedence
+        jobs[f"{entry['cluster_id']}.{entry['proc_id']}"] = entry
+    return jobs
+
+
+class JobLedger:
+    """sqlite-backed record of the submitted jobs."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as con:
+            con.execute(_SCHEMA)
+
+    def _connect(self):
+        # One connection per operation: safe across threads and processes
+        con = sqlite3.connect(self.path, timeout=60)
+        con.row_factory = sqlite3.Row
+        return con
+
+    @staticmethod
+    def _decode(row):
+        job = dict(row)
+        for key in _JSON_FIELDS:
+            if job.get(key) is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+    _INSERT = (
+        "INSERT INTO jobs (kind, process, name, backend, cluster_id, proc_id, state, inputs, outputs, "
+        "nevents, log_path, resubmit_cmd, resubmit_cwd, submitted_at, duplicate_of) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+
+    @staticmethod
+    def _row(kind, name, process=None, backend=None, cluster_id=None, proc_id=None,
+             state=SUBMITTED, inputs=None, outputs=None, nevents=None, log_path=None,
+             resubmit_cmd=None, resubmit_cwd=None, duplicate_of=None):
+        return (
+            kind, process, name, backend, cluster_id, proc_id, state,
+            json.dumps(inputs or []), json.dumps(outputs or []), nevents, log_path,
+            json.dumps(resubmit_cmd) if resubmit_cmd else None, resubmit_cwd,
+            time.time(), duplicate_of,
+        )
+
+    def add_job(self, kind, name, **job):
+        """Record a new job and return its id."""
+        with self._connect() as con:
+            return con.execute(self._INSERT, self._row(kind, name, **job)).lastrowid
+
+    def add_jobs(self, jobs):
+        """Record several jobs (dictionaries of add_job arguments) in a single transaction."""
+        with self._connect() as con:
+            con.executemany(self._INSERT, [self._row(**job) for job in jobs])
+
+    def update(self, job_id, **fields):
+        """Update the given columns of a job."""
+        if not fields:
+            return
+        for key in _JSON_FIELDS:
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as con:
+            con.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def jobs(self, state=None, kind=None, process=None):
+        """Return the recorded jobs, optionally filtered."""
+        query, args = "SELECT * FROM jobs WHERE 1=1", []
+        for column, value in (("kind", kind), ("process", process)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                args.append(value)
+        if state is not None:
+            states = (state,) if isinstance(state, str) else tuple(state)
+            query += f" AND state IN ({', '.join('?' * len(states))})"
+            args.extend(states)
+        with self._connect() as con:
+            return [self._decode(row) for row in con.execute(query, args)]
+
+    # ---- Polling
+    def poll(self):
+        """
+        Update the state of the active jobs from the scheduler logs or, for the
+        condor jobs without a usable log, from condor_q/condor_history. Jobs
+        unknown to the scheduler are considered done once all outputs exist.
+        """
+        active = self.jobs(state=ACTIVE_STATES)
+        parsed_logs, entries = {}, {}
+        for job in active:
+            log_path = job.get("log_path")
+            if not log_path:
+                continue
+            if log_path not in parsed_logs:
+                parsed_logs[log_path] = parse_condor_log(log_path)
+            in_log = parsed_logs[log_path]
+            entry = in_log.get(f"{job['cluster_id']}.{job['proc_id'] or 0}")
+            if entry is None and job["cluster_id"] is None and in_log:
+                # Unknown cluster: the latest job in the log is the relevant one
+                entry = in_log[max(in_log, key=lambda k: tuple(map(int, k.split("."))))]
+            if entry:
+                entries[job["id"]] = entry
+
+        # One condor query for all the jobs that are not in a log
+        query = {
+            job["id"]: f"{job['cluster_id']}.{job['proc_id'] or 0}"
+            for job in active
+            if job["id"] not in entries and job["backend"] == "condor" and job["cluster_id"]
+        }
+        if query:
+            queried = query_condor(set(query.values()))
+            entries.update({job_id: queried[key] for job_id, key in query.items() if key in queried})
+
+        for job in active:
+            updates = {}
+            entry = entries.get(job["id"])
+            outputs = job.get("outputs") or []
+            if entry:
+                updates = {k: v for k, v in entry.items() if k != "proc_id" and v is not None}
+                if updates["state"] == DONE and not all(os.path.exists(out) for out in outputs):
+                    logger.warning(f"{job['name']} finished without producing all its outputs")
+                    updates["state"] = FAILED
+            elif outputs and all(os.path.exists(out) for out in outputs):
+                updates = {"state": DONE, "finished_at": max(os.path.getmtime(out) for out in outputs)}
+
+            if updates and any(job.get(k) != v for k, v in updates.items()):
+                self.update(job["id"], **updates)
+
+        self._resolve_duplicates()
+
+    def _resolve_duplicates(self):
+        """When one copy of a duplicated job finishes, the other one is superseded."""
+        done_ids = {job["id"] for job in self.jobs(state=DONE)}
+        done_dups = {job["duplicate_of"] for job in self.jobs(state=DONE) if job["duplicate_of"]}
+        for job in self.jobs(state=ACTIVE_STATES):
+            if job["duplicate_of"] in done_ids or job["id"] in done_dups:
+                logger.info(f"{job['name']}: another copy finished first, removing it")
+                if job["backend"] == "condor" and job["cluster_id"]:
+                    subprocess.run(["condor_rm", f"{job['cluster_id']}.{job['proc_id'] or 0}"], capture_output=True)
+                self.update(job["id"], state=SUPERSEDED)
+
+    # ---- Resubmission
+    def _submit_again(self, job):
+        """Run the resubmission command of a job. Returns the new cluster id (if any)."""
+        result = subprocess.run(
+            job["resubmit_cmd"],
+            cwd=job["resubmit_cwd"] or None,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            logger.error(f"Resubmission of {job['name']} failed: {result.stderr.strip()}")
+            return False, None
+        return True, parse_cluster_id(result.stdout)
+
+    def resubmit_failed(self, max_retries=3, backoff=600.):
+        """Resubmit failed jobs, waiting backoff * 2**(attempts-1) seconds between attempts."""
+        now = time.time()
+        resubmitted = 0
+        for job in self.jobs(state=(FAILED, HELD)):
+            if job["attempts"] > max_retries:
+                continue
+            if not job["resubmit_cmd"]:
+                logger.warning(f"{job['name']} failed but has no resubmission command recorded")
+                continue
+            if job["next_retry_at"] is None:
+                self.update(job["id"], next_retry_at=now + backoff * 2 ** (job["attempts"] - 1))
+                continue
+            if now < job["next_retry_at"]:
+                continue
+
+            if job["state"] == HELD and job["backend"] == "condor" and job["cluster_id"]:
+                subprocess.run(["condor_rm", f"{job['cluster_id']}.{job['proc_id'] or 0}"], capture_output=True)
+
+            ok, cluster_id = self._submit_again(job)
+            if not ok:
+                continue
+            logger.info(f"Resubmitted {job['name']} (attempt {job['attempts'] + 1})")
+            if job["backend"] == "local":
+                # Local jobs are rerun synchronously
+                self.update(job["id"], state=DONE, attempts=job["attempts"] + 1, exit_code=0,
+                            started_at=now, finished_at=time.time(), next_retry_at=None)
+                resubmitted += 1
+                continue
+            self.update(
+                job["id"],
+                state=SUBMITTED,
+                attempts=job["attempts"] + 1,
+                cluster_id=cluster_id,
+                proc_id=0 if cluster_id else job["proc_id"],
+                exit_code=None,
+                started_at=None,
+                finished_at=None,
+                next_retry_at=None,
+                submitted_at=now,
+            )
+            resubmitted += 1
+        return resubmitted
+
+    def duplicate_stragglers(self, factor=3.0, min_done=5):
+        """
+        Submit a second copy of running jobs that take longer than `factor`
+        times the median run time of the finished jobs of the same kind and process.
+        """
+        now = time.time()
+        duplicated = 0
+        already_duplicated = {job["duplicate_of"] for job in self.jobs() if job["duplicate_of"]}
+        for job in self.jobs(state=RUNNING):
+            if job["id"] in already_duplicated or job["duplicate_of"] or not job["resubmit_cmd"]:
+                continue
+            walltimes = [
+                j["finished_at"] - j["started_at"]
+                for j in self.jobs(state=DONE, kind=job["kind"], process=job["process"])
+                if j["started_at"] and j["finished_at"]
+            ]
+            if len(walltimes) < min_done or not job["started_at"]:
+                continue
+            if now - job["started_at"] < factor * statistics.median(walltimes):
+                continue
+
+            ok, cluster_id = self._submit_again(job)
+            if not ok:
+                continue
+            logger.info(f"{job['name']} is a straggler: submitted a duplicate")
+            self.add_job(
+                kind=job["kind"],
+                name=job["name"],
+                process=job["process"],
+                backend=job["backend"],
+                cluster_id=cluster_id,
+                proc_id=0,
+                inputs=job["inputs"],
+                outputs=job["outputs"],
+                nevents=job["nevents"],
+                log_path=job["log_path"],
+                resubmit_cmd=job["resubmit_cmd"],
+                resubmit_cwd=job["resubmit_cwd"],
+                duplicate_of=job["id"],
+            )
+            duplicated += 1
+        return duplicated
+
+    # ---- Reporting
+    @staticmethod
+    def retryable(job, max_retries=None):
+        """Whether a failed or held job will still be resubmitted (never if max_retries is None)."""
+        return max_retries is not None and bool(job["resubmit_cmd"]) and job["attempts"] <= max_retries
+
+    def summary(self, kind=None, max_retries=None):
+        """
+        Summarize the job states, throughput and the expected time to completion.
+        Failed and held jobs only count as remaining while they can be
+        resubmitted (see `retryable`), the others are reported as exhausted.
+        """
+        jobs = [job for job in self.jobs(kind=kind) if job["state"] != SUPERSEDED]
+        counts = {}
+        for job in jobs:
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+
+        done = [job for job in jobs if job["state"] == DONE and job["finished_at"]]
+        exhausted = [
+            job for job in jobs
+            if job["state"] in (FAILED, HELD) and not self.retryable(job, max_retries)
+        ]
+        remaining = sum(job["state"] in (*ACTIVE_STATES, FAILED) for job in jobs) - len(exhausted)
+        throughput, eta = None, None
+        if done:
+            first = min(job["submitted_at"] for job in jobs if job["submitted_at"])
+            last = max(job["finished_at"] for job in done)
+            elapsed = max(last - first, 1.)
+            throughput = len(done) / elapsed * 3600.
+            eta = remaining / throughput * 3600. if remaining else 0.
+        return {
+            "total": len(jobs),
+            "counts": counts,
+            "remaining": remaining,
+            "exhausted": [job["name"] for job in exhausted],
+            "throughput_per_hour": throughput,
+            "eta_seconds": eta,
+        }
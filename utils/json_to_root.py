@@ -1,11 +1,19 @@
 """
 Module to convert JSON histogram data to ROOT histograms.
+ROOT is only imported when ROOT histograms are requested: with
+`as_numpy=True` the histograms are returned as NumPy-backed
+`utils.histogram.Histogram` objects.
 """
 
 import json
-import ROOT
 from typing import Dict, List, Union
-from plotting.cms_palette import *
+from .histogram import Histogram, histograms_from_cmgrdf
+from .histogram_sidecar import has_sidecar, read_sidecar
+
+def _histogram_prefix(json_path: str) -> str:
+    """Prefix of the histogram names: <channel>__<plot>__"""
+    channel, plot = json_path.split("/")[-2:]
+    return f"{channel}__{plot}".replace(".json", "") + "__"
 
 class JSONtoROOTConverter:
     """
@@ -17,8 +25,7 @@ class JSONtoROOTConverter:
         Initialize the converter with a JSON file.
         """
         self.json_path = json_path
-        channel, plot = json_path.split("/")[-2:]
-        self.filename = f"{channel}__{plot}".replace(".json", "") 
+        self.filename = _histogram_prefix(json_path)[:-2]
         self.data = self._load_json()
         self.filter_histograms = filter_histograms
         self.histograms = {}
@@ -28,10 +35,11 @@ class JSONtoROOTConverter:
         with open(self.json_path, 'r') as f:
             return json.load(f)
     
-    def _create_histogram(self, histo_name: str, histo_data: Dict) -> ROOT.TH1D:
+    def _create_histogram(self, histo_name: str, histo_data: Dict) -> "ROOT.TH1D":
         """
         Create a ROOT TH1D histogram from JSON data with variable binning.
         """
+        import ROOT
         # Extract bin edges
         bins = histo_data['axes']['x']['bins']
         nbins = len(bins) - 1
@@ -68,7 +76,7 @@ class JSONtoROOTConverter:
         
         return hist
     
-    def convert_all(self) -> Dict[str, ROOT.TH1D]:
+    def convert_all(self) -> Dict[str, "ROOT.TH1D"]:
         """
         Convert all histograms in the JSON file to ROOT histograms.
         """
@@ -83,7 +91,18 @@ class JSONtoROOTConverter:
         
         return self.histograms
     
-    def convert_single(self, histo_name: str) -> ROOT.TH1D:
+    def to_numpy(self) -> Dict[str, Histogram]:
+        """
+        Convert the (filtered) histograms to NumPy-backed histograms, keyed by
+        histogram name. Does not require ROOT.
+        """
+        return histograms_from_cmgrdf(
+            self.data,
+            filter_histograms=self.filter_histograms,
+            prefix=f"{self.filename}__",
+        )
+
+    def convert_single(self, histo_name: str) -> "ROOT.TH1D":
         """
         Convert a single histogram by name.
         """
@@ -98,6 +117,7 @@ class JSONtoROOTConverter:
         """
         Save all converted histograms to a ROOT file.
         """
+        import ROOT
         if not self.histograms:
             self.convert_all()
         
@@ -107,7 +127,7 @@ class JSONtoROOTConverter:
         root_file.Close()
         print(f"Saved {len(self.histograms)} histograms to {output_path}")
     
-    def get_histogram(self, histo_name: str) -> Union[ROOT.TH1D, None]:
+    def get_histogram(self, histo_name: str) -> Union["ROOT.TH1D", None]:
         """
         Get a specific histogram (convert if not already done).
         """
@@ -124,15 +144,35 @@ class JSONtoROOTConverter:
         return list(self.data.get('histos', {}).keys())
 
 
-def read_json_histograms(json_path: str, filter_histograms: List[str] = []) -> Dict[str, ROOT.TH1D]:
+def read_json_histograms(
+        json_path: str,
+        filter_histograms: List[str] = [],
+        as_numpy: bool = False
+    ) -> Dict[str, Union["ROOT.TH1D", Histogram]]:
     """
     Convenience function to read and convert all histograms from a JSON file.
+    The binary sidecar (see utils/histogram_sidecar.py) is used when available.
     
     Args:
         json_path: Path to the JSON file
+        filter_histograms: Names of the histograms to read (all if empty)
+        as_numpy: Return NumPy-backed Histogram objects instead of ROOT.TH1D
         
     Returns:
-        Dictionary mapping histogram names to ROOT.TH1D objects
+        Dictionary mapping histogram names to ROOT.TH1D (or Histogram) objects
     """
+    # Read only the requested histograms from the binary sidecar, if there is one
+    if has_sidecar(json_path):
+        histograms = read_sidecar(json_path, filter_histograms, prefix=_histogram_prefix(json_path))
+        if as_numpy:
+            return histograms
+        root_histograms = {}
+        for name, hist in histograms.items():
+            root_histograms[name] = hist.to_root()
+            root_histograms[name].SetLineWidth(0)
+        return root_histograms
+
     converter = JSONtoROOTConverter(json_path, filter_histograms=filter_histograms)
+    if as_numpy:
+        return converter.to_numpy()
     return converter.convert_all()
@@ -1,16 +1,55 @@
 import os
 import re
+import json
 import subprocess
 import ROOT
 import argparse
 import time
+import shutil
+import shlex
+import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    # uproot only reads the TTree metadata, much cheaper than a full TFile.Open
+    import uproot
+except ImportError:
+    uproot = None
 
 # Create the logger instance
 from logger import get_logger
+from job_ledger import JobLedger, parse_cluster_id
+import relayout
 logger = get_logger( __name__ )
 
 cwd = os.getcwd()
 
+# Journal of the planned moves (in inpath) and marker of the fully populated chunk folders
+JOURNAL_NAME = "merge_journal.json"
+COMPLETE_MARKER = ".complete"
+
+# Reason codes of the quarantined files
+INTEGRITY_REASONS = {
+    "open_failed": "the file cannot be opened",
+    "recovered": "the file was not closed properly (truncated) and had to be recovered",
+    "unreadable_key": "an object of the file cannot be read",
+    "no_events_tree": "no Events tree",
+    "empty": "the Events tree is empty",
+    "no_runs_tree": "no Runs tree, or an empty one",
+    "runs_mismatch": "the Runs tree counts fewer generated events than the Events tree has",
+    "basket_read_error": "a sampled entry cannot be read",
+    "exception": "an error occurred while checking the file",
+}
+
+HADDNANO = "/cvmfs/cms.cern.ch/el9_amd64_gcc12/cms/cmssw/CMSSW_14_0_6/bin/el9_amd64_gcc12/haddnano.py"
+
+def fan_in_type(value):
+    """argparse type of --fan-in: a tree reduction needs at least 2 files per merge."""
+    fan_in = int(value)
+    if fan_in < 2:
+        raise argparse.ArgumentTypeError(f"the fan-in must be at least 2, got {fan_in}")
+    return fan_in
+
 def add_parsing_options():
     """ This is a custom parser that allows for passing options to the code """
     parser = argparse.ArgumentParser()
@@ -27,6 +66,46 @@ def add_parsing_options():
         type = int,
         help = "Path with batch outputs."
     )
+    parser.add_argument(
+        '--strategy', 
+        dest = "strategy", 
+        default = "greedy",
+        choices = ["greedy", "balanced"],
+        help = "How files are grouped into chunks: greedy (batch order) or balanced (near-equal events and bytes)."
+    )
+    parser.add_argument(
+        '--verify', 
+        dest = "verify", 
+        action = 'store_true',
+        help = "Check the integrity of the files (trees, keys) while counting them, and quarantine the bad ones."
+    )
+    parser.add_argument(
+        '--sample-baskets', 
+        dest = "sample_baskets", 
+        default = 0,
+        type = int,
+        help = "With --verify, also read this many entries spread over each file."
+    )
+    parser.add_argument(
+        '--backend', 
+        dest = "backend", 
+        default = "condor",
+        choices = ["condor", "local"],
+        help = "Merge the chunks with HTCondor jobs or locally on --ncores processes."
+    )
+    parser.add_argument(
+        '--fan-in', 
+        dest = "fan_in", 
+        default = 2,
+        type = fan_in_type,
+        help = "Number of files merged together at each step of the local tree reduction (at least 2)."
+    )
+    parser.add_argument(
+        '--merger', 
+        dest = "merger", 
+        default = HADDNANO,
+        help = "Merging command, called as: <merger> output.root input1.root input2.root ..."
+    )
     parser.add_argument(
         '--submit', 
         dest = "submit", 
@@ -38,7 +117,13 @@ def add_parsing_options():
         dest = "ncores", 
         default = 1,
         type = int,
-        help = "Number of cores to run with (only for local execution)."
+        help = "Number of cores to run with (event counting and local execution)."
+    )
+    parser.add_argument(
+        '--ledger', 
+        dest = "ledger", 
+        default = None,
+        help = "Path to a job ledger (sqlite) where the merge jobs are recorded."
     )
     parser.add_argument(
         '--dry-run', 
@@ -46,28 +131,134 @@ def add_parsing_options():
         action = 'store_true',
         help = "Print actions without executing them."
     )
+    relayout.add_parsing_options(parser)
     return parser.parse_args()
 
-def get_events_in_file(filename, treename="Events"):
-    """Return number of entries in the given ROOT file for the specified tree."""
+def count_file_events(filename, treename="Events"):
+    """
+    Return (nevents, reason) for the given tree of a ROOT file, reason being None
+    when the tree could be read and has entries, or one of INTEGRITY_REASONS.
+    """
+    if uproot is not None:
+        try:
+            with uproot.open(filename) as f:
+                if treename not in f:
+                    logger.warning( f"{filename} has no tree named {treename}" )
+                    return 0, "no_events_tree"
+                nevents = f[treename].num_entries
+                return nevents, None if nevents else "empty"
+        except Exception as e:
+            logger.error(f"Reading {filename}: {e}")
+            return 0, "open_failed"
     try:
         f = ROOT.TFile.Open(filename)
         if not f or f.IsZombie():
             logger.warning(f"could not open {filename}")
-            return 0
+            return 0, "open_failed"
         tree = f.Get(treename)
         if not tree:
             logger.warning( f"{filename} has no tree named {treename}" )
-            return 0
+            return 0, "no_events_tree"
         entries = tree.GetEntries()
         f.Close()
-        return entries
+        return entries, None if entries else "empty"
     except Exception as e:
         logger.error(f"Reading {filename}: {e}")
-        return 0
+        return 0, "exception"
 
-def log_chunk_events(outfolder, files, treename="Events", dry_run=False):
-    """Write a log file with per-file and total event counts before moving files."""
+def get_events_in_file(filename, treename="Events"):
+    """Return number of entries in the given ROOT file for the specified tree."""
+    return count_file_events(filename, treename)[0]
+
+def check_file_integrity(filename, treename="Events", sample_baskets=0):
+    """
+    Fast integrity check of a NanoGEN file. Returns (nevents, reason), reason
+    being None for a good file or one of INTEGRITY_REASONS. If `sample_baskets`
+    is set, that many entries spread over the file (including the last one)
+    are read, which decompresses the corresponding baskets.
+    """
+    f = None
+    try:
+        f = ROOT.TFile.Open(filename)
+        if not f or f.IsZombie():
+            return 0, "open_failed"
+        if f.TestBit(ROOT.TFile.kRecovered):
+            return 0, "recovered"
+        for key in f.GetListOfKeys():
+            if not key.ReadObj():
+                return 0, "unreadable_key"
+        tree = f.Get(treename)
+        if not tree:
+            return 0, "no_events_tree"
+        nevents = tree.GetEntries()
+        if nevents == 0:
+            return 0, "empty"
+        runs = f.Get("Runs")
+        if not runs or runs.GetEntries() == 0:
+            return nevents, "no_runs_tree"
+        if runs.GetBranch("genEventCount"):
+            generated = sum(entry.genEventCount for entry in runs)
+            if generated < nevents:
+                return nevents, "runs_mismatch"
+        if sample_baskets:
+            step = max(1, nevents // sample_baskets)
+            for ientry in sorted(set(range(0, nevents, step)) | {nevents - 1}):
+                if tree.GetEntry(ientry) <= 0:
+                    return nevents, "basket_read_error"
+        return nevents, None
+    except Exception as e:
+        logger.error(f"Checking {filename}: {e}")
+        return 0, "exception"
+    finally:
+        if f:
+            f.Close()
+
+def _map_files(func, files, ncores, *args):
+    """Apply `func(file, *args)` to all the files on `ncores` worker processes."""
+    if ncores <= 1:
+        return [func(f, *args) for f in files]
+    with ProcessPoolExecutor(max_workers=ncores) as pool:
+        return list(pool.map(func, files, *[[arg] * len(files) for arg in args], chunksize=16))
+
+def _split_results(results):
+    """{file: (nevents, reason)} -> {file: nevents}, {file: reason} of the bad files."""
+    counts = {f: nevents for f, (nevents, _) in results.items()}
+    reasons = {f: reason for f, (_, reason) in results.items() if reason is not None}
+    return counts, reasons
+
+def count_events(files, treename="Events", ncores=1):
+    """
+    Count the entries of all the files concurrently on `ncores` worker processes,
+    each file being opened only once. Returns {file: nevents} and {file: reason}
+    for the files that cannot be read or have no events, as verify_files.
+    """
+    logger.info(f"Counting events in {len(files)} files with {ncores} worker(s)")
+    return _split_results(dict(zip(files, _map_files(count_file_events, files, ncores, treename))))
+
+def verify_files(files, treename="Events", ncores=1, sample_baskets=0):
+    """
+    Check the integrity of all the files concurrently, counting their events at
+    the same time. Returns {file: nevents} and {file: reason} for the bad files.
+    """
+    logger.info(f"Checking the integrity of {len(files)} files with {ncores} worker(s)")
+    return _split_results(dict(zip(files, _map_files(check_file_integrity, files, ncores, treename, sample_baskets))))
+
+def quarantine_file(f, batch_num, reason, dry_run=False):
+    """Move a bad file to problematic_files/ and record why in problematic_files/quarantine.log."""
+    dest = os.path.join("problematic_files", f"GEN_batch{batch_num}.root")
+    logger.warning(f"Quarantining {f} ({reason})")
+    if dry_run:
+        logger.info(f"[DRY RUN] Would move {f} -> {dest}")
+        return
+    os.rename(f, dest)
+    with open(os.path.join("problematic_files", "quarantine.log"), "a") as log:
+        log.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {f} -> {dest}: {reason} ({INTEGRITY_REASONS[reason]})\n")
+
+def log_chunk_events(outfolder, files, treename="Events", dry_run=False, counts=None):
+    """
+    Write a log file with per-file and total event counts before moving files.
+    The counts are taken from `counts` ({file: nevents}) when available.
+    """
     if not dry_run:
         os.makedirs(outfolder, exist_ok=True)
     log_path = os.path.join(outfolder, "log.txt")
@@ -77,7 +268,7 @@ def log_chunk_events(outfolder, files, treename="Events", dry_run=False):
     # Files can be either a list of paths or list of tuples (path, batch_num)
     for item in files:
         f = item[0] if isinstance(item, tuple) else item
-        nevents = get_events_in_file(f, treename)
+        nevents = counts[f] if counts and f in counts else get_events_in_file(f, treename)
         lines.append(f"{f}: {nevents} events")
         total_events += nevents
 
@@ -92,37 +283,165 @@ def log_chunk_events(outfolder, files, treename="Events", dry_run=False):
             logfile.write("\n".join(lines) + "\n")
         logger.info(f"Wrote log to {log_path}")
 
-def move_files_to_chunk(outfolder, input_files, dry_run=False):
-    """Move input files into a dedicated chunk folder, renaming from GEN.root to GEN_batchNUMBER.root."""
-    logger.debug(f"Moving {len(input_files)} files -> {outfolder}")
-    if not dry_run:
-        os.makedirs(outfolder, exist_ok=True)
-    else:
-        logger.info(f"[DRY RUN] Would create directory: {outfolder}")
-    
+def chunk_moves(outfolder, input_files):
+    """List the (source, destination) renames moving the input files into a chunk folder."""
+    moves = []
     for item in input_files:
         # Handle both (filepath, batch_num) tuples and plain filepaths
         if isinstance(item, tuple):
             file, batch_num = item
-            dest_name = f"GEN_batch{batch_num}.root"
-            dest_path = os.path.join(outfolder, dest_name)
-            if dry_run:
-                logger.info(f"[DRY RUN] Would execute: mv {file} {dest_path}")
-            else:
-                logger.warning(f"  - Moving {file} -> {dest_path}")
-                subprocess.run(["mv", file, dest_path], check=True)
+            moves.append((file, os.path.join(outfolder, f"GEN_batch{batch_num}.root")))
         else:
-            file = item
-            dest_path = os.path.join(outfolder, os.path.basename(file))
-            if dry_run:
-                logger.info(f"[DRY RUN] Would execute: mv {file} {dest_path}")
-            else:
-                logger.warning(f"  - Moving {file}")
-                subprocess.run(["mv", file, outfolder], check=True)
-
-def group_files(inpath, target_events, treename="Events", dry_run=False):
-    """Group ROOT files into new chunk folders, without touching existing ones."""
+            moves.append((item, os.path.join(outfolder, os.path.basename(item))))
+    return moves
+
+def move_files_to_chunk(outfolder, input_files, dry_run=False, moves=None):
+    """
+    Move input files into a dedicated chunk folder, renaming from GEN.root to GEN_batchNUMBER.root.
+    Files already moved (destination present, source gone) are skipped, so that an interrupted
+    move can be resumed; files gone from both places are reported in the chunk log and skipped.
+    Once all the files are in place the folder is marked as complete.
+    """
+    moves = moves if moves is not None else chunk_moves(outfolder, input_files)
+    logger.debug(f"Moving {len(moves)} files -> {outfolder}")
+    if dry_run:
+        logger.info(f"[DRY RUN] Would create directory: {outfolder}")
+        for src, dest in moves:
+            logger.info(f"[DRY RUN] Would move {src} -> {dest}")
+        return
+
+    os.makedirs(outfolder, exist_ok=True)
+    for src, dest in moves:
+        if not os.path.exists(src):
+            if not os.path.exists(dest):
+                # Quarantined or deleted since the journal was written: the chunk is merged without it
+                logger.warning(f"{outfolder}: {src} is gone and was never moved to {dest}, skipping it")
+                with open(os.path.join(outfolder, "log.txt"), "a") as logfile:
+                    logfile.write(f"{src}: missing, not moved\n")
+            continue
+        os.rename(src, dest)
+    open(os.path.join(outfolder, COMPLETE_MARKER), "w").close()
+    logger.info(f"Moved {len(moves)} files -> {outfolder}")
+
+def write_journal(journal):
+    """Write the journal of planned moves atomically."""
+    tmp_path = f"{JOURNAL_NAME}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(journal, f, indent=1)
+    os.replace(tmp_path, JOURNAL_NAME)
+
+def is_complete(outfolder):
+    """A chunk folder is complete once all its files were moved in (COMPLETE_MARKER)."""
+    return os.path.exists(os.path.join(outfolder, COMPLETE_MARKER))
+
+def execute_journal(journal, dry_run=False):
+    """Perform the moves of all the chunks of the journal that are not complete yet."""
+    for outfolder, chunk in journal["chunks"].items():
+        if chunk["complete"] or is_complete(outfolder):
+            continue
+        if not os.path.exists(os.path.join(outfolder, "log.txt")):
+            log_chunk_events(outfolder, list(chunk["nevents"]), dry_run=dry_run, counts=chunk["nevents"])
+        move_files_to_chunk(outfolder, None, dry_run=dry_run, moves=chunk["moves"])
+        if dry_run:
+            continue
+        chunk["complete"] = True
+        write_journal(journal)
+    if not dry_run:
+        os.remove(JOURNAL_NAME)
+
+def resume_journal(dry_run=False):
+    """Finish the moves of a previous interrupted grouping, if any. Must be run from inpath."""
+    if not os.path.exists(JOURNAL_NAME):
+        return
+    with open(JOURNAL_NAME) as f:
+        journal = json.load(f)
+    pending = [folder for folder, chunk in journal["chunks"].items() if not chunk["complete"]]
+    logger.warning(f"Resuming an interrupted grouping: {len(pending)} chunk folder(s) to complete")
+    execute_journal(journal, dry_run=dry_run)
+
+def complete_chunks(inpath):
+    """
+    Chunk folders of inpath that can be merged: only the ones marked complete.
+    Folders without the marker (interrupted grouping, or grouped by an older
+    version) are reported and left alone.
+    """
+    folders = sorted(d for d in os.listdir(inpath) if d.endswith("_chunks"))
+    complete = [d for d in folders if is_complete(os.path.join(inpath, d))]
+    for folder in sorted(set(folders) - set(complete)):
+        logger.warning(
+            f"{folder} is not marked complete, not merging it. If all its files are in place, "
+            f"mark it with: touch {os.path.join(inpath, folder, COMPLETE_MARKER)}"
+        )
+    return complete
+
+def group_greedy(files, counts, target_events):
+    """Fill the chunks in batch-number order until `target_events` is exceeded."""
+    groups = []
+    current_group = []
+    current_events = 0
+    for f, batch_num in files:
+        if current_events + counts[f] > target_events and current_group:
+            groups.append(current_group)
+            current_group = []
+            current_events = 0
+        current_group.append((f, batch_num))
+        current_events += counts[f]
+    if current_group:
+        groups.append(current_group)
+    return groups
+
+def group_balanced(files, counts, target_events):
+    """
+    Split the files into ceil(total / target_events) chunks of near-equal
+    events and bytes: files are sorted by decreasing size and each one is
+    placed in the currently lightest chunk (first-fit-decreasing/LPT).
+    Events and bytes are normalized so that both are balanced at once.
+    """
+    if not files:
+        return []
+    sizes = {f: os.path.getsize(f) for f, _ in files}
+    total_events = sum(counts[f] for f, _ in files)
+    total_bytes = sum(sizes.values()) or 1
+    nchunks = min(len(files), max(1, -(-total_events // target_events)))
+
+    def weight(f):
+        return counts[f] / total_events + sizes[f] / total_bytes
+
+    groups = [[] for _ in range(nchunks)]
+    loads = [0.] * nchunks
+    for f, batch_num in sorted(files, key=lambda item: weight(item[0]), reverse=True):
+        ichunk = loads.index(min(loads))
+        groups[ichunk].append((f, batch_num))
+        loads[ichunk] += weight(f)
+
+    # Keep the batch-number order inside each chunk
+    return [sorted(group, key=lambda item: int(item[1])) for group in groups]
+
+GROUPING_STRATEGIES = {
+    "greedy": group_greedy,
+    "balanced": group_balanced,
+}
+
+def log_group_balance(groups, counts):
+    """Log the spread of the chunk sizes."""
+    if not groups:
+        return
+    nevents = [sum(counts[f] for f, _ in group) for group in groups]
+    nbytes = [sum(os.path.getsize(f) for f, _ in group) for group in groups]
+    logger.info(
+        f"{len(groups)} chunks: {min(nevents)}-{max(nevents)} events, "
+        f"{min(nbytes) / 1024**2:.0f}-{max(nbytes) / 1024**2:.0f} MB"
+    )
+
+def group_files(inpath, target_events, treename="Events", dry_run=False, ncores=1, strategy="greedy",
+                verify=False, sample_baskets=0):
+    """
+    Group ROOT files into new chunk folders, without touching existing ones.
+    The planned moves are written to a journal before being performed, so that
+    an interrupted grouping is completed by the next run.
+    """
     os.chdir(inpath)
+    resume_journal(dry_run=dry_run)
     
     # Find all batchNUMBER directories
     batch_dirs = [d for d in os.listdir(".") if os.path.isdir(d) and re.match(r"batch\d+", d)]
@@ -149,75 +468,66 @@ def group_files(inpath, target_events, treename="Events", dry_run=False):
         return None
 
     logger.info(f"Found {len(files)} files")
+    if verify:
+        counts, reasons = verify_files([f for f, _ in files], treename, ncores, sample_baskets)
+    else:
+        counts, reasons = count_events([f for f, _ in files], treename, ncores)
 
-    current_group = []
-    current_events = 0
     output_index = 0
 
     if not dry_run:
         os.makedirs("problematic_files", exist_ok=True)
     else:
         logger.info("[DRY RUN] Would create directory: problematic_files")
-    
-    output_prefix = os.getcwd().split("/")[-1]
-
-    # Find the next free chunk index
-    while os.path.exists(f"{output_prefix}_{output_index}_chunks"):
-        logger.info(f"Skipping existing chunk folder {output_prefix}_{output_index}_chunks")
-        output_index += 1
 
+    valid_files = []
     for f, batch_num in files:
-        logger.info( f"Reading file: {f} ({batch_num})" )
-        nevents = get_events_in_file(f, treename)
-        if nevents == 0:
-            if dry_run:
-                logger.info(f"[DRY RUN] Would execute: mv {f} problematic_files/")
-            else:
-                subprocess.run(["mv", f, "problematic_files/"], check=True)
+        logger.debug( f"{f} ({batch_num}): {counts[f]} events" )
+        if f in reasons:
+            quarantine_file(f, batch_num, reasons[f], dry_run=dry_run)
             continue
+        valid_files.append((f, batch_num))
 
-        if current_events + nevents > target_events and current_group:
-            output_name = f"{output_prefix}_{output_index}.root"
-            outfolder = output_name.replace(".root", "_chunks")
-
-            # Only create if it doesn't exist
-            if not os.path.exists(outfolder):
-                log_chunk_events(outfolder, current_group, treename, dry_run=dry_run)
+    groups = GROUPING_STRATEGIES[strategy](valid_files, counts, target_events)
+    log_group_balance(groups, counts)
 
-                move_files_to_chunk(outfolder, current_group, dry_run=dry_run)
-            else:
-                logger.info(f"Skipping {outfolder} (already exists)")
+    output_prefix = os.getcwd().split("/")[-1]
 
+    # Plan all the moves first
+    journal = {"chunks": {}}
+    for group in groups:
+        # Move past any existing chunk folders
+        while os.path.exists(f"{output_prefix}_{output_index}_chunks"):
+            logger.info(f"Skipping existing chunk folder {output_prefix}_{output_index}_chunks")
             output_index += 1
-            current_group = []
-            current_events = 0
 
-            # Move past any existing chunk folders
-            while os.path.exists(f"{output_prefix}_{output_index}_chunks"):
-                logger.info(f"Skipping existing chunk folder {output_prefix}_{output_index}_chunks")
-                output_index += 1
-
-        current_group.append((f, batch_num))
-        current_events += nevents
-
-    # Handle last group
-    if current_group:
         output_name = f"{output_prefix}_{output_index}.root"
         outfolder = output_name.replace(".root", "_chunks")
+        journal["chunks"][outfolder] = {
+            "moves": chunk_moves(outfolder, group),
+            "nevents": {f: counts[f] for f, _ in group},
+            "complete": False,
+        }
+        output_index += 1
+
+    if not dry_run:
+        write_journal(journal)
+    execute_journal(journal, dry_run=dry_run)
 
-        if not os.path.exists(outfolder):
-            log_chunk_events(outfolder, current_group, treename, dry_run=dry_run)
-            move_files_to_chunk(outfolder, current_group, dry_run=dry_run)
-        else:
-            logger.info(f"Skipping {outfolder} (already exists)")
 
+def relayout_command(infile, outfile, relayout_args):
+    """Command re-writing a merged file with the re-layout options."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relayout.py")
+    return ["python3", script, infile, outfile, *relayout_args]
 
-def create_condor_wrapper(temp_dir):
+def create_condor_wrapper(temp_dir, relayout_args=None):
     """Create a wrapper script for condor to execute merge jobs."""
     wrapper_path = os.path.join(temp_dir, "condor_merge_wrapper.sh")
     with open(wrapper_path, "w") as f:
         f.write("#!/bin/bash\n")
-        f.write("# HTCondor wrapper for merging ROOT files\n\n")
+        f.write("# HTCondor wrapper for merging ROOT files\n")
+        f.write("# Any failing step fails the job, and no partial output is left in the chunk folder\n")
+        f.write("set -e\n\n")
         f.write("CHUNK_FOLDER=$1\n")
         f.write("OUTPUT_NAME=$2\n")
         f.write("WORKDIR=$3\n\n")
@@ -227,13 +537,18 @@ def create_condor_wrapper(temp_dir):
         f.write('    echo "No ROOT files to merge"\n')
         f.write('    exit 1\n')
         f.write('fi\n\n')
-        f.write("HADDNANO=/cvmfs/cms.cern.ch/el9_amd64_gcc12/cms/cmssw/CMSSW_14_0_6/bin/el9_amd64_gcc12/haddnano.py\n\n")
+        f.write(f"HADDNANO={HADDNANO}\n\n")
         f.write('if [ -f "../$OUTPUT_NAME" ]; then\n')
         f.write('    echo "Output file $OUTPUT_NAME already exists. Skipping."\n')
         f.write('    exit 0\n')
         f.write('fi\n\n')
+        f.write("trap 'rm -f \"$OUTPUT_NAME\" \"relayout_$OUTPUT_NAME\"' ERR\n")
         f.write('echo "Merging ${FILES[@]} into $OUTPUT_NAME"\n')
         f.write('$HADDNANO $OUTPUT_NAME "${FILES[@]}"\n')
+        if relayout_args:
+            cmd = " ".join(relayout_command("$OUTPUT_NAME", "relayout_$OUTPUT_NAME", [shlex.quote(a) for a in relayout_args]))
+            f.write(f'{cmd}\n')
+            f.write('mv relayout_$OUTPUT_NAME $OUTPUT_NAME\n')
         f.write('mv $OUTPUT_NAME ..\n')
         f.write('echo "Merge complete"\n')
     
@@ -242,36 +557,73 @@ def create_condor_wrapper(temp_dir):
     return wrapper_path
 
 
+def _write_condor_header(f, wrapper_script):
+    """Write the common part of the merge submit files."""
+    f.write("# HTCondor submit file for merging ROOT files\n")
+    f.write("universe = vanilla\n")
+    f.write(f"executable = {wrapper_script}\n")
+    f.write("should_transfer_files = NO\n")
+    f.write("+JobFlavour = \"workday\"\n\n")
+
+def _write_condor_job(f, inpath, folder, log_dir):
+    """Write the queue statement merging one chunk folder."""
+    output_name = folder.replace("_chunks", ".root")
+    f.write(f"arguments = {folder} {output_name} {inpath}\n")
+    f.write(f"output = {log_dir}/{folder}.out\n")
+    f.write(f"error = {log_dir}/{folder}.err\n")
+    f.write(f"log = {log_dir}/{folder}.log\n")
+    f.write("queue\n\n")
+
 def create_condor_submit_file(inpath, chunk_folders, temp_dir):
     """Create HTCondor submit file for merge jobs."""
     submit_file = os.path.join(temp_dir, "merge_jobs.sub")
     wrapper_script = os.path.join(temp_dir, "condor_merge_wrapper.sh")
+    log_dir = os.path.join(temp_dir, "condor_logs")
+    os.makedirs(log_dir, exist_ok=True)
     
     with open(submit_file, "w") as f:
-        f.write("# HTCondor submit file for merging ROOT files\n")
-        f.write("universe = vanilla\n")
-        f.write(f"executable = {wrapper_script}\n")
-        f.write("should_transfer_files = NO\n")
-        f.write("+JobFlavour = \"workday\"\n\n")
-        
+        _write_condor_header(f, wrapper_script)
         for folder in chunk_folders:
-            output_name = folder.replace("_chunks", ".root")
-            log_dir = os.path.join(temp_dir, "condor_logs")
-            os.makedirs(log_dir, exist_ok=True)
-            
-            f.write(f"arguments = {folder} {output_name} {inpath}\n")
-            f.write(f"output = {log_dir}/{folder}.out\n")
-            f.write(f"error = {log_dir}/{folder}.err\n")
-            f.write(f"log = {log_dir}/{folder}.log\n")
-            f.write("queue\n\n")
+            _write_condor_job(f, inpath, folder, log_dir)
     
     logger.info(f"Created condor submit file: {submit_file}")
     return submit_file
 
-def merge_all_chunks_condor(inpath, submit=False):
+def create_condor_resubmit_file(inpath, folder, temp_dir):
+    """Create a submit file merging a single chunk folder (used for resubmissions)."""
+    resubmit_dir = os.path.join(temp_dir, "resubmit")
+    os.makedirs(resubmit_dir, exist_ok=True)
+    submit_file = os.path.join(resubmit_dir, f"{folder}.sub")
+    with open(submit_file, "w") as f:
+        _write_condor_header(f, os.path.join(temp_dir, "condor_merge_wrapper.sh"))
+        _write_condor_job(f, inpath, folder, os.path.join(temp_dir, "condor_logs"))
+    return submit_file
+
+def record_merge_jobs(ledger_path, inpath, chunk_folders, temp_dir, cluster_id):
+    """Record the submitted merge jobs in the job ledger."""
+    ledger = JobLedger(ledger_path)
+    sample_name = inpath.rstrip("/").split("/")[-1]
+    temp_dir = os.path.abspath(temp_dir)
+    for proc_id, folder in enumerate(chunk_folders):
+        ledger.add_job(
+            kind="merge",
+            name=f"merge_{folder}",
+            process=sample_name,
+            backend="condor",
+            cluster_id=cluster_id,
+            proc_id=proc_id,
+            inputs=[os.path.join(inpath, folder)],
+            outputs=[os.path.join(inpath, folder.replace("_chunks", ".root"))],
+            log_path=os.path.join(temp_dir, "condor_logs", f"{folder}.log"),
+            resubmit_cmd=["condor_submit", create_condor_resubmit_file(inpath, folder, temp_dir)],
+            resubmit_cwd=cwd,
+        )
+    logger.info(f"Recorded {len(chunk_folders)} merge jobs in {ledger_path}")
+
+def merge_all_chunks_condor(inpath, submit=False, ledger=None, relayout_args=None):
     """Submit merge jobs to HTCondor."""
     os.chdir(cwd)
-    chunk_folders = [d for d in os.listdir( inpath ) if d.endswith("_chunks")]
+    chunk_folders = complete_chunks(inpath)
     
     if not chunk_folders:
         logger.warning("No chunk folders found to merge")
@@ -288,7 +640,7 @@ def merge_all_chunks_condor(inpath, submit=False):
     logger.info(f"Created temporary directory for condor files: {temp_dir}")
     
     # Create wrapper script and submit file
-    create_condor_wrapper(temp_dir)
+    create_condor_wrapper(temp_dir, relayout_args)
     submit_file = create_condor_submit_file(inpath, chunk_folders, temp_dir)
     
     if not submit:
@@ -307,11 +659,126 @@ def merge_all_chunks_condor(inpath, submit=False):
     else:
         logger.error(f"Failed to submit jobs: {result.stderr}")
         return
+
+    if ledger is not None:
+        record_merge_jobs(ledger, inpath, chunk_folders, temp_dir, parse_cluster_id(result.stdout))
     
     logger.info("Monitor jobs with: condor_q")
     logger.info(f"Check logs in: {os.path.join(temp_dir, 'condor_logs')}")
 
 
+def _run(cmd, output):
+    """Run a command producing `output`."""
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(cmd[0])} failed for {output}: {result.stderr.strip()}")
+    if result.stdout.strip():
+        logger.debug(result.stdout.strip())
+    return output
+
+def _merge_files(merger, output, inputs):
+    """Merge `inputs` into `output` with the merging command."""
+    return _run([merger, output, *inputs], output)
+
+def merge_chunk_local(inpath, folder, pool, merger=HADDNANO, fan_in=2, relayout_args=None):
+    """
+    Merge one chunk folder with a tree reduction: the files are merged in groups
+    of `fan_in` on the worker pool, level after level, until a single merge is
+    left. The output is written to a temporary file (re-layout if requested) and
+    renamed at the end, so that an existing output is always complete.
+    """
+    output = os.path.join(inpath, folder.replace("_chunks", ".root"))
+    if os.path.exists(output):
+        logger.info(f"Output file {output} already exists. Skipping.")
+        return "skipped"
+
+    files = sorted(glob.glob(os.path.join(inpath, folder, "*.root")))
+    if not files:
+        logger.error(f"No ROOT files to merge in {folder}")
+        return "failed"
+
+    tmpdir = os.path.join(inpath, folder, ".merge_tmp")
+    os.makedirs(tmpdir, exist_ok=True)
+    tmp_output = os.path.join(inpath, f".{os.path.basename(output)}.tmp")
+    try:
+        level = 0
+        while len(files) > fan_in:
+            groups = [files[i:i + fan_in] for i in range(0, len(files), fan_in)]
+            merged = [
+                group[0] if len(group) == 1 else pool.submit(
+                    _merge_files, merger, os.path.join(tmpdir, f"level{level}_{igroup}.root"), group
+                )
+                for igroup, group in enumerate(groups)
+            ]
+            merged = [item if isinstance(item, str) else item.result() for item in merged]
+
+            # Intermediate files of the previous level are not needed anymore
+            for f in files:
+                if f.startswith(tmpdir) and f not in merged:
+                    os.remove(f)
+            files = merged
+            level += 1
+
+        pool.submit(_merge_files, merger, tmp_output, files).result()
+        if relayout_args:
+            tmp_relayout = os.path.join(tmpdir, "relayout.root")
+            pool.submit(_run, relayout_command(tmp_output, tmp_relayout, relayout_args), tmp_relayout).result()
+            os.replace(tmp_relayout, tmp_output)
+        os.replace(tmp_output, output)
+    except Exception as e:
+        logger.error(f"Merging {folder}: {e}")
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        return "failed"
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    logger.info(f"Merged {folder} -> {output}")
+    return "done"
+
+def merge_all_chunks_local(inpath, ncores=1, merger=HADDNANO, fan_in=2, ledger=None, relayout_args=None):
+    """Merge all the chunk folders on a local pool of `ncores` merging processes."""
+    assert fan_in >= 2, f"the fan-in must be at least 2, got {fan_in}"
+    os.chdir(cwd)
+    inpath = os.path.abspath(inpath)
+    chunk_folders = complete_chunks(inpath)
+
+    if not chunk_folders:
+        logger.warning("No chunk folders found to merge")
+        return
+
+    logger.info(f"Merging {len(chunk_folders)} chunk folders locally on {ncores} worker(s)")
+    start = time.time()
+
+    # The merges run on `pool`; one driver thread per chunk only waits for them
+    with ThreadPoolExecutor(max_workers=ncores) as pool, \
+         ThreadPoolExecutor(max_workers=len(chunk_folders)) as drivers:
+        results = list(drivers.map(
+            lambda folder: merge_chunk_local(inpath, folder, pool, merger, fan_in, relayout_args),
+            chunk_folders
+        ))
+
+    if ledger is not None:
+        job_ledger = JobLedger(ledger)
+        for folder, status in zip(chunk_folders, results):
+            if status == "skipped":
+                continue
+            job_ledger.add_job(
+                kind="merge",
+                name=f"merge_{folder}",
+                process=inpath.rstrip("/").split("/")[-1],
+                backend="local",
+                state=status,
+                inputs=[os.path.join(inpath, folder)],
+                outputs=[os.path.join(inpath, folder.replace("_chunks", ".root"))],
+            )
+
+    logger.info(
+        f"Local merge finished in {time.time() - start:.0f} s: "
+        f"{results.count('done')} merged, {results.count('skipped')} skipped, {results.count('failed')} failed"
+    )
+
+
 if __name__ == "__main__":
     opts = add_parsing_options()
     inpath = opts.inpath
@@ -319,13 +786,29 @@ if __name__ == "__main__":
     ncores = opts.ncores
     submit = opts.submit
     dry_run = opts.dry_run
+    ledger = os.path.abspath(opts.ledger) if opts.ledger else None
+    relayout_args = relayout.relayout_arguments(opts) if opts.algorithm else None
 
     if dry_run:
         logger.info("=== DRY RUN MODE - No files will be moved ===")
 
     # Step 1: group files into folders
-    group_files(inpath, target_events, dry_run=dry_run)
+    group_files(
+        inpath,
+        target_events,
+        dry_run=dry_run,
+        ncores=ncores,
+        strategy=opts.strategy,
+        verify=opts.verify,
+        sample_baskets=opts.sample_baskets,
+    )
 
     # Step 2: merge all chunk folders
-    logger.info("Preparing HTCondor merge jobs...")
-    merge_all_chunks_condor(inpath, submit=submit)
+    if opts.backend == "local":
+        if dry_run:
+            logger.info("[DRY RUN] Would merge the chunk folders locally")
+        else:
+            merge_all_chunks_local(inpath, ncores, opts.merger, opts.fan_in, ledger=ledger, relayout_args=relayout_args)
+    else:
+        logger.info("Preparing HTCondor merge jobs...")
+        merge_all_chunks_condor(inpath, submit=submit, ledger=ledger, relayout_args=relayout_args)
@@ -7,7 +7,6 @@
 import re
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import sys
 
 def parse_latex_scientific(s):
@@ -21,8 +20,25 @@ def parse_latex_scientific(s):
         else:
             return s
 
+def dim6top_name(tag, name, flavour=None):
+    """
+    Translate the \\ccc{tag}{name}{flavour} notation of the tables into the
+    dim6top UFO parameter names, e.g. {3}{\\varphi Q}{} -> cpQ3, {3,8}{Qq}{} -> cQq83
+    or {S}{tl}{1} -> ctlSi.
+    """
+    name = name.replace("\\varphi", "p").replace(" ", "")
+    tag = tag.replace(" ", "").replace("-", "M")
+    if "," in tag:
+        tag = "".join(reversed(tag.split(",")))
+    return f"c{name}{tag}" + ("i" if flavour else "")
+
 # --- Parse LaTeX into DataFrame ---
-def parse_latex_table(filename):
+def parse_latex_table(filename, label_format="latex"):
+    """
+    Parse one of the dim6top LaTeX tables into a DataFrame. With
+    label_format="dim6top" the operator labels are the UFO parameter names
+    (as used in configs/list_operators.yml) instead of LaTeX strings.
+    """
     with open(filename, "r", encoding="utf-8") as f:
         latex = f.read()
 
@@ -38,6 +54,8 @@ def parse_latex_table(filename):
     def repl_ccc(m):
         tag = m.group(1).strip()
         name = m.group(2).strip()
+        if label_format == "dim6top":
+            return dim6top_name(tag, name, (m.group(3) or "").strip())
         return rf"$C_{{{name}}}^{{{tag}}}$"
     content = ccc_pat.sub(repl_ccc, content)
 
@@ -86,6 +104,7 @@ def plot_with_groups(df, proc, thr, title):
     threshold: cutoff for filtering numeric values
     groups: dict mapping group name -> list of operators (row labels)
     """
+    import matplotlib.pyplot as plt
 
     values = df.apply(pd.to_numeric, errors="coerce")  # convert numeric part
 
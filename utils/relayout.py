@@ -0,0 +1,270 @@
+"""
+Rewrite merged NanoGEN files with a layout tuned for being read many
+times: compression algorithm/level, cluster (auto-flush) and basket
+sizes, and an optional allow-list of branches. The allow-list can be
+derived from the sources of a measurement (definitions, selections,
+plots), keeping only the branches and collections they refer to.
+
+Can be used from `merge_output.py` or standalone:
+    python3 relayout.py input.root output.root --algorithm lz4 --level 4 \
+        --keep-from ../measurements/ttgamma --benchmark
+"""
+import os
+import re
+import glob
+import time
+import fnmatch
+import argparse
+
+import ROOT
+
+try:
+    from utils.logger import get_logger
+except ImportError:
+    from logger import get_logger
+logger = get_logger( __name__ )
+
+COMPRESSION_ALGORITHMS = {
+    "zlib": 1,
+    "lzma": 2,
+    "lz4": 4,
+    "zstd": 5,
+}
+
+# Always kept when an allow-list is used
+DEFAULT_BRANCHES = [
+    "run",
+    "luminosityBlock",
+    "event",
+    "genWeight",
+    "LHEWeight_*",
+    "nLHEReweightingWeight",
+    "LHEReweightingWeight",
+]
+
+READ_ALL_FUNCTION = """
+Long64_t topcomb_read_all(TTree *tree) {
+    const Long64_t nentries = tree->GetEntries();
+    for (Long64_t i = 0; i < nentries; ++i) tree->GetEntry(i);
+    return nentries;
+}
+"""
+
+
+def add_parsing_options(parser=None):
+    """ Re-layout options, shared with merge_output.py """
+    standalone = parser is None
+    if standalone:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("input", help="Input ROOT file.")
+        parser.add_argument("output", help="Output ROOT file.")
+    parser.add_argument(
+        '--algorithm',
+        dest = "algorithm",
+        default = None if not standalone else "lz4",
+        choices = list(COMPRESSION_ALGORITHMS),
+        help = "Compression algorithm of the re-layout files (enables the re-layout in merge_output.py)."
+    )
+    parser.add_argument(
+        '--level',
+        dest = "level",
+        default = 4,
+        type = int,
+        help = "Compression level."
+    )
+    parser.add_argument(
+        '--auto-flush',
+        dest = "auto_flush",
+        default = -50000000,
+        type = int,
+        help = "Cluster size: number of entries if positive, bytes if negative (ROOT convention)."
+    )
+    parser.add_argument(
+        '--basket-size',
+        dest = "basket_size",
+        default = None,
+        type = int,
+        help = "Basket size in bytes (requires a ROOT version supporting it in RSnapshotOptions)."
+    )
+    parser.add_argument(
+        '--keep',
+        dest = "keep",
+        default = None,
+        nargs = "+",
+        help = "Branches to keep (wildcards allowed)."
+    )
+    parser.add_argument(
+        '--keep-from',
+        dest = "keep_from",
+        default = None,
+        nargs = "+",
+        help = "Keep only the branches used by the sources in these folders/files (e.g. measurements/ttgamma)."
+    )
+    parser.add_argument(
+        '--benchmark',
+        dest = "benchmark",
+        action = 'store_true',
+        help = "Report the read throughput of the kept branches before and after the re-layout."
+    )
+    return parser.parse_args() if standalone else parser
+
+
+def get_branches(filename, treename="Events"):
+    """ Return the branch names of a tree """
+    f = ROOT.TFile.Open(filename)
+    names = [b.GetName() for b in f.Get(treename).GetListOfBranches()]
+    f.Close()
+    return names
+
+
+def branches_from_sources(paths, all_branches):
+    """
+    Select the branches referred to in the source files: a branch is kept
+    if its name, or its collection name (e.g. GenPart for GenPart_pt),
+    appears in the sources. The counter branches of the kept collections
+    are kept as well.
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for ext in ("py", "h", "cc", "C", "yml", "yaml"):
+                sources += glob.glob(os.path.join(path, "**", f"*.{ext}"), recursive=True)
+        else:
+            sources.append(path)
+
+    tokens = set()
+    for source in sources:
+        with open(source) as f:
+            tokens.update(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", f.read()))
+
+    keep = set()
+    for branch in all_branches:
+        collection = branch.split("_")[0]
+        if branch in tokens or collection in tokens:
+            keep.add(branch)
+            if f"n{collection}" in all_branches:
+                keep.add(f"n{collection}")
+    return keep
+
+
+def select_branches(all_branches, keep=None, keep_from=None):
+    """ Build the allow-list of branches, or None to keep everything """
+    if not keep and not keep_from:
+        return None
+    patterns = DEFAULT_BRANCHES + (keep or [])
+    selected = {b for b in all_branches if any(fnmatch.fnmatch(b, p) for p in patterns)}
+    if keep_from:
+        selected |= branches_from_sources(keep_from, all_branches)
+    # Keep the original branch order
+    return [b for b in all_branches if b in selected]
+
+
+def relayout_file(
+        infile,
+        outfile,
+        algorithm="lz4",
+        level=4,
+        auto_flush=-50000000,
+        basket_size=None,
+        branches=None,
+        treename="Events"
+    ):
+    """
+    Rewrite `infile` into `outfile` with the requested compression and
+    cluster/basket sizes, keeping only `branches` of the main tree (all if
+    None). The other trees (e.g. Runs) are copied unchanged.
+    """
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fCompressionAlgorithm = COMPRESSION_ALGORITHMS[algorithm]
+    opts.fCompressionLevel = level
+    opts.fAutoFlush = auto_flush
+    if basket_size is not None:
+        if hasattr(opts, "fBasketSize"):
+            opts.fBasketSize = basket_size
+        else:
+            logger.warning("This ROOT version does not support setting the basket size, ignoring it")
+
+    df = ROOT.RDataFrame(treename, infile)
+    columns = branches if branches is not None else [str(c) for c in df.GetColumnNames()]
+    logger.info(f"Re-layout {infile} -> {outfile} ({algorithm}, level {level}, {len(columns)} branches)")
+    df.Snapshot(treename, outfile, columns, opts)
+
+    # Copy the other trees (Runs, LuminosityBlocks, ...)
+    fin = ROOT.TFile.Open(infile)
+    fout = ROOT.TFile.Open(outfile, "UPDATE")
+    for key in fin.GetListOfKeys():
+        if key.GetName() == treename or not key.GetClassName().startswith("TTree"):
+            continue
+        tree = fin.Get(key.GetName())
+        fout.cd()
+        tree.CloneTree(-1, "fast").Write()
+    fout.Close()
+    fin.Close()
+
+
+def benchmark_read(filename, branches=None, treename="Events"):
+    """ Read the `branches` (all if None) of every entry and return the throughput """
+    if not hasattr(ROOT, "topcomb_read_all"):
+        ROOT.gInterpreter.Declare(READ_ALL_FUNCTION)
+    f = ROOT.TFile.Open(filename)
+    tree = f.Get(treename)
+    if branches is not None:
+        tree.SetBranchStatus("*", 0)
+        for branch in branches:
+            tree.SetBranchStatus(branch, 1)
+    start = time.time()
+    nentries = ROOT.topcomb_read_all(tree)
+    elapsed = max(time.time() - start, 1e-9)
+    nbytes = f.GetBytesRead()
+    f.Close()
+    return {
+        "events_per_second": nentries / elapsed,
+        "mb_per_second": nbytes / 1024**2 / elapsed,
+        "seconds": elapsed,
+        "file_mb": os.path.getsize(filename) / 1024**2,
+    }
+
+
+def log_benchmark(label, result):
+    logger.info(
+        f"{label}: {result['events_per_second']:.0f} events/s, {result['mb_per_second']:.1f} MB/s read, "
+        f"{result['seconds']:.1f} s, file size {result['file_mb']:.0f} MB"
+    )
+
+
+def relayout_with_options(infile, outfile, opts, treename="Events"):
+    """ Apply the re-layout described by the parsed options, with the optional benchmark """
+    branches = select_branches(get_branches(infile, treename), opts.keep, opts.keep_from)
+    if opts.benchmark:
+        log_benchmark(f"Before re-layout ({infile})", benchmark_read(infile, branches, treename))
+    relayout_file(
+        infile,
+        outfile,
+        algorithm=opts.algorithm,
+        level=opts.level,
+        auto_flush=opts.auto_flush,
+        basket_size=opts.basket_size,
+        branches=branches,
+        treename=treename,
+    )
+    if opts.benchmark:
+        log_benchmark(f"After re-layout ({outfile})", benchmark_read(outfile, branches, treename))
+
+
+def relayout_arguments(opts):
+    """ Command line arguments reproducing the re-layout options (used in the condor wrapper) """
+    args = ["--algorithm", opts.algorithm, "--level", str(opts.level), "--auto-flush", str(opts.auto_flush)]
+    if opts.basket_size is not None:
+        args += ["--basket-size", str(opts.basket_size)]
+    if opts.keep:
+        args += ["--keep", *opts.keep]
+    if opts.keep_from:
+        args += ["--keep-from", *[os.path.abspath(p) for p in opts.keep_from]]
+    if opts.benchmark:
+        args += ["--benchmark"]
+    return args
+
+
+if __name__ == "__main__":
+    opts = add_parsing_options()
+    relayout_with_options(opts.input, opts.output, opts)